@@ -0,0 +1,83 @@
+"""Parts shared by the bots paid by the vaults for calling them on behalf of somebody else.
+
+The relayer redeems for the payoff and the keeper refunds for the bounty. Both value what a
+call pays in mutez, skip the swaps somebody else is already calling in the mempool, estimate
+the fee of every call of a batch and keep the calls paying more than their fee.
+"""
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+from pytezos.rpc.node import RpcError
+
+from atomex.vaults import TEZ_VAULT, Swap
+
+# Price of a token unit in mutez, keyed by (token address, token id)
+Prices = Dict[Tuple[str, Optional[int]], Decimal]
+# Mempool classes of operations that will never be included
+DROPPED = ('refused', 'outdated', 'branch_refused')
+
+T = TypeVar('T')
+
+
+def value_in_mutez(swap: Swap, amount: int, prices: Prices) -> Optional[int]:
+    """What `amount` of the swap asset is worth, None if it can't be valued"""
+    if swap.vault == TEZ_VAULT:
+        return amount
+    price = prices.get((swap.token_address, swap.token_id))
+    if price is None:
+        return None
+    return int(amount * price)
+
+
+def pending_calls(mempool, vaults: Dict[str, str], entrypoint: str) -> Set[bytes]:
+    """Bytes arguments of the calls to an entrypoint of the given vault addresses waiting in the mempool"""
+    addresses = set(vaults.values())
+    arguments = set()
+    for status, operations in mempool.items():
+        if status in DROPPED:
+            continue
+        for operation in operations:
+            if isinstance(operation, list):
+                operation = operation[1]
+            for content in operation.get('contents', []):
+                parameters = content.get('parameters', {})
+                if content.get('kind') != 'transaction' or content.get('destination') not in addresses \
+                        or parameters.get('entrypoint') != entrypoint:
+                    continue
+                argument = parameters.get('value', {}).get('bytes')
+                if argument:
+                    arguments.add(bytes.fromhex(argument))
+    return arguments
+
+
+def estimate_fees(client, items: List[T], call: Callable[[T], Any],
+                  on_failure: Callable[[T, RpcError], None]) -> List[Tuple[T, int]]:
+    """Estimate the fee of the call of every item within one batch.
+
+    A batch that fails to simulate is split in two until the failing calls are isolated, those
+    are dropped and handed to `on_failure`.
+    """
+    if not items:
+        return []
+    try:
+        opg = client.bulk(*[call(item) for item in items]).autofill()
+        return [(item, int(content['fee'])) for item, content in zip(items, opg.contents)]
+    except RpcError as e:
+        if len(items) == 1:
+            on_failure(items[0], e)
+            return []
+        middle = len(items) // 2
+        return estimate_fees(client, items[:middle], call, on_failure) + \
+            estimate_fees(client, items[middle:], call, on_failure)
+
+
+def select_profitable(candidates: Iterable[Tuple[T, int]], reward: Callable[[T], Optional[int]],
+                      min_profit: int = 0) -> List[T]:
+    """Keep the items whose reward exceeds their fee by at least `min_profit`, best first"""
+    profitable = []
+    for item, fee in candidates:
+        value = reward(item)
+        if value is not None and value - fee >= min_profit:
+            profitable.append((value - fee, item))
+    profitable.sort(key=lambda pair: pair[0], reverse=True)
+    return [item for _, item in profitable]
@@ -0,0 +1,498 @@
+"""Decoders specialized to a Michelson type.
+
+`MichelsonType.match(t).from_micheline_value(v).to_python_object()` builds a tree of typed
+objects and recomputes the layout of every pair and union for every value it decodes. The
+decoders here are compiled once per type into closures that read Micheline JSON (as in RPC
+receipts and big_map diffs) or forged Micheline (as in packed data and binary dumps) straight
+into the same Python objects: field names, flattening of unannotated pairs and union branch
+names are taken from pytezos when compiling. Types without a specialized reader (big_map,
+keys, lambdas, ...) fall back to pytezos for their subtree.
+
+    python -m atomex.decoder tez_vault --samples 10000
+"""
+import argparse
+import json
+import random
+from contextlib import suppress
+from datetime import datetime, timezone
+from functools import lru_cache
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pytezos.michelson.forge import forge_contract, forge_micheline, optimize_timestamp, unforge_contract, \
+    unforge_micheline
+from pytezos.michelson.format import format_timestamp
+from pytezos.michelson.types.base import MichelsonType
+from pytezos.michelson.types.core import Unit
+from pytezos.michelson.types.pair import PairType
+from pytezos.michelson.types.sum import OrType
+
+# Tags of forged Micheline nodes and the primitives values are made of
+INT, STRING, SEQUENCE, PRIM_0, PRIM_1, PRIM_2, PRIM_N, BYTES = 0, 1, 2, 3, 5, 7, 9, 10
+FALSE, ELT, LEFT, NONE, PAIR, RIGHT, SOME, TRUE, UNIT = 3, 4, 5, 6, 7, 8, 9, 10, 11
+
+JsonDecoder = Callable[[Any], Any]
+BinaryDecoder = Callable[[bytes, int], Tuple[Any, int]]
+
+
+def _strip_default(address: str) -> str:
+    return address[:-len('%default')] if address.endswith('%default') else address
+
+
+@lru_cache(maxsize=4096)
+def _address(data: bytes) -> str:
+    return _strip_default(unforge_contract(data))
+
+
+@lru_cache(maxsize=4096)
+def _address_hex(data: str) -> str:
+    return _address(bytes.fromhex(data))
+
+
+def _timestamp(value: str) -> int:
+    """Seconds of an RFC3339 time, with a fast path for the `2022-01-01T00:00:00Z` form nodes return"""
+    if len(value) == 20 and value[19] == 'Z' and value[10] == 'T':
+        with suppress(ValueError):
+            return int(datetime(int(value[:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]),
+                                int(value[14:16]), int(value[17:19]), tzinfo=timezone.utc).timestamp())
+    return optimize_timestamp(value)
+
+
+def _read_int(data: bytes, pos: int) -> Tuple[int, int]:
+    """Zarith integer at `pos`, after its tag"""
+    byte = data[pos]
+    value, shift, negative = byte & 0x3f, 6, byte & 0x40
+    pos += 1
+    while byte & 0x80:
+        byte = data[pos]
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        pos += 1
+    return (-value if negative else value), pos
+
+
+def _read_array(data: bytes, pos: int) -> Tuple[bytes, int]:
+    end = pos + 4 + int.from_bytes(data[pos:pos + 4], 'big')
+    return data[pos + 4:end], end
+
+
+def _skip(data: bytes, pos: int) -> int:
+    """End of the node at `pos`"""
+    tag = data[pos]
+    if tag == INT:
+        return _read_int(data, pos + 1)[1]
+    if tag in (STRING, SEQUENCE, BYTES):
+        return pos + 5 + int.from_bytes(data[pos + 1:pos + 5], 'big')
+    if tag == PRIM_N:
+        pos = _read_array(data, pos + 2)[1]
+        return _read_array(data, pos)[1]
+    args, annots = (tag - 3) // 2, (tag - 3) % 2
+    pos += 2
+    for _ in range(args):
+        pos = _skip(data, pos)
+    return _read_array(data, pos)[1] if annots else pos
+
+
+def _items(data: bytes, pos: int) -> Tuple[int, int, int]:
+    """Start, count and end of the comb items of a `Pair a b c ...` or `{a; b; c}` node"""
+    tag = data[pos]
+    if tag == PRIM_2:
+        start, end = pos + 2, _skip(data, pos)
+        return start, 2, end
+    if tag == PRIM_N:
+        start = pos + 6
+        args_end = start + int.from_bytes(data[pos + 2:pos + 6], 'big')
+        end = _read_array(data, args_end)[1]
+    else:
+        start = pos + 5
+        end = args_end = start + int.from_bytes(data[pos + 1:pos + 5], 'big')
+    count, item = 0, start
+    while item < args_end:
+        item = _skip(data, item)
+        count += 1
+    return start, count, end
+
+
+class Decoder:
+    """Decoder of the values of a Michelson type"""
+
+    def __init__(self, michelson_type, comparable: bool = False):
+        self.type = michelson_type
+        self.from_micheline: JsonDecoder = _json_decoder(michelson_type, comparable)
+        self._binary: BinaryDecoder = _binary_decoder(michelson_type, comparable)
+
+    def from_bytes(self, data: bytes) -> Any:
+        """Decode forged Micheline, i.e. packed data without its 05 prefix"""
+        value, end = self._binary(data, 0)
+        if end != len(data):
+            raise ValueError(f'{len(data) - end} trailing bytes')
+        return value
+
+    def unpack(self, data: bytes) -> Any:
+        if data[:1] != b'\x05':
+            raise ValueError('packed data should start with 05')
+        return self.from_bytes(data[1:])
+
+
+@lru_cache(maxsize=None)
+def _compile(type_expr: str) -> Decoder:
+    return Decoder(MichelsonType.match(json.loads(type_expr)))
+
+
+def compile_type(type_expr) -> Decoder:
+    """Decoder of a type given as Micheline, compiled once per type"""
+    return _compile(json.dumps(type_expr, sort_keys=True))
+
+
+def _fallback(cls, comparable: bool) -> Tuple[JsonDecoder, BinaryDecoder]:
+    def from_json(value):
+        return cls.from_micheline_value(value).to_python_object(comparable=comparable)
+
+    def from_binary(data, pos):
+        end = _skip(data, pos)
+        return from_json(unforge_micheline(data[pos:end])), end
+
+    return from_json, from_binary
+
+
+def _flat_names(cls, comparable: bool) -> Optional[List[str]]:
+    flat_args = cls.get_flat_args(force_tuple=comparable)
+    return list(flat_args) if isinstance(flat_args, dict) else None
+
+
+def _nested(arg) -> bool:
+    """Unannotated pairs nested in a pair are flattened into it"""
+    return issubclass(arg, PairType) and not (arg.field_name or arg.type_name)
+
+
+def _json_decoder(cls, comparable: bool = False) -> JsonDecoder:
+    prim = cls.prim
+    if prim in ('int', 'nat', 'mutez'):
+        return lambda value: int(value['int'])
+    if prim == 'string':
+        return lambda value: value['string']
+    if prim == 'bytes':
+        return lambda value: bytes.fromhex(value['bytes'])
+    if prim == 'bool':
+        return lambda value: value['prim'] == 'True'
+    if prim == 'unit':
+        return lambda value: Unit
+    if prim == 'timestamp':
+        return lambda value: int(value['int']) if 'int' in value else _timestamp(value['string'])
+    if prim == 'address':
+        return lambda value: _strip_default(value['string']) if 'string' in value \
+            else _address_hex(value['bytes'])
+    if prim == 'option':
+        item = _json_decoder(cls.args[0], comparable)
+        return lambda value: None if value['prim'] == 'None' else item(value['args'][0])
+    if prim in ('list', 'set'):
+        item = _json_decoder(cls.args[0], prim == 'set')
+        return lambda value: [item(x) for x in value]
+    if prim == 'map':
+        key, val = _json_decoder(cls.args[0], True), _json_decoder(cls.args[1])
+        return lambda value: {key(elt['args'][0]): val(elt['args'][1]) for elt in value}
+    if prim == 'pair':
+        return _json_pair(cls, comparable)
+    if prim == 'or':
+        return _json_union(cls, comparable)
+    return _fallback(cls, comparable)[0]
+
+
+def _json_collector(cls, comparable: bool) -> Callable[[Any, list], None]:
+    """Appends the flat values of a pair, given as `Pair a b`, `Pair a b c ...` or `{a; b; c ...}`"""
+    (left_nested, left), (right_nested, right) = [
+        (True, _json_collector(arg, comparable)) if _nested(arg) else (False, _json_decoder(arg, comparable))
+        for arg in cls.args
+    ]
+
+    def collect(value, out):
+        args = value['args'] if isinstance(value, dict) else value
+        rest = args[1] if len(args) == 2 else args[1:]
+        if left_nested:
+            left(args[0], out)
+        else:
+            out.append(left(args[0]))
+        if right_nested:
+            right(rest, out)
+        else:
+            out.append(right(rest))
+
+    return collect
+
+
+def _json_pair(cls, comparable: bool) -> JsonDecoder:
+    collect, names = _json_collector(cls, comparable), _flat_names(cls, comparable)
+
+    def decode(value):
+        out: list = []
+        collect(value, out)
+        return dict(zip(names, out)) if names else tuple(out)
+
+    return decode
+
+
+def _union_tree(cls, comparable: bool, names: Dict[str, str], decoders, path: str = ''):
+    """[left, right] where a branch is either a nested union or (name, decoder)"""
+    tree = []
+    for i, arg in enumerate(cls.args):
+        if issubclass(arg, OrType):
+            tree.append(_union_tree(arg, comparable, names, decoders, path + str(i)))
+        else:
+            tree.append((names[path + str(i)], decoders(arg, comparable)))
+    return tree
+
+
+def _union_names(cls) -> Dict[str, str]:
+    paths = [path for path, _ in cls.iter_type_args()]
+    return dict(zip(paths, cls.get_flat_args(infer_names=True)))
+
+
+def _json_union(cls, comparable: bool) -> JsonDecoder:
+    tree, enum = _union_tree(cls, comparable, _union_names(cls), _json_decoder), cls.is_enum
+
+    def decode(value):
+        node = tree
+        while True:
+            node = node[0 if value['prim'] == 'Left' else 1]
+            value = value['args'][0]
+            if not isinstance(node, list):
+                break
+        name, item = node
+        if enum:
+            return name
+        return (name, item(value)) if comparable else {name: item(value)}
+
+    return decode
+
+
+def _binary_decoder(cls, comparable: bool = False) -> BinaryDecoder:
+    prim = cls.prim
+    if prim in ('int', 'nat', 'mutez'):
+        return lambda data, pos: _read_int(data, pos + 1)
+    if prim == 'string':
+        def decode_string(data, pos):
+            value, pos = _read_array(data, pos + 1)
+            return value.decode(), pos
+        return decode_string
+    if prim == 'bytes':
+        return lambda data, pos: _read_array(data, pos + 1)
+    if prim == 'bool':
+        return lambda data, pos: (data[pos + 1] == TRUE, pos + 2)
+    if prim == 'unit':
+        return lambda data, pos: (Unit, pos + 2)
+    if prim == 'timestamp':
+        def decode_timestamp(data, pos):
+            if data[pos] == INT:
+                return _read_int(data, pos + 1)
+            value, pos = _read_array(data, pos + 1)
+            return _timestamp(value.decode()), pos
+        return decode_timestamp
+    if prim == 'address':
+        def decode_address(data, pos):
+            value, end = _read_array(data, pos + 1)
+            return (_address(value) if data[pos] == BYTES else _strip_default(value.decode())), end
+        return decode_address
+    if prim == 'option':
+        item = _binary_decoder(cls.args[0], comparable)
+        return lambda data, pos: (None, pos + 2) if data[pos + 1] == NONE else item(data, pos + 2)
+    if prim in ('list', 'set'):
+        item = _binary_decoder(cls.args[0], prim == 'set')
+
+        def decode_list(data, pos):
+            end = pos + 5 + int.from_bytes(data[pos + 1:pos + 5], 'big')
+            pos, items = pos + 5, []
+            while pos < end:
+                value, pos = item(data, pos)
+                items.append(value)
+            return items, end
+        return decode_list
+    if prim == 'map':
+        key, val = _binary_decoder(cls.args[0], True), _binary_decoder(cls.args[1])
+
+        def decode_map(data, pos):
+            end = pos + 5 + int.from_bytes(data[pos + 1:pos + 5], 'big')
+            pos, items = pos + 5, {}
+            while pos < end:
+                k, pos = key(data, pos + 2)
+                items[k], pos = val(data, pos)
+            return items, end
+        return decode_map
+    if prim == 'pair':
+        return _binary_pair(cls, comparable)
+    if prim == 'or':
+        return _binary_union(cls, comparable)
+    return _fallback(cls, comparable)[1]
+
+
+def _binary_collector(cls, comparable: bool):
+    """Appends the flat values of a pair, `count` is the number of comb items left inline at `pos`"""
+    parts = []
+    for arg in cls.args:
+        if _nested(arg):
+            parts.append((True, _binary_collector(arg, comparable)))
+        elif issubclass(arg, PairType):
+            parts.append((False, _binary_pair(arg, comparable)))
+        else:
+            parts.append((False, _binary_decoder(arg, comparable)))
+    (left_nested, left), (right_nested, right) = parts
+
+    def collect(data, pos, out, count=None):
+        if count is None:
+            if data[pos] == PRIM_2 and data[pos + 1] == PAIR:
+                pos, count, end = pos + 2, 2, None
+            else:
+                pos, count, end = _items(data, pos)
+        else:
+            end = None
+        if left_nested:
+            pos = left(data, pos, out)
+        else:
+            value, pos = left(data, pos)
+            out.append(value)
+        rest = None if count == 2 else count - 1
+        if right_nested:
+            pos = right(data, pos, out, rest)
+        elif rest is None:
+            value, pos = right(data, pos)
+            out.append(value)
+        else:
+            value, pos = right.inline(data, pos, rest)
+            out.append(value)
+        return pos if end is None else end
+
+    return collect
+
+
+def _binary_pair(cls, comparable: bool) -> BinaryDecoder:
+    collect, names = _binary_collector(cls, comparable), _flat_names(cls, comparable)
+
+    def inline(data, pos, count=None):
+        out: list = []
+        pos = collect(data, pos, out, count)
+        return (dict(zip(names, out)) if names else tuple(out)), pos
+
+    def decode(data, pos):
+        return inline(data, pos)
+
+    decode.inline = inline
+    return decode
+
+
+def _binary_union(cls, comparable: bool) -> BinaryDecoder:
+    tree, enum = _union_tree(cls, comparable, _union_names(cls), _binary_decoder), cls.is_enum
+
+    def decode(data, pos):
+        node = tree
+        while True:
+            node = node[0 if data[pos + 1] == LEFT else 1]
+            pos += 2
+            if not isinstance(node, list):
+                break
+        name, item = node
+        value, pos = item(data, pos)
+        if enum:
+            return name, pos
+        return ((name, value) if comparable else {name: value}), pos
+
+    return decode
+
+
+def random_value(type_expr, rng: random.Random, addresses: List[str]):
+    """Random Micheline value of a type, in the forms a node may return (readable or optimized, combs)"""
+    prim, args = type_expr['prim'], type_expr.get('args', [])
+    if prim in ('nat', 'mutez'):
+        bits = 63 if prim == 'mutez' else 80
+        return {'int': str(rng.choice((0, 1, rng.randint(0, 10 ** 6), rng.randint(0, 2 ** bits - 1))))}
+    if prim == 'int':
+        return {'int': str(rng.randint(-2 ** 40, 2 ** 40))}
+    if prim == 'string':
+        return {'string': ''.join(rng.choice('abc%_ ') for _ in range(rng.randint(0, 8)))}
+    if prim == 'bytes':
+        return {'bytes': rng.randbytes(rng.choice((0, 1, 32))).hex()}
+    if prim == 'bool':
+        return {'prim': rng.choice(('True', 'False'))}
+    if prim == 'unit':
+        return {'prim': 'Unit'}
+    if prim == 'timestamp':
+        timestamp = rng.randint(0, 2 ** 32)
+        return {'int': str(timestamp)} if rng.random() < 0.5 else {'string': format_timestamp(timestamp)}
+    if prim == 'address':
+        address = rng.choice(addresses)
+        return {'string': address} if rng.random() < 0.5 else {'bytes': forge_contract(address).hex()}
+    if prim == 'option':
+        return {'prim': 'None'} if rng.random() < 0.3 else {'prim': 'Some', 'args': [random_value(args[0], rng, addresses)]}
+    if prim == 'list':
+        return [random_value(args[0], rng, addresses) for _ in range(rng.randint(0, 3))]
+    if prim in ('set', 'map'):
+        # Keys come sorted and unique, in the order of their Michelson type
+        key_type, keys = MichelsonType.match(args[0]), {}
+        for _ in range(rng.randint(0, 3)):
+            key = random_value(args[0], rng, addresses)
+            keys[key_type.from_micheline_value(key)] = key
+        keys = [keys[typed] for typed in sorted(keys)]
+        if prim == 'set':
+            return keys
+        return [{'prim': 'Elt', 'args': [key, random_value(args[1], rng, addresses)]} for key in keys]
+    if prim == 'or':
+        side = rng.randint(0, len(args) - 1)
+        return {'prim': ('Left', 'Right')[side], 'args': [random_value(args[side], rng, addresses)]}
+    if prim == 'pair':
+        items = [random_value(arg, rng, addresses) for arg in args]
+        # Right combs may also come as `Pair a b c` or as a sequence
+        while len(items) == 2 and isinstance(items[1], dict) and items[1].get('prim') == 'Pair' \
+                and not args[-1].get('annots') and rng.random() < 0.3:
+            items = items[:1] + items[1]['args']
+        if len(items) > 2 and rng.random() < 0.5:
+            return items
+        return {'prim': 'Pair', 'args': items}
+    raise NotImplementedError(f'no random values of {prim}')
+
+
+def corpus(type_expr, samples: int, seed: int = 0, addresses: Optional[List[str]] = None) -> List[Any]:
+    rng = random.Random(seed)
+    addresses = addresses or ['tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN', 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY',
+                              'tz2K5KMSQDPaTTnX9XXZyEJFwh9Y46QyqJHf', 'KT1TjdF4H8H2qzxichtEbiCwHxCRM1SVx6B7']
+    return [random_value(type_expr, rng, addresses) for _ in range(samples)]
+
+
+def _timed(decode: Callable[[Any], Any], inputs: List[Any], rounds: int) -> Tuple[List[Any], float]:
+    """Decoded inputs and the best time of a few rounds, the first one fills the caches"""
+    best = float('inf')
+    for _ in range(rounds):
+        start = perf_counter()
+        outputs = [decode(value) for value in inputs]
+        best = min(best, perf_counter() - start)
+    return outputs, best
+
+
+def compare(type_expr, values: List[Any], rounds: int = 3) -> Dict[str, Any]:
+    """Check the decoder against pytezos on Micheline and forged values, and time both"""
+    generic, decoder = MichelsonType.match(type_expr), compile_type(type_expr)
+    forged = [forge_micheline(value) for value in values]
+    report: Dict[str, Any] = {'samples': len(values)}
+    for form, inputs, fast, slow in (
+            ('micheline', values, decoder.from_micheline,
+             lambda value: generic.from_micheline_value(value).to_python_object()),
+            ('binary', forged, decoder.from_bytes,
+             lambda data: generic.from_micheline_value(unforge_micheline(data)).to_python_object())):
+        expected, slow_time = _timed(slow, inputs, rounds)
+        actual, fast_time = _timed(fast, inputs, rounds)
+        # repr tells apart what == does not, like True and 1 or tuples and lists
+        mismatches = [i for i, (a, b) in enumerate(zip(actual, expected)) if repr(a) != repr(b)]
+        report[form] = {'mismatches': mismatches, 'pytezos': slow_time, 'decoder': fast_time,
+                        'speedup': slow_time / fast_time if fast_time else float('inf')}
+    return report
+
+
+if __name__ == '__main__':
+    from atomex.vaults import load_vault, swaps_type_exprs
+
+    parser = argparse.ArgumentParser(description='Compare the vault decoders with pytezos on random values')
+    parser.add_argument('vault', type=str, help='vault name (tez_vault, fa12_vault, fa2_vault)')
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    types = {'swap': swaps_type_exprs(args.vault)[1], 'parameter': load_vault(args.vault).context.parameter_expr['args'][0]}
+    for name, type_expr in types.items():
+        print(json.dumps({name: compare(type_expr, corpus(type_expr, args.samples, args.seed))}))
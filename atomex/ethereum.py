@@ -0,0 +1,333 @@
+"""Minimal JSON-RPC client and ABI codec for AtomexEthVault and AtomexErc20Vault.
+
+Only static ABI types are used by the vaults, so encoding is done by hand instead of
+pulling in web3. Transactions are sent with `eth_sendTransaction`, i.e. from accounts
+unlocked on the node, which is what anvil, ganache and `truffle develop` provide.
+"""
+import asyncio
+import json
+from itertools import count
+from time import sleep
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from urllib.request import Request, urlopen
+
+from atomex import metrics
+
+ETH_VAULT = 'AtomexEthVault'
+ERC20_VAULT = 'AtomexErc20Vault'
+
+# First 4 bytes of keccak256 of the function signatures
+SELECTORS = {
+    ETH_VAULT: {
+        'initiate': '0xc5f1ee15',  # initiate(bytes32,address,uint256,uint256,uint256,bool)
+        'add': '0x446bffba',  # add(bytes32)
+        'activate': '0x59db6e85',  # activate(bytes32)
+        'redeem': '0xb31597ad',  # redeem(bytes32,bytes32)
+        'refund': '0x7249fbb6',  # refund(bytes32)
+        'redeemBatch': '0x9ffcd8c7',  # redeemBatch(bytes32[],bytes32[])
+        'refundBatch': '0xacab6377',  # refundBatch(bytes32[])
+        'swaps': '0xeb84e7f2',  # swaps(bytes32)
+    },
+    ERC20_VAULT: {
+        'initiate': '0x6170a610',  # initiate(bytes32,address,address,uint256,uint256,uint256,uint256,bool)
+        # initiateWithPermit(bytes32,address,address,uint256,uint256,uint256,uint256,bool,uint256,uint8,bytes32,bytes32)
+        'initiateWithPermit': '0x63ad25f2',
+        'add': '0x5ffa4bce',  # add(bytes32,uint256)
+        'activate': '0x59db6e85',
+        'redeem': '0xb31597ad',
+        'refund': '0x7249fbb6',
+        'redeemBatch': '0x9ffcd8c7',
+        'refundBatch': '0xacab6377',
+        'swaps': '0xeb84e7f2',
+    },
+}
+APPROVE = '0x095ea7b3'  # approve(address,uint256)
+NAME = '0x06fdde03'  # name()
+NONCES = '0x7ecebe00'  # nonces(address) of EIP-2612 tokens
+AGGREGATE = '0x252dba42'  # aggregate((address,bytes)[]) of Multicall
+
+# keccak256 of the event signatures, i.e. topic 0 of the vault logs
+TOPICS = {
+    # Initiated(bytes32,address,address,uint256,uint256,uint256,uint256,bool)
+    'Initiated': '0x914f65b6104e19048e5621b3ce2305105501807246f53deaa4dd9b7facc2a703',
+    # Initiated(bytes32,address,address,address,uint256,uint256,uint256,uint256,bool)
+    'Erc20Initiated': '0x99cdc76be187c2919cca1f8a27dac6a651692095c8902fadcf1fc75539d28146',
+    # Added(bytes32,address,uint256)
+    'Added': '0xd760a88b05be4d78a2815eb20f72049b7c89e1dca4fc467139fe3f2224a37423',
+    # Activated(bytes32)
+    'Activated': '0xe1abfe35306def8dbc83e3cb0bc76ffd144cee4ab7707b4e888afd4d24c2d6ca',
+    # Redeemed(bytes32,bytes32)
+    'Redeemed': '0x489e9ee921192823d1aa1ef800c9ffc642993538b1e7e43a4d46a91965e894ab',
+    # Refunded(bytes32)
+    'Refunded': '0xfe509803c09416b28ff3d8f690c8b0c61462a892c46d5430c8fb20abe472daf0',
+}
+
+# Return values of the `swaps` getter, i.e. the packed Swap struct members in declaration order
+SWAP_FIELDS = {
+    ETH_VAULT: (
+        ('initiator', 'address'), ('refundTimestamp', 'uint64'), ('active', 'bool'), ('state', 'uint8'),
+        ('participant', 'address'), ('countdown', 'uint64'), ('value', 'uint128'), ('payoff', 'uint128'),
+    ),
+    ERC20_VAULT: (
+        ('initiator', 'address'), ('refundTimestamp', 'uint64'), ('active', 'bool'), ('state', 'uint8'),
+        ('participant', 'address'), ('countdown', 'uint64'), ('contractAddr', 'address'),
+        ('value', 'uint128'), ('payoff', 'uint128'),
+    ),
+}
+
+# Values of the State enum of the vaults
+EMPTY, INITIATED, REDEEMED, REFUNDED = range(4)
+
+
+class EthereumRpcError(Exception):
+
+    @property
+    def code(self) -> Optional[int]:
+        error = self.args[0] if self.args else None
+        return error.get('code') if isinstance(error, dict) else None
+
+    @property
+    def message(self) -> str:
+        error = self.args[0] if self.args else ''
+        return error.get('message', '') if isinstance(error, dict) else str(error)
+
+
+def _word(value: Any, abi_type: str) -> bytes:
+    if abi_type == 'address':
+        return bytes.fromhex(value[2:].lower()).rjust(32, b'\x00')
+    if abi_type == 'bool':
+        return int(bool(value)).to_bytes(32, 'big')
+    if abi_type == 'bytes32':
+        data = bytes.fromhex(value[2:]) if isinstance(value, str) else value
+        if len(data) != 32:
+            raise ValueError(f'expected 32 bytes, got {len(data)}')
+        return data
+    if abi_type.startswith('uint'):
+        return int(value).to_bytes(32, 'big')
+    raise NotImplementedError(abi_type)
+
+
+def _value(word: bytes, abi_type: str) -> Any:
+    if abi_type == 'address':
+        return '0x' + word[12:].hex()
+    if abi_type == 'bool':
+        return word != bytes(32)
+    if abi_type == 'bytes32':
+        return word
+    if abi_type.startswith('uint'):
+        return int.from_bytes(word, 'big')
+    raise NotImplementedError(abi_type)
+
+
+def topic(value: Any, abi_type: str) -> str:
+    return '0x' + _word(value, abi_type).hex()
+
+
+def encode_call(selector: str, types: Sequence[str], values: Sequence[Any]) -> str:
+    return selector + b''.join(_word(value, abi_type) for value, abi_type in zip(values, types)).hex()
+
+
+def _raw(data: Union[str, bytes]) -> bytes:
+    if isinstance(data, bytes):
+        return data
+    return bytes.fromhex(data[2:] if data.startswith('0x') else data)
+
+
+def encode_arrays(selector: str, abi_type: str, *arrays: Sequence[Any]) -> str:
+    """Calldata of a function taking only dynamic arrays of a static type"""
+    tails = [_word(len(array), 'uint256') + b''.join(_word(value, abi_type) for value in array) for array in arrays]
+    offsets, position = [], 32 * len(arrays)
+    for tail in tails:
+        offsets.append(_word(position, 'uint256'))
+        position += len(tail)
+    return selector + (b''.join(offsets) + b''.join(tails)).hex()
+
+
+def decode_words(data: Union[str, bytes], types: Sequence[str]) -> List[Any]:
+    raw = _raw(data)
+    return [_value(raw[i * 32:(i + 1) * 32], abi_type) for i, abi_type in enumerate(types)]
+
+
+def decode_string(data: Union[str, bytes]) -> str:
+    raw = _raw(data)
+    offset = int.from_bytes(raw[:32], 'big')
+    length = int.from_bytes(raw[offset:offset + 32], 'big')
+    return raw[offset + 32:offset + 32 + length].decode()
+
+
+def decode_swap(kind: str, data: Union[str, bytes]) -> Dict[str, Any]:
+    """Decode the return data of the `swaps` getter"""
+    fields = SWAP_FIELDS[kind]
+    return dict(zip((name for name, _ in fields), decode_words(data, [abi_type for _, abi_type in fields])))
+
+
+def encode_aggregate(calls: Sequence[Tuple[str, str]]) -> str:
+    """Calldata of Multicall `aggregate` for (target, calldata) pairs"""
+    items = []
+    for target, data in calls:
+        raw = _raw(data)
+        items.append(_word(target, 'address') + _word(64, 'uint256') + _word(len(raw), 'uint256')
+                     + raw.ljust((len(raw) + 31) // 32 * 32, b'\x00'))
+    offsets, position = [], 32 * len(items)
+    for item in items:
+        offsets.append(_word(position, 'uint256'))
+        position += len(item)
+    head = _word(32, 'uint256') + _word(len(items), 'uint256')
+    return AGGREGATE + (head + b''.join(offsets) + b''.join(items)).hex()
+
+
+def decode_aggregate(data: Union[str, bytes]) -> Tuple[int, List[bytes]]:
+    """Block number and return data of every call from the Multicall `aggregate` result"""
+    raw = _raw(data)
+
+    def uint(position: int) -> int:
+        return int.from_bytes(raw[position:position + 32], 'big')
+
+    array = uint(32)
+    base = array + 32
+    results = []
+    for i in range(uint(array)):
+        item = base + uint(base + 32 * i)
+        results.append(raw[item + 32:item + 32 + uint(item)])
+    return uint(0), results
+
+
+class EthereumRpc:
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url
+        self.timeout = timeout
+        self._ids = count(1)
+
+    def call(self, method: str, *params) -> Any:
+        payload = json.dumps({'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': list(params)})
+        request = Request(self.url, data=payload.encode(), headers={'Content-Type': 'application/json'})
+        metrics.rpc_requests.inc(endpoint=method)
+        with urlopen(request, timeout=self.timeout) as res:
+            response = json.loads(res.read())
+        if 'error' in response:
+            raise EthereumRpcError(response['error'])
+        return response['result']
+
+    async def acall(self, method: str, *params) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.call(method, *params))
+
+    def wait_receipt(self, tx_hash: str, poll_interval: float = 0.5, timeout: float = 120) -> Dict[str, Any]:
+        for _ in range(int(timeout / poll_interval) + 1):
+            receipt = self.call('eth_getTransactionReceipt', tx_hash)
+            if receipt:
+                if int(receipt['status'], 16) != 1:
+                    raise EthereumRpcError(f'transaction {tx_hash} reverted')
+                return receipt
+            sleep(poll_interval)
+        raise TimeoutError(f'transaction {tx_hash} is not mined')
+
+    def transact(self, sender: str, to: str, data: str, value: int = 0, wait: bool = True) -> Dict[str, Any]:
+        """Send a transaction from an unlocked account and wait for its receipt"""
+        tx_hash = self.call('eth_sendTransaction', {'from': sender, 'to': to, 'data': data, 'value': hex(value)})
+        return self.wait_receipt(tx_hash) if wait else {'transactionHash': tx_hash}
+
+
+class Vault:
+    """AtomexEthVault or AtomexErc20Vault deployed at `address`"""
+
+    def __init__(self, rpc: EthereumRpc, address: str, kind: str = ETH_VAULT):
+        self.rpc = rpc
+        self.address = address
+        self.kind = kind
+        self.selectors = SELECTORS[kind]
+
+    def initiate(self, sender: str, hashed_secret: bytes, participant: str, refund_timestamp: int,
+                 countdown: int, value: int, payoff: int, active: bool, token: Optional[str] = None):
+        if self.kind == ETH_VAULT:
+            data = encode_call(self.selectors['initiate'],
+                               ('bytes32', 'address', 'uint256', 'uint256', 'uint256', 'bool'),
+                               (hashed_secret, participant, refund_timestamp, countdown, payoff, active))
+            return self.rpc.transact(sender, self.address, data, value=value)
+        approve = encode_call(APPROVE, ('address', 'uint256'), (self.address, value))
+        self.rpc.transact(sender, token, approve)
+        data = encode_call(self.selectors['initiate'],
+                           ('bytes32', 'address', 'address', 'uint256', 'uint256', 'uint256', 'uint256', 'bool'),
+                           (hashed_secret, token, participant, refund_timestamp, countdown, value, payoff, active))
+        return self.rpc.transact(sender, self.address, data)
+
+    def sign_permit(self, owner: str, token: str, value: int, deadline: int) -> Tuple[int, bytes, bytes]:
+        """Sign an EIP-2612 permit of `value` to the vault with an account unlocked on the node"""
+        name = decode_string(self.rpc.call('eth_call', {'to': token, 'data': NAME}, 'latest'))
+        nonce_call = encode_call(NONCES, ('address',), (owner,))
+        nonce, = decode_words(self.rpc.call('eth_call', {'to': token, 'data': nonce_call}, 'latest'), ('uint256',))
+        typed_data = {
+            'types': {
+                'EIP712Domain': [{'name': 'name', 'type': 'string'}, {'name': 'version', 'type': 'string'},
+                                 {'name': 'chainId', 'type': 'uint256'}, {'name': 'verifyingContract', 'type': 'address'}],
+                'Permit': [{'name': 'owner', 'type': 'address'}, {'name': 'spender', 'type': 'address'},
+                           {'name': 'value', 'type': 'uint256'}, {'name': 'nonce', 'type': 'uint256'},
+                           {'name': 'deadline', 'type': 'uint256'}],
+            },
+            'primaryType': 'Permit',
+            'domain': {'name': name, 'version': '1', 'chainId': int(self.rpc.call('eth_chainId'), 16),
+                       'verifyingContract': token},
+            'message': {'owner': owner, 'spender': self.address, 'value': value, 'nonce': nonce, 'deadline': deadline},
+        }
+        signature = _raw(self.rpc.call('eth_signTypedData_v4', owner, json.dumps(typed_data)))
+        v = signature[64] if signature[64] >= 27 else signature[64] + 27
+        return v, signature[:32], signature[32:64]
+
+    def initiate_with_permit(self, sender: str, hashed_secret: bytes, participant: str, refund_timestamp: int,
+                             countdown: int, value: int, payoff: int, active: bool, token: str, deadline: int):
+        """Initiate an ERC-20 swap in a single transaction, the approval is signed off-chain"""
+        v, r, s = self.sign_permit(sender, token, value, deadline)
+        data = encode_call(self.selectors['initiateWithPermit'],
+                           ('bytes32', 'address', 'address', 'uint256', 'uint256', 'uint256', 'uint256', 'bool',
+                            'uint256', 'uint8', 'bytes32', 'bytes32'),
+                           (hashed_secret, token, participant, refund_timestamp, countdown, value, payoff, active,
+                            deadline, v, r, s))
+        return self.rpc.transact(sender, self.address, data)
+
+    def activate(self, sender: str, hashed_secret: bytes):
+        data = encode_call(self.selectors['activate'], ('bytes32',), (hashed_secret,))
+        return self.rpc.transact(sender, self.address, data)
+
+    def redeem(self, sender: str, hashed_secret: bytes, secret: bytes):
+        data = encode_call(self.selectors['redeem'], ('bytes32', 'bytes32'), (hashed_secret, secret))
+        return self.rpc.transact(sender, self.address, data)
+
+    def refund(self, sender: str, hashed_secret: bytes):
+        data = encode_call(self.selectors['refund'], ('bytes32',), (hashed_secret,))
+        return self.rpc.transact(sender, self.address, data)
+
+    def redeem_batch(self, sender: str, hashed_secrets: Sequence[bytes], secrets: Sequence[bytes]):
+        data = encode_arrays(self.selectors['redeemBatch'], 'bytes32', hashed_secrets, secrets)
+        return self.rpc.transact(sender, self.address, data)
+
+    def refund_batch(self, sender: str, hashed_secrets: Sequence[bytes]):
+        data = encode_arrays(self.selectors['refundBatch'], 'bytes32', hashed_secrets)
+        return self.rpc.transact(sender, self.address, data)
+
+    def swap(self, hashed_secret: bytes) -> Dict[str, Any]:
+        data = encode_call(self.selectors['swaps'], ('bytes32',), (hashed_secret,))
+        return decode_swap(self.kind, self.rpc.call('eth_call', {'to': self.address, 'data': data}, 'latest'))
+
+
+class SwapReader:
+    """Reads swaps of many hashed secrets per `eth_call` through a Multicall contract.
+
+    The calls of a batch are executed against the same block, `block` is the one of the last batch.
+    """
+
+    def __init__(self, rpc: EthereumRpc, multicall: str, batch_size: int = 500):
+        self.rpc = rpc
+        self.multicall = multicall
+        self.batch_size = batch_size
+        self.block: Optional[int] = None
+
+    def swaps(self, vault: Vault, hashed_secrets: Iterable[bytes], block: str = 'latest') -> Dict[bytes, Dict[str, Any]]:
+        hashed_secrets = list(hashed_secrets)
+        result = {}
+        for i in range(0, len(hashed_secrets), self.batch_size):
+            batch = hashed_secrets[i:i + self.batch_size]
+            data = encode_aggregate([(vault.address, encode_call(vault.selectors['swaps'], ('bytes32',), (hashed,)))
+                                     for hashed in batch])
+            self.block, returned = decode_aggregate(self.rpc.call('eth_call', {'to': self.multicall, 'data': data}, block))
+            result.update(zip(batch, (decode_swap(vault.kind, item) for item in returned)))
+        return result
@@ -0,0 +1,139 @@
+"""Indexer of the contract events emitted by the Tezos vaults.
+
+Every vault emits `%initiated` (hashed secret and the new swap), `%added` (hashed secret and
+the new total, fa12_vault and tez_vault), `%redeemed` (hashed secret and secret) and
+`%refunded` (hashed secret). Fields are named after the storage of each vault, i.e.
+`hashed_secret` in tez_vault and `hashedSecret` in the LIGO vaults. Events are internal
+operations of the receipt carrying their own type, so indexing them needs neither the vault
+script nor its big_map diffs, unlike decoding the transaction parameters and the `swaps` diff
+of every vault call (`decode_calls`, kept as the baseline of the ingestion benchmark):
+
+    python -m atomex.events KT1... KT1... -n http://localhost:20000 --from-level 100 --benchmark
+
+The gas spent on emitting is measured with `atomex.profiler` against a node, `EMIT` frames
+are reported separately.
+"""
+import argparse
+import json
+from time import perf_counter
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from atomex.decoder import compile_type
+from atomex.pool import tezos_shell
+from atomex.vaults import load_vault, swaps_types
+
+TAGS = ('initiated', 'added', 'redeemed', 'refunded')
+
+
+class VaultEvent(NamedTuple):
+    level: int
+    op_hash: Optional[str]
+    vault: str
+    tag: str
+    hashed_secret: bytes
+    payload: Any
+
+
+def _internal_results(operations: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+    for opg in operations:
+        for content in opg.get('contents', []):
+            for result in content.get('metadata', {}).get('internal_operation_results', []):
+                yield opg.get('hash'), result
+
+
+def decode_event(result: Dict[str, Any], level: int = 0, op_hash: Optional[str] = None) -> VaultEvent:
+    """Decode an event of a receipt, or of `interpret` results where the type is `event_type`"""
+    type_expr = result.get('type', result.get('event_type'))
+    payload = compile_type(type_expr).from_micheline(result['payload'])
+    if result['tag'] == 'refunded':
+        hashed_secret = payload
+    else:
+        hashed_secret = payload.get('hashed_secret', payload.get('hashedSecret'))
+    return VaultEvent(level=level,
+                      op_hash=op_hash,
+                      vault=result['source'],
+                      tag=result['tag'],
+                      hashed_secret=hashed_secret,
+                      payload=payload)
+
+
+def block_events(operations: Iterable[Dict[str, Any]], addresses: Sequence[str], level: int = 0) -> List[VaultEvent]:
+    """Events of the given vault addresses applied in a block, `operations` are its manager operations"""
+    addresses = set(addresses)
+    events = []
+    for op_hash, result in _internal_results(operations):
+        if result.get('kind') == 'event' and result.get('source') in addresses \
+                and result.get('tag') in TAGS and result.get('result', {}).get('status', 'applied') == 'applied':
+            events.append(decode_event(result, level, op_hash))
+    return events
+
+
+def decode_calls(operations: Iterable[Dict[str, Any]], vaults: Dict[str, str]) -> List[Tuple[str, Any, list]]:
+    """Baseline indexing: parameters and decoded `swaps` diff of every applied vault call.
+
+    `vaults` maps vault addresses to vault names, returns (entrypoint, parameter, diff) tuples.
+    """
+    calls = []
+    for opg in operations:
+        for content in opg.get('contents', []):
+            metadata = content.get('metadata', {})
+            results = [(content, metadata.get('operation_result', {}))]
+            results.extend((op, op.get('result', {})) for op in metadata.get('internal_operation_results', []))
+            for call, result in results:
+                vault = vaults.get(call.get('destination'))
+                if call.get('kind') != 'transaction' or vault is None or result.get('status') != 'applied':
+                    continue
+                contract = load_vault(vault)
+                entrypoint = call['parameters']['entrypoint']
+                parameter = contract.parameter.decode(call['parameters']['value'], entrypoint)[entrypoint]
+                key_type, value_type = swaps_types(vault)
+                diff = []
+                for lazy_diff in result.get('lazy_storage_diff', []):
+                    if lazy_diff['kind'] != 'big_map':
+                        continue
+                    for update in lazy_diff['diff'].get('updates', []):
+                        key = key_type.from_micheline_value(update['key']).to_python_object()
+                        value = update.get('value')
+                        if value is not None:
+                            value = value_type.from_micheline_value(value).to_python_object()
+                        diff.append((key, value))
+                calls.append((entrypoint, parameter, diff))
+    return calls
+
+
+def benchmark(operations: List[Dict[str, Any]], vaults: Dict[str, str], rounds: int = 10) -> Dict[str, float]:
+    """Seconds spent per round indexing the same operations from events and from calls"""
+    timings = {}
+    for name, index in (('events', lambda: block_events(operations, list(vaults))),
+                        ('calls', lambda: decode_calls(operations, vaults))):
+        index()  # warm the type caches
+        start = perf_counter()
+        for _ in range(rounds):
+            index()
+        timings[name] = (perf_counter() - start) / rounds
+    timings['speedup'] = timings['calls'] / timings['events'] if timings['events'] else float('inf')
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the events of Atomex Tezos vaults')
+    parser.add_argument('vaults', type=str, nargs='+', help='vault addresses')
+    parser.add_argument('-n', type=str, default='http://localhost:20000', help='node URL, or comma separated URLs of a pool')
+    parser.add_argument('--from-level', type=int, required=True)
+    parser.add_argument('--to-level', type=int, help='last level to read, the head by default')
+    parser.add_argument('--vault', type=str, action='append', default=[],
+                        help='vault name of every address (tez_vault, fa12_vault, fa2_vault), for --benchmark')
+    parser.add_argument('--benchmark', action='store_true', help='compare with decoding parameters and diffs')
+    args = parser.parse_args()
+
+    shell = tezos_shell(args.n)
+    to_level = args.to_level if args.to_level is not None else shell.head.header()['level']
+    blocks = []
+    for level in range(args.from_level, to_level + 1):
+        operations = shell.blocks[level].operations.managers()
+        blocks.extend(operations)
+        for event in block_events(operations, args.vaults, level):
+            record = {k: (f'0x{v.hex()}' if isinstance(v, bytes) else v) for k, v in event._asdict().items()}
+            print(json.dumps(record, default=str), flush=True)
+    if args.benchmark:
+        print(json.dumps(benchmark(blocks, dict(zip(args.vaults, args.vault)))))
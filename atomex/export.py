@@ -0,0 +1,247 @@
+"""Parquet export of the swap history of the Tezos and Ethereum vaults.
+
+Every vault event becomes a row of a Hive-partitioned dataset, `<root>/chain=<chain>/vault=<vault>/day=<YYYY-MM-DD>/`,
+with the swap columns filled from the initiation (kept for open swaps between runs), the
+`outcome` the event leads to and, for redeems and refunds, the latencies since initiation.
+Every run only adds files, named after the levels they cover, so earlier partitions are never
+rewritten and re-exporting a range replaces its own files with the same content:
+
+    python -m atomex.export build/history --tezos-node http://localhost:20000 --tezos-vault tez_vault=KT1...
+    python -m atomex.export build/history --ethereum-node http://localhost:8545 --ethereum-vault eth_vault=0x...
+
+Writing needs pyarrow (`poetry install -E analytics`), the datasets can be queried with pyarrow,
+DuckDB or pandas, e.g. `SELECT vault, sum(amount) FROM 'build/history/**/*.parquet' GROUP BY vault`.
+"""
+import argparse
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from decimal import Decimal
+from os.path import join
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed to write the files
+    pa = pq = None
+
+from atomex.events import VaultEvent, block_events
+from atomex.scanner import Scanner, SwapEvent, build_filters
+from atomex.vaults import TEZ_VAULT, swap_from_storage
+
+STATE_FILE = '_state.json'
+SWAP_COLUMNS = ('hashed_secret', 'initiator', 'participant', 'token', 'token_id', 'amount', 'payoff',
+                'bounty', 'refund_time', 'initiated_at')
+COLUMNS = ('chain', 'vault', 'day', 'outcome') + SWAP_COLUMNS + \
+    ('timestamp', 'level', 'tx', 'secret', 'time_to_redeem', 'time_to_close')
+OUTCOMES = ('initiated', 'added', 'redeemed', 'refunded')
+
+
+def schema():
+    if pa is None:
+        raise RuntimeError('pyarrow is required to write Parquet files, install the analytics extra')
+    amount = pa.decimal128(38, 0)
+    return pa.schema([
+        ('outcome', pa.string()),
+        ('hashed_secret', pa.binary(32)),
+        ('initiator', pa.string()),
+        ('participant', pa.string()),
+        ('token', pa.string()),
+        ('token_id', pa.int64()),
+        ('amount', amount),
+        ('payoff', amount),
+        ('bounty', amount),
+        ('refund_time', pa.timestamp('s', tz='UTC')),
+        ('initiated_at', pa.timestamp('s', tz='UTC')),
+        ('timestamp', pa.timestamp('s', tz='UTC')),
+        ('level', pa.int64()),
+        ('tx', pa.string()),
+        ('secret', pa.binary()),
+        ('time_to_redeem', pa.int64()),
+        ('time_to_close', pa.int64()),
+    ])
+
+
+def _day(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _utc(timestamp: Optional[int]) -> Optional[datetime]:
+    return None if timestamp is None else datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+class SwapExporter:
+    """Collects rows of vault events and appends them to the dataset at `root`"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.rows: List[Dict[str, Any]] = []
+        self.open: Dict[str, Dict[str, Any]] = {}
+        self.cursors: Dict[str, int] = {}
+        path = join(root, STATE_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.open = {key: dict(swap, hashed_secret=bytes.fromhex(swap['hashed_secret']))
+                         for key, swap in state['open'].items()}
+            self.cursors = state['cursors']
+
+    def event(self, chain: str, vault: str, outcome: str, hashed_secret: bytes, timestamp: int, level: int,
+              tx: Optional[str] = None, swap: Optional[Dict[str, Any]] = None, amount: Optional[int] = None,
+              secret: Optional[bytes] = None):
+        """Add the row of an event, `swap` has the swap columns of an initiation, `amount` is a new total"""
+        key = f'{chain}/{vault}/{hashed_secret.hex()}'
+        if outcome == 'initiated':
+            self.open[key] = dict(swap, hashed_secret=hashed_secret, initiated_at=timestamp)
+        known = self.open.get(key, {'hashed_secret': hashed_secret})
+        if amount is not None and 'amount' in known:
+            known['amount'] = amount
+        row = dict.fromkeys(COLUMNS)
+        row.update(known)
+        row.update(chain=chain, vault=vault, day=_day(timestamp), outcome=outcome,
+                   timestamp=timestamp, level=level, tx=tx, secret=secret)
+        if outcome in ('redeemed', 'refunded'):
+            self.open.pop(key, None)
+            if known.get('initiated_at') is not None:
+                row['time_to_close'] = timestamp - known['initiated_at']
+                if outcome == 'redeemed':
+                    row['time_to_redeem'] = row['time_to_close']
+        self.rows.append(row)
+
+    def add_tezos(self, events: Iterable[VaultEvent], vaults: Dict[str, str], timestamps: Dict[int, int]):
+        """Add Tezos vault events, `vaults` maps addresses to vault names and `timestamps` levels to times"""
+        for event in events:
+            vault = vaults[event.vault]
+            timestamp = timestamps[event.level]
+            swap, amount, secret = None, None, None
+            if event.tag == 'initiated':
+                state = event.payload if vault == TEZ_VAULT else event.payload['swap']
+                record = swap_from_storage(vault, event.hashed_secret, state)
+                swap = {'initiator': record.initiator, 'participant': record.participant,
+                        'token': record.token_address, 'token_id': record.token_id,
+                        'amount': record.redeem_amount, 'payoff': record.payoff, 'bounty': record.bounty,
+                        'refund_time': record.refund_time}
+            elif event.tag == 'added':
+                if vault == TEZ_VAULT:
+                    amount = event.payload['amount']
+                else:
+                    known = self.open.get(f'tezos/{vault}/{event.hashed_secret.hex()}', {})
+                    if known.get('payoff') is not None:
+                        amount = event.payload['totalAmount'] - known['payoff']
+            elif event.tag == 'redeemed':
+                secret = event.payload['secret']
+            self.event('tezos', vault, event.tag, event.hashed_secret, timestamp, event.level,
+                       tx=event.op_hash, swap=swap, amount=amount, secret=secret)
+
+    def add_ethereum(self, events: Iterable[SwapEvent], vaults: Dict[str, str], timestamps: Dict[int, int]):
+        """Add Ethereum vault events, `vaults` maps lowercase addresses to vault names and `timestamps` blocks to times"""
+        for event in events:
+            outcome = event.event.lower()
+            if outcome not in OUTCOMES:
+                continue
+            swap = None
+            if outcome == 'initiated':
+                swap = {'initiator': event.initiator, 'participant': event.participant, 'token': event.token,
+                        'token_id': None, 'amount': event.value, 'payoff': event.payoff,
+                        'bounty': None, 'refund_time': event.refund_timestamp}
+            self.event('ethereum', vaults.get(event.vault, event.vault), outcome, event.hashed_secret,
+                       timestamps[event.block], event.block, tx=event.tx_hash, swap=swap,
+                       amount=event.value if outcome == 'added' else None, secret=event.secret)
+
+    def flush(self) -> List[str]:
+        """Write the collected rows, one new file per partition, then the open swaps and cursors"""
+        partitions: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+        for row in self.rows:
+            partitions[(row['chain'], row['vault'], row['day'])].append(row)
+        paths = []
+        if partitions:
+            table_schema = schema()
+        for (chain, vault, day), rows in sorted(partitions.items()):
+            directory = join(self.root, f'chain={chain}', f'vault={vault}', f'day={day}')
+            os.makedirs(directory, exist_ok=True)
+            path = join(directory, f'part-{rows[0]["level"]}-{rows[-1]["level"]}.parquet')
+            columns = {name: [row[name] for row in rows] for name in table_schema.names}
+            for name in ('amount', 'payoff', 'bounty'):
+                columns[name] = [None if value is None else Decimal(value) for value in columns[name]]
+            for name in ('refund_time', 'initiated_at', 'timestamp'):
+                columns[name] = [_utc(value) for value in columns[name]]
+            pq.write_table(pa.table(columns, schema=table_schema), f'{path}.tmp', compression='zstd')
+            os.replace(f'{path}.tmp', path)
+            paths.append(path)
+
+        os.makedirs(self.root, exist_ok=True)
+        state = {'cursors': self.cursors,
+                 'open': {key: dict(swap, hashed_secret=swap['hashed_secret'].hex()) for key, swap in self.open.items()}}
+        with open(join(self.root, f'{STATE_FILE}.tmp'), 'w') as f:
+            json.dump(state, f)
+        os.replace(join(self.root, f'{STATE_FILE}.tmp'), join(self.root, STATE_FILE))
+        self.rows = []
+        return paths
+
+
+def export_tezos(exporter: SwapExporter, shell, vaults: Dict[str, str], from_level: int, to_level: int,
+                 batch: int = 1000, on_flush: Optional[Callable[[List[str]], None]] = None):
+    """Export the events of the given vault addresses, resuming after the last exported level"""
+    level = max(from_level, exporter.cursors.get('tezos', from_level - 1) + 1)
+    while level <= to_level:
+        end = min(to_level, level + batch - 1)
+        timestamps, events = {}, []
+        for current in range(level, end + 1):
+            operations = shell.blocks[current].operations.managers()
+            found = block_events(operations, list(vaults), current)
+            if found:
+                header = shell.blocks[current].header()
+                timestamps[current] = int(datetime.strptime(header['timestamp'], '%Y-%m-%dT%H:%M:%SZ')
+                                          .replace(tzinfo=timezone.utc).timestamp())
+                events.extend(found)
+        exporter.add_tezos(events, vaults, timestamps)
+        exporter.cursors['tezos'] = end
+        paths = exporter.flush()
+        if on_flush:
+            on_flush(paths)
+        level = end + 1
+
+
+def export_ethereum(exporter: SwapExporter, rpc, vaults: Dict[str, str], from_block: int, to_block: int,
+                    batch: int = 10000, on_flush: Optional[Callable[[List[str]], None]] = None):
+    """Export the events of the given lowercase vault addresses, resuming after the last exported block"""
+    scanner = Scanner(rpc, build_filters(list(vaults)))
+    block = max(from_block, exporter.cursors.get('ethereum', from_block - 1) + 1)
+    while block <= to_block:
+        end = min(to_block, block + batch - 1)
+        events = scanner.scan(block, end)
+        timestamps = {number: int(rpc.call('eth_getBlockByNumber', hex(number), False)['timestamp'], 16)
+                      for number in sorted({event.block for event in events})}
+        exporter.add_ethereum(events, vaults, timestamps)
+        exporter.cursors['ethereum'] = end
+        paths = exporter.flush()
+        if on_flush:
+            on_flush(paths)
+        block = end + 1
+
+
+if __name__ == '__main__':
+    from atomex.ethereum import EthereumRpc
+    from atomex.pool import tezos_shell
+
+    parser = argparse.ArgumentParser(description='Export the swap history of the vaults to Parquet')
+    parser.add_argument('root', type=str, help='dataset directory')
+    parser.add_argument('--tezos-node', type=str, help='node URL, or comma separated URLs of a pool')
+    parser.add_argument('--tezos-vault', type=str, action='append', default=[], help='name=address')
+    parser.add_argument('--from-level', type=int, default=0)
+    parser.add_argument('--ethereum-node', type=str)
+    parser.add_argument('--ethereum-vault', type=str, action='append', default=[], help='name=address')
+    parser.add_argument('--from-block', type=int, default=0)
+    args = parser.parse_args()
+
+    exporter = SwapExporter(args.root)
+    if args.tezos_node:
+        shell = tezos_shell(args.tezos_node)
+        vaults = {address: name for name, address in (item.split('=', 1) for item in args.tezos_vault)}
+        export_tezos(exporter, shell, vaults, args.from_level, shell.head.header()['level'], on_flush=print)
+    if args.ethereum_node:
+        rpc = EthereumRpc(args.ethereum_node)
+        vaults = {address.lower(): name for name, address in (item.split('=', 1) for item in args.ethereum_vault)}
+        export_ethereum(exporter, rpc, vaults, args.from_block, int(rpc.call('eth_blockNumber'), 16), on_flush=print)
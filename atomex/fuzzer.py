@@ -0,0 +1,413 @@
+"""Stateful fuzzer of the Tezos vaults.
+
+A case is a random sequence of initiate, add, redeem and refund calls by random accounts,
+with random amounts, payoffs, refund bounties and clock jumps. Every call is interpreted against a vault
+build and checked against a reference model of the vault: the call fails when the model
+says it must, otherwise the swaps and the transfers are the expected ones, and the vault
+holds exactly what its open swaps lock. A spent swap is gone, so it can't be redeemed or
+refunded twice. A failing case is shrunk to the fewest steps that still fail.
+
+Cases are sharded over worker processes, each of them reuses the parsed vault (see
+`atomex.replay.load_program`), and every case is reproducible from the seed of the run
+and its index:
+
+    python -m atomex.fuzzer tez_vault --cases 100000 --steps 50 --seed 7
+    python -m atomex.fuzzer tez_vault --seed 7 --case 4242
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from pytezos.michelson.parse import michelson_to_micheline
+from pytezos.michelson.types.base import MichelsonType
+
+from atomex.replay import interpret
+from atomex.vaults import (FA12_VAULT, FA2_VAULT, TEZ_VAULT, Swap, build_dir, hash_secret, load_vault,
+                           swap_from_storage, swaps_types)
+
+VAULT_ADDRESS = 'KT1BEqzn5Wx8uJrZNvuS9DVHmLvG9td3fDLi'
+ACCOUNTS = ('tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN', 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY',
+            'tz1grSQDByRpnVs7sPtaprNZRp531ZKz6Jmm', 'tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx')
+TOKENS = ('KT1PWx2mnDueood7fEmfbBDKx1D9BAnnXitn', 'KT1RJ6PbjHpwc3M5rw5s2Nbmefwbuwbdxton')
+KINDS = {
+    TEZ_VAULT: ('initiate', 'add', 'redeem', 'refund', 'wait'),
+    FA12_VAULT: ('initiate', 'add', 'redeem', 'refund', 'wait'),
+    FA2_VAULT: ('initiate', 'redeem', 'refund', 'wait'),
+}
+TRANSFER_TYPES = {
+    FA12_VAULT: 'pair address (pair address nat)',
+    FA2_VAULT: 'list (pair address (list (pair address (pair nat nat))))',
+}
+
+# (asset, from, to, amount), the asset is 'tez', a FA1.2 token address or a FA2 (address, token id)
+Transfer = Tuple[Any, str, str, int]
+
+
+class Outcome(NamedTuple):
+    failure: Optional[str]
+    hashed_secret: Optional[bytes] = None
+    swap: Optional[Swap] = None
+    transfers: Tuple[Transfer, ...] = ()
+
+
+def asset(swap: Swap):
+    if swap.vault == TEZ_VAULT:
+        return 'tez'
+    if swap.vault == FA12_VAULT:
+        return swap.token_address
+    return swap.token_address, swap.token_id
+
+
+class Model:
+    """What a vault is expected to do, independent of its code"""
+
+    def __init__(self, vault: str):
+        self.vault = vault
+        self.swaps: Dict[bytes, Swap] = {}
+
+    def expect(self, step: Dict[str, Any]) -> Outcome:
+        kind, now, sender = step['kind'], step['now'], step['sender']
+        tez = self.vault == TEZ_VAULT
+        if not tez and step['amount']:
+            return Outcome('tez sent to a token vault')
+        if kind == 'initiate':
+            hashed_secret, participant = step['hashed_secret'], step['participant']
+            if len(hashed_secret) != 32:
+                return Outcome('wrong hash size')
+            if step['refund_time'] <= now:
+                return Outcome('refund time has come')
+            if hashed_secret in self.swaps:
+                return Outcome('already initiated')
+            if tez:
+                if step['amount'] < step['payoff']:
+                    return Outcome('payoff exceeds the amount')
+                if step['amount'] < step['bounty']:
+                    return Outcome('bounty exceeds the amount')
+                swap = Swap(self.vault, hashed_secret, sender, participant, step['refund_time'],
+                            amount=step['amount'] - step['payoff'], payoff=step['payoff'], bounty=step['bounty'])
+                return Outcome(None, hashed_secret, swap, (('tez', sender, VAULT_ADDRESS, step['amount']),))
+            if participant in (sender, step['source']):
+                return Outcome('initiator acts as participant')
+            if step['bounty'] > step['total']:
+                return Outcome('bounty exceeds the total')
+            if self.vault == FA2_VAULT:
+                swap = Swap(self.vault, hashed_secret, sender, participant, step['refund_time'],
+                            amount=step['total'], token_address=step['token'], token_id=step['token_id'],
+                            bounty=step['bounty'])
+            elif step['payoff'] > step['total']:
+                return Outcome('payoff exceeds the total')
+            else:
+                swap = Swap(self.vault, hashed_secret, sender, participant, step['refund_time'],
+                            amount=step['total'], payoff=step['payoff'], token_address=step['token'],
+                            bounty=step['bounty'])
+            return Outcome(None, hashed_secret, swap, ((asset(swap), sender, VAULT_ADDRESS, step['total']),))
+
+        if kind == 'redeem':
+            if tez and step['amount']:
+                return Outcome('tez sent with redeem')
+            if len(step['secret']) != 32:
+                return Outcome('wrong secret size')
+            hashed_secret = hash_secret(step['secret'])
+        else:
+            hashed_secret = step['hashed_secret']
+        swap = self.swaps.get(hashed_secret)
+        if swap is None:
+            return Outcome('no swap')
+
+        if kind == 'add':
+            if now >= swap.refund_time:
+                return Outcome('refund time has come')
+            added = step['amount'] if tez else step['total']
+            return Outcome(None, hashed_secret, swap._replace(amount=swap.amount + added),
+                           ((asset(swap), sender, VAULT_ADDRESS, added),))
+        if kind == 'redeem':
+            if now >= swap.refund_time:
+                return Outcome('refund time has come')
+            transfers = [(asset(swap), VAULT_ADDRESS, swap.participant, swap.redeem_amount)]
+            if swap.payoff > 0:
+                transfers.append((asset(swap), VAULT_ADDRESS, sender, swap.payoff))
+            return Outcome(None, hashed_secret, None, tuple(transfers))
+        # refund
+        if tez and step['amount']:
+            return Outcome('tez sent with refund')
+        if now < swap.refund_time:
+            return Outcome('refund time has not come')
+        transfers = [(asset(swap), VAULT_ADDRESS, swap.initiator, swap.refund_amount)]
+        if swap.bounty > 0:
+            transfers.append((asset(swap), VAULT_ADDRESS, sender, swap.bounty))
+        return Outcome(None, hashed_secret, None, tuple(transfers))
+
+    def commit(self, outcome: Outcome):
+        if outcome.swap is None:
+            self.swaps.pop(outcome.hashed_secret, None)
+        else:
+            self.swaps[outcome.hashed_secret] = outcome.swap
+
+
+def random_step(rng: random.Random, vault: str, secrets: List[bytes], now: int) -> Dict[str, Any]:
+    kind = rng.choice(KINDS[vault])
+    if kind == 'wait':
+        return {'kind': kind, 'now': now + rng.choice((1, 10, 60, 600, 3600))}
+    sender = rng.choice(ACCOUNTS)
+    step = {
+        'kind': kind,
+        'now': now,
+        'sender': sender,
+        'source': sender if rng.random() < 0.8 else rng.choice(ACCOUNTS),
+        'amount': 0 if vault != TEZ_VAULT and rng.random() < 0.99 else rng.randint(0, 1000),
+    }
+    secret = rng.choice(secrets)
+    if kind == 'redeem':
+        step['secret'] = secret if rng.random() < 0.95 else secret[:31]
+        if vault == TEZ_VAULT and rng.random() < 0.9:
+            step['amount'] = 0
+        return step
+    step['hashed_secret'] = hash_secret(secret) if rng.random() < 0.95 else secret[:31]
+    if kind == 'refund' and vault == TEZ_VAULT and rng.random() < 0.9:
+        step['amount'] = 0
+    if kind in ('initiate', 'add') and vault != TEZ_VAULT:
+        step['total'] = rng.randint(0, 1000)
+    if kind == 'initiate':
+        step['participant'] = rng.choice(ACCOUNTS)
+        step['refund_time'] = now + rng.choice((-60, 0, 1, 60, 600, 3600, 86400))
+        step['payoff'] = rng.randint(0, 100) if rng.random() < 0.9 else rng.randint(0, 2000)
+        step['bounty'] = rng.randint(0, 100) if rng.random() < 0.9 else rng.randint(0, 2000)
+        step['token'] = rng.choice(TOKENS)
+        step['token_id'] = rng.randint(0, 1)
+    return step
+
+
+def random_case(vault: str, seed: int, case: int, steps: int) -> List[Dict[str, Any]]:
+    rng = random.Random(f'{seed}:{case}')
+    secrets = [rng.randbytes(32) for _ in range(4)]
+    now, sequence = 0, []
+    for _ in range(steps):
+        step = random_step(rng, vault, secrets, now)
+        now = step['now']
+        sequence.append(step)
+    return sequence
+
+
+def encode(vault: str, step: Dict[str, Any]) -> Dict[str, Any]:
+    """Parameters of a step, encoded with the vault interface"""
+    kind = step['kind']
+    if kind == 'redeem':
+        value = step['secret']
+    elif kind == 'refund':
+        value = step['hashed_secret']
+    elif vault == TEZ_VAULT and kind == 'initiate':
+        value = {key: step[key] for key in ('participant', 'hashed_secret', 'refund_time', 'payoff', 'bounty')}
+    elif vault == TEZ_VAULT:
+        value = step['hashed_secret']
+    elif kind == 'add':
+        value = {'hashedSecret': step['hashed_secret'], 'addAmount': step['total']}
+    else:
+        value = {'hashedSecret': step['hashed_secret'], 'participant': step['participant'],
+                 'refundTime': step['refund_time'], 'tokenAddress': step['token'], 'totalAmount': step['total'],
+                 'bountyAmount': step['bounty']}
+        if vault == FA12_VAULT:
+            value['payoffAmount'] = step['payoff']
+        else:
+            value['tokenId'] = step['token_id']
+    return load_vault(vault).parameter.encode({kind: value})
+
+
+class Harness:
+    """Runs the steps of a case against a vault build and its model"""
+
+    def __init__(self, vault: str, path: Optional[str] = None):
+        self.vault = vault
+        self.path = path or join(build_dir, f'{vault}.tz')
+        self.value_type = swaps_types(vault)[1]
+        self.transfer_type = MichelsonType.match(michelson_to_micheline(TRANSFER_TYPES[vault])) \
+            if vault in TRANSFER_TYPES else None
+        self.model = Model(vault)
+        self.big_map: Dict[bytes, Any] = {}
+        self.ledger: Counter = Counter()
+
+    def storage(self):
+        elements = [{'prim': 'Elt', 'args': [{'bytes': key.hex()}, value]} for key, value in sorted(self.big_map.items())]
+        return {'prim': 'Pair', 'args': [elements, {'prim': 'Unit'}]} if self.vault == TEZ_VAULT else elements
+
+    def transfers(self, operations: List[Dict[str, Any]]) -> List[Transfer]:
+        transfers = []
+        for op in operations:
+            if op.get('kind') != 'transaction':
+                continue
+            if self.transfer_type is None:
+                transfers.append(('tez', VAULT_ADDRESS, op['destination'], int(op['amount'])))
+                continue
+            value = self.transfer_type.from_micheline_value(op['parameters']['value']).to_python_object()
+            if self.vault == FA12_VAULT:
+                transfers.append((op['destination'],) + tuple(value))
+            else:
+                transfers.extend(((op['destination'], token_id), src, dst, amount)
+                                 for src, txs in value for dst, token_id, amount in txs)
+        return transfers
+
+    def call(self, step: Dict[str, Any]) -> Dict[str, Any]:
+        """Vault call of a step against the current storage, in the format of `atomex.replay`"""
+        parameters = encode(self.vault, step)
+        return {
+            'vault': self.vault,
+            'entrypoint': parameters['entrypoint'],
+            'parameter': parameters['value'],
+            'storage': self.storage(),
+            'source': step['source'],
+            'sender': step['sender'],
+            'amount': step['amount'],
+            'timestamp': step['now'],
+            'self': VAULT_ADDRESS,
+        }
+
+    def step(self, step: Dict[str, Any]) -> Optional[str]:
+        """Run a step, returns what went wrong if the vault and the model disagree"""
+        if step['kind'] == 'wait':
+            return None
+        operations, _, lazy_diff, error = interpret(self.path, self.call(step))
+        outcome = self.model.expect(step)
+        if error is not None:
+            return None if outcome.failure else f'vault failed with {error.args[-1]}, model expected success'
+        if outcome.failure:
+            return f'vault succeeded, model expected failure: {outcome.failure}'
+
+        transfers = self.transfers(operations)
+        if self.vault == TEZ_VAULT and step['amount']:
+            transfers.append(('tez', step['sender'], VAULT_ADDRESS, step['amount']))
+        if Counter(transfers) != Counter(outcome.transfers):
+            return f'transfers {sorted(transfers)}, model expected {sorted(outcome.transfers)}'
+
+        for diff in lazy_diff:
+            if diff['kind'] != 'big_map':
+                continue
+            for update in diff['diff'].get('updates', []):
+                key = bytes.fromhex(update['key']['bytes'])
+                if update.get('value') is None:
+                    self.big_map.pop(key, None)
+                else:
+                    self.big_map[key] = update['value']
+        self.model.commit(outcome)
+        for transfer_asset, src, dst, amount in transfers:
+            self.ledger[(transfer_asset, src)] -= amount
+            self.ledger[(transfer_asset, dst)] += amount
+        return self.check(outcome.hashed_secret)
+
+    def check(self, hashed_secret: bytes) -> Optional[str]:
+        if set(self.big_map) != set(self.model.swaps):
+            return f'swaps {sorted(self.big_map)}, model expected {sorted(self.model.swaps)}'
+        if hashed_secret in self.big_map:
+            state = self.value_type.from_micheline_value(self.big_map[hashed_secret]).to_python_object()
+            swap = swap_from_storage(self.vault, hashed_secret, state)
+            if swap != self.model.swaps[hashed_secret]:
+                return f'swap {swap}, model expected {self.model.swaps[hashed_secret]}'
+        locked: Counter = Counter()
+        for swap in self.model.swaps.values():
+            locked[asset(swap)] += swap.total
+        held = {key[0]: amount for key, amount in self.ledger.items() if key[1] == VAULT_ADDRESS and amount}
+        if held != {key: amount for key, amount in locked.items() if amount}:
+            return f'vault holds {held}, its swaps lock {dict(locked)}'
+        return None
+
+
+def run_case(vault: str, steps: List[Dict[str, Any]], path: Optional[str] = None) -> Optional[Tuple[int, str]]:
+    """Index and description of the first step where the vault diverges from the model, if any"""
+    harness = Harness(vault, path)
+    for i, step in enumerate(steps):
+        problem = harness.step(step)
+        if problem:
+            return i, problem
+    return None
+
+
+def record_calls(vault: str, seed: int, cases: Iterable[int], steps: int,
+                 path: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Vault calls of random cases, to replay them against another build (see `atomex.optimizer`)"""
+    for case in cases:
+        harness = Harness(vault, path)
+        for i, step in enumerate(random_case(vault, seed, case, steps)):
+            if step['kind'] == 'wait':
+                continue
+            yield dict(harness.call(step), id=f'{seed}/{case}/{i}')
+            if harness.step(step):
+                break
+
+
+def shrink(vault: str, steps: List[Dict[str, Any]], path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Drop chunks of steps as long as the case still fails (delta debugging)"""
+    failure = run_case(vault, steps, path)
+    steps = steps[:failure[0] + 1]
+    chunks = 2
+    while len(steps) > 1:
+        size = max(1, len(steps) // chunks)
+        for start in range(0, len(steps), size):
+            candidate = steps[:start] + steps[start + size:]
+            if candidate and run_case(vault, candidate, path):
+                steps = candidate
+                chunks = max(chunks - 1, 2)
+                break
+        else:
+            if size == 1:
+                break
+            chunks = min(len(steps), chunks * 2)
+    return steps
+
+
+def run_shard(vault: str, seed: int, cases: Iterable[int], steps: int,
+              path: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+    """Run cases, returns the number of steps run and the shrunk failures"""
+    total, failures = 0, []
+    for case in cases:
+        sequence = random_case(vault, seed, case, steps)
+        total += len(sequence)
+        failure = run_case(vault, sequence, path)
+        if failure:
+            shrunk = shrink(vault, sequence, path)
+            failures.append({'case': case, 'step': failure[0], 'problem': run_case(vault, shrunk, path)[1],
+                             'steps': shrunk})
+    return total, failures
+
+
+def fuzz(vault: str, cases: int, steps: int, seed: int, workers: Optional[int] = None,
+         path: Optional[str] = None, shard_size: int = 50) -> Tuple[int, List[Dict[str, Any]]]:
+    """Run cases over a pool of `workers` processes (all cores by default)"""
+    shards = [range(start, min(cases, start + shard_size)) for start in range(0, cases, shard_size)]
+    total, failures = 0, []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(run_shard, vault, seed, shard, steps, path) for shard in shards]
+        for future in futures:
+            shard_total, shard_failures = future.result()
+            total += shard_total
+            failures.extend(shard_failures)
+    return total, failures
+
+
+def dump(failure: Dict[str, Any]) -> str:
+    return json.dumps(failure, default=lambda value: value.hex() if isinstance(value, bytes) else str(value))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fuzz a Tezos vault against its reference model')
+    parser.add_argument('vault', type=str, choices=sorted(KINDS))
+    parser.add_argument('--path', type=str, help='build to fuzz, build/contracts/<vault>.tz by default')
+    parser.add_argument('--cases', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=50, help='steps per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--case', type=int, help='only run this case of the seed')
+    parser.add_argument('-j', type=int, help='number of worker processes, all cores by default')
+    args = parser.parse_args()
+
+    if args.case is not None:
+        total, failures = run_shard(args.vault, args.seed, [args.case], args.steps, args.path)
+    else:
+        total, failures = fuzz(args.vault, args.cases, args.steps, args.seed, args.j, args.path)
+    for failure in failures:
+        print(dump(failure))
+    print(json.dumps({'vault': args.vault, 'seed': args.seed, 'steps': total, 'failures': len(failures)}))
+    if failures:
+        sys.exit(1)
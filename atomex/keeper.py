@@ -0,0 +1,146 @@
+"""Refund keeper.
+
+Anyone can refund a swap once its refund time has come, and refunding pays the swap bounty
+to the sender (`bounty` of tez_vault, `bountyAmount` of fa12_vault and fa2_vault), out of
+what goes back to the initiator. The keeper follows the vault events to know the open
+swaps, and every block refunds the expired ones whose bounty covers the estimated fee,
+as a single operation group:
+
+    python -m atomex.keeper -k edsk... -n http://localhost:20000 --vault tez_vault=KT1... --from-level 100
+"""
+import argparse
+from decimal import Decimal
+from time import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pytezos.rpc.node import RpcError
+
+from atomex import metrics
+from atomex.bots import Prices, estimate_fees, pending_calls, select_profitable, value_in_mutez
+from atomex.events import VaultEvent, block_events
+from atomex.vaults import TEZ_VAULT, Swap, swap_from_storage
+
+
+class Keeper:
+
+    def __init__(self, client, vaults: Dict[str, str], prices: Optional[Prices] = None, min_profit: int = 0,
+                 max_batch: int = 50, clock: Callable[[], float] = time):
+        """
+        :param client: pytezos client with the keeper key
+        :param vaults: vault name to address
+        :param prices: token unit prices in mutez for FA1.2 and FA2 bounties
+        :param min_profit: minimal bounty minus fee, in mutez
+        """
+        self.client = client
+        self.vaults = vaults
+        self.prices = prices or {}
+        self.min_profit = min_profit
+        self.max_batch = max_batch
+        self.clock = clock
+        self.swaps: Dict[Tuple[str, bytes], Swap] = {}
+        # Last level whose events were tracked
+        self.level: Optional[int] = None
+        self._names = {address: name for name, address in vaults.items()}
+        self._contracts = {name: client.contract(address) for name, address in vaults.items()}
+
+    def track(self, events: Iterable[VaultEvent]):
+        """Update the open swaps from the vault events of a block"""
+        for event in events:
+            vault = self._names[event.vault]
+            key = (vault, event.hashed_secret)
+            if event.tag == 'initiated':
+                state = event.payload if vault == TEZ_VAULT else event.payload['swap']
+                self.swaps[key] = swap_from_storage(vault, event.hashed_secret, state)
+            elif event.tag == 'added' and key in self.swaps:
+                amount = event.payload['amount'] if vault == TEZ_VAULT else event.payload['totalAmount']
+                self.swaps[key] = self.swaps[key]._replace(amount=int(amount))
+            elif event.tag in ('redeemed', 'refunded'):
+                self.swaps.pop(key, None)
+
+    def sync(self, from_level: int, to_level: int):
+        """Track the vault events of a range of blocks, e.g. to find the swaps initiated before the keeper started"""
+        for level in range(from_level, to_level + 1):
+            operations = self.client.shell.blocks[level].operations.managers()
+            self.track(block_events(operations, list(self.vaults.values()), level))
+            self.level = level
+
+    def expired(self) -> List[Swap]:
+        """Open swaps with a bounty that can be refunded now"""
+        now = self.clock()
+        return [swap for swap in self.swaps.values() if swap.bounty > 0 and swap.refund_time <= now]
+
+    def refund_call(self, swap: Swap):
+        return self._contracts[swap.vault].refund(swap.hashed_secret)
+
+    def bounty(self, swap: Swap) -> Optional[int]:
+        """What refunding the swap pays to the sender, None if it can't be valued"""
+        return value_in_mutez(swap, swap.bounty, self.prices)
+
+    def estimate_fees(self, candidates: List[Swap]) -> List[Tuple[Swap, int]]:
+        """Estimate the fee of every refund within one batch, forgetting the swaps that fail to simulate"""
+        def forget(swap: Swap, error: RpcError):
+            # Already refunded or redeemed without the keeper seeing the event
+            metrics.track_failure(swap.vault, 'refund', error)
+            self.swaps.pop((swap.vault, swap.hashed_secret), None)
+
+        return estimate_fees(self.client, candidates, self.refund_call, forget)
+
+    def step(self):
+        """Refund every profitable expired swap not yet being refunded by somebody else, returns the operation group"""
+        candidates = self.expired()
+        if not candidates:
+            return None
+
+        pending = pending_calls(self.client.shell.mempool.pending_operations(), self.vaults, 'refund')
+        candidates = [swap for swap in candidates if swap.hashed_secret not in pending and self.bounty(swap) is not None]
+        # Only simulate the richest ones, a whole backlog would not fit in one operation group
+        candidates.sort(key=self.bounty, reverse=True)
+        candidates = candidates[:self.max_batch]
+        batch = select_profitable(self.estimate_fees(candidates), self.bounty, self.min_profit)
+        if not batch:
+            return None
+
+        try:
+            opg = self.client.bulk(*[self.refund_call(swap) for swap in batch]).send()
+        except RpcError as e:
+            for swap in batch:
+                metrics.track_failure(swap.vault, 'refund', e)
+            raise
+
+        metrics.rpc_requests.inc(endpoint='injection')
+        return opg
+
+    def run(self):
+        """Track the events of every new block, including those produced while refunding, and refund once per head"""
+        while True:
+            head = self.client.shell.head.header()['level']
+            self.sync(head if self.level is None else self.level + 1, head)
+            self.step()
+            self.client.shell.wait_next_block()
+
+
+if __name__ == '__main__':
+    from pytezos import pytezos
+
+    from atomex.pool import tezos_shell
+
+    parser = argparse.ArgumentParser(description='Refund expired swaps for their bounty')
+    parser.add_argument('-k', type=str, help='private key of the keeper')
+    parser.add_argument('-n', type=str, help='node URL, or comma separated URLs of a pool')
+    parser.add_argument('--vault', type=str, action='append', default=[], help='name=address')
+    parser.add_argument('--from-level', type=int, help='first level to look for open swaps at')
+    parser.add_argument('--price', type=str, action='append', default=[],
+                        help='token unit price in mutez, token_address[:token_id]=price')
+    parser.add_argument('--min-profit', type=int, default=0, help='minimal bounty minus fee, in mutez')
+    args = parser.parse_args()
+
+    prices: Prices = {}
+    for item in args.price:
+        token, price = item.split('=', 1)
+        address, _, token_id = token.partition(':')
+        prices[(address, int(token_id) if token_id else None)] = Decimal(price)
+    client = pytezos.using(key=args.k, shell=tezos_shell(args.n))
+    keeper = Keeper(client, dict(item.split('=', 1) for item in args.vault), prices, args.min_profit)
+    if args.from_level is not None:
+        keeper.sync(args.from_level, client.shell.head.header()['level'])
+    keeper.run()
@@ -0,0 +1,281 @@
+"""Counters and histograms for the swap tooling, exposed in Prometheus text format"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import ceil
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# FAILWITH messages of the vaults, used as the `error` label of failed operations
+VAULT_ERRORS = (
+    # tez_vault.tz
+    "participant address doesn't exist or has unsupported type",
+    "hash size doesn't equal 32 bytes",
+    'refund_time has already come',
+    'bounty exceeds the amount',
+    'payoff exceeds the amount',
+    "sender address doesn't exist or has unsupported type",
+    'swap for this hash is already initiated',
+    'no swap for such hash',
+    'can not accept tez',
+    "secret size doesn't equal 32 bytes",
+    'no swap for such secret',
+    'recipient does not exist',
+    'wrong sender address',
+    'refund_time has not come',
+    # fa12_vault.ligo, fa2_vault.ligo
+    'payoff amount exceeds the total',
+    'bounty amount exceeds the total',
+    'refund time has already come',
+    'SOURCE cannot act as participant',
+    'SENDER cannot act as participant',
+    'expected transfer entrypoint',
+    "refund time hasn't come",
+    'this contract does not accept tez',
+)
+UNKNOWN_ERROR = 'unknown'
+
+LATENCY_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+GAS_BUCKETS = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'{self.name} expects labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError('counters can only be incremented')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}_total', _format_labels(self.label_names, key), value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._sums[key] = self._sums.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - started_at, **labels)
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def sum(self, **labels) -> float:
+        return self._sums.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        names = self.label_names + ('le',)
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _format_labels(names, key + (_format_value(bound),)), cumulative
+            yield f'{self.name}_sum', _format_labels(self.label_names, key), total
+            yield f'{self.name}_count', _format_labels(self.label_names, key), cumulative
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = Registry()
+
+initiate_inclusion_seconds = registry.histogram(
+    'atomex_initiate_inclusion_seconds',
+    'Time from initiate injection to its inclusion in a block',
+    labels=('chain', 'vault'))
+redeem_injection_seconds = registry.histogram(
+    'atomex_redeem_injection_seconds',
+    'Time from the secret being seen to the redeem being injected',
+    labels=('chain', 'vault'))
+refund_inclusion_seconds = registry.histogram(
+    'atomex_refund_inclusion_seconds',
+    'Time from refund time to the refund being included in a block',
+    labels=('chain', 'vault'))
+rpc_requests = registry.counter(
+    'atomex_rpc_requests',
+    'RPC calls by endpoint',
+    labels=('endpoint',))
+gas_used = registry.histogram(
+    'atomex_gas_used',
+    'Gas consumed per vault entrypoint call',
+    labels=('vault', 'entrypoint'),
+    buckets=GAS_BUCKETS)
+failed_operations = registry.counter(
+    'atomex_failed_operations',
+    'Failed vault operations by FAILWITH message',
+    labels=('vault', 'entrypoint', 'error'))
+
+
+def failwith_message(error) -> str:
+    """Extract the FAILWITH string from an interpreter error, an RPC error or an operation result error list"""
+    if isinstance(error, BaseException):
+        error = error.args[-1] if error.args else ''
+    if isinstance(error, (list, tuple)):
+        return next((failwith_message(item) for item in reversed(error)
+                     if failwith_message(item) != UNKNOWN_ERROR), UNKNOWN_ERROR)
+    if isinstance(error, dict):
+        reason = error.get('with', {})
+        return failwith_message(reason.get('string', '')) if isinstance(reason, dict) else UNKNOWN_ERROR
+    message = str(error).strip('\'"')
+    return message if message in VAULT_ERRORS else UNKNOWN_ERROR
+
+
+def track_failure(vault: str, entrypoint: str, error):
+    failed_operations.inc(vault=vault, entrypoint=entrypoint, error=failwith_message(error))
+
+
+def track_gas(vaults: Dict[str, str], operation_group: Dict[str, Any]):
+    """Observe the gas of the applied vault calls of an included operation group, `vaults` maps addresses to names"""
+    for content in operation_group.get('contents', []):
+        metadata = content.get('metadata', {})
+        calls = [(content, metadata.get('operation_result', {}))]
+        calls.extend((op, op.get('result', {})) for op in metadata.get('internal_operation_results', []))
+        for call, result in calls:
+            vault = vaults.get(call.get('destination'))
+            if vault and call.get('kind') == 'transaction' and result.get('status') == 'applied':
+                gas_used.observe(ceil(int(result.get('consumed_milligas', 0)) / 1000),
+                                 vault=vault, entrypoint=call.get('parameters', {}).get('entrypoint', 'default'))
+
+
+class SwapTimer:
+    """Remembers when a swap phase started and observes the latency once it completes"""
+
+    def __init__(self, histogram: Histogram, clock=monotonic):
+        self.histogram = histogram
+        self.clock = clock
+        self._started: Dict[bytes, float] = {}
+
+    def start(self, hashed_secret: bytes, at: Optional[float] = None):
+        self._started.setdefault(hashed_secret, self.clock() if at is None else at)
+
+    def stop(self, hashed_secret: bytes, at: Optional[float] = None, **labels) -> Optional[float]:
+        started_at = self._started.pop(hashed_secret, None)
+        if started_at is None:
+            return None
+        elapsed = (self.clock() if at is None else at) - started_at
+        self.histogram.observe(elapsed, **labels)
+        return elapsed
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = registry
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = 9100, host: str = '127.0.0.1', metrics: Registry = registry) -> ThreadingHTTPServer:
+    """Start exposing `metrics` at http://host:port/metrics from a daemon thread"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
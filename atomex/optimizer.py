@@ -0,0 +1,326 @@
+"""Peephole optimizer for the compiled vaults.
+
+Rewrites short instruction windows into cheaper equivalents, in every code block of the
+script (branches, loop and lambda bodies, views). Every rule holds for any stack and any
+types, so it only needs the instructions themselves:
+
+    DUP; DROP                  ->                  (same for pushing a constant then dropping it)
+    SWAP; SWAP                 ->
+    DIG n; DUG n               ->                  (and DUG n; DIG n, DIG 0, DUG 0, DIP {})
+    DIG 1 / DUG 1              ->  SWAP
+    DROP n; DROP m             ->  DROP (n + m)
+    DUP; SWAP                  ->  DUP
+    DUP; CDR; SWAP; CAR        ->  UNPAIR
+    DUP n; X; DUP (n + 1); X   ->  DUP n; X; DUP   (X a pure unary instruction, e.g. a CONTRACT lookup)
+    DUP; X; SWAP; X            ->  X; DUP
+    { a; { b; c } }            ->  { a; b; c }     (blocks nested in a block, e.g. expanded macros)
+
+The output is only written when the whole test suite passes against it. Both builds run the
+calls of random fuzzer cases (see `atomex.fuzzer`), or a dump of calls (see `atomex.replay`),
+and the report tells the mean executed instructions per entrypoint before and after, and the
+mean gas when a node is given:
+
+    python -m atomex.optimizer build/contracts/fa12_vault.tz
+    python -m atomex.optimizer build/contracts/fa12_vault.tz --calls calls.jsonl -n http://localhost:20000
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+from collections import Counter
+from os.path import basename, join, splitext
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pytezos import ContractInterface
+from pytezos.michelson.forge import forge_micheline
+from pytezos.michelson.format import micheline_to_michelson
+
+from atomex.fuzzer import record_calls
+from atomex.replay import replay_all
+from atomex.vaults import build_dir, project_dir
+
+# Instructions pushing a value without reading the stack nor failing
+CONSTANTS = {'PUSH', 'UNIT', 'NIL', 'NONE', 'EMPTY_SET', 'EMPTY_MAP', 'SENDER', 'SOURCE', 'AMOUNT',
+             'BALANCE', 'NOW', 'SELF_ADDRESS', 'CHAIN_ID', 'LEVEL'}
+# Instructions replacing the top of the stack with a value depending only on it
+PURE_UNARY = {'CAR', 'CDR', 'SHA256', 'SHA512', 'BLAKE2B', 'KECCAK', 'SHA3', 'HASH_KEY', 'ADDRESS',
+              'CONTRACT', 'PACK', 'UNPACK', 'SIZE', 'ABS', 'ISNAT', 'INT', 'NEG', 'NOT', 'EQ', 'NEQ',
+              'LT', 'GT', 'LE', 'GE', 'IMPLICIT_ACCOUNT', 'SOME', 'LEFT', 'RIGHT'}
+# Arguments of control instructions that are code blocks (DIP is handled apart, its body comes
+# after an optional depth); PUSH values, types and CREATE_CONTRACT scripts are left untouched
+CODE_ARGS = {
+    'IF': (0, 1),
+    'IF_LEFT': (0, 1),
+    'IF_NONE': (0, 1),
+    'IF_CONS': (0, 1),
+    'LOOP': (0,),
+    'LOOP_LEFT': (0,),
+    'ITER': (0,),
+    'MAP': (0,),
+    'LAMBDA': (2,),
+    'LAMBDA_REC': (2,),
+}
+
+Rule = Callable[[List[Any], int], Optional[Tuple[int, List[Any]]]]
+
+
+def _is(instr, *prims) -> bool:
+    return isinstance(instr, dict) and instr.get('prim') in prims
+
+
+def _plain(instr, *prims) -> bool:
+    return _is(instr, *prims) and not instr.get('annots')
+
+
+def _n(instr, default: int = 1) -> Optional[int]:
+    """Numeric argument of DUP, DROP, DIG, DUG and DIP, None if the instruction has a code argument"""
+    args = instr.get('args', [])
+    if not args:
+        return default
+    return int(args[0]['int']) if isinstance(args[0], dict) and 'int' in args[0] else None
+
+
+def _prim(prim: str, n: Optional[int] = None) -> Dict[str, Any]:
+    return {'prim': prim, 'args': [{'int': str(n)}]} if n is not None else {'prim': prim}
+
+
+def _fails(block) -> bool:
+    """A block that pushes constants and fails, i.e. the error branch of an assertion"""
+    return isinstance(block, list) and len(block) > 0 and _is(block[-1], 'FAILWITH') \
+        and all(_is(instr, *CONSTANTS) for instr in block[:-1])
+
+
+def _unary(seq: List[Any], i: int) -> int:
+    """Length of a pure unary segment at `i`, optionally unwrapped by an IF_NONE that fails on None"""
+    if i >= len(seq) or not _is(seq[i], *PURE_UNARY):
+        return 0
+    if i + 1 < len(seq) and _is(seq[i + 1], 'IF_NONE') and _fails(seq[i + 1]['args'][0]) \
+            and seq[i + 1]['args'][1] == []:
+        return 2
+    return 1
+
+
+def drop_dup(seq, i):
+    if _is(seq[i], 'DUP', *CONSTANTS) and i + 1 < len(seq) and _plain(seq[i + 1], 'DROP') and _n(seq[i + 1]) == 1:
+        return 2, []
+
+
+def swap_swap(seq, i):
+    if _plain(seq[i], 'SWAP') and i + 1 < len(seq) and _plain(seq[i + 1], 'SWAP'):
+        return 2, []
+
+
+def dig_dug(seq, i):
+    instr = seq[i]
+    if not _plain(instr, 'DIG', 'DUG'):
+        return None
+    n = _n(instr)
+    if n == 0:
+        return 1, []
+    if n == 1:
+        return 1, [_prim('SWAP')]
+    pair = 'DUG' if instr['prim'] == 'DIG' else 'DIG'
+    if i + 1 < len(seq) and _plain(seq[i + 1], pair) and _n(seq[i + 1]) == n:
+        return 2, []
+
+
+def empty_dip(seq, i):
+    if _is(seq[i], 'DIP') and seq[i]['args'][-1] == []:
+        return 1, []
+
+
+def merge_drops(seq, i):
+    if _plain(seq[i], 'DROP') and _n(seq[i]) == 0:
+        return 1, []
+    if _plain(seq[i], 'DROP') and i + 1 < len(seq) and _plain(seq[i + 1], 'DROP'):
+        return 2, [_prim('DROP', _n(seq[i]) + _n(seq[i + 1]))]
+
+
+def dup_swap(seq, i):
+    if _is(seq[i], 'DUP') and _n(seq[i]) == 1 and i + 1 < len(seq) and _plain(seq[i + 1], 'SWAP'):
+        return 2, [seq[i]]
+
+
+def unpair(seq, i):
+    window = seq[i:i + 4]
+    if len(window) == 4 and _plain(window[0], 'DUP') and _n(window[0]) == 1 and _plain(window[1], 'CDR') \
+            and _plain(window[2], 'SWAP') and _plain(window[3], 'CAR'):
+        return 4, [_prim('UNPAIR')]
+
+
+def shared_lookup(seq, i):
+    if not _is(seq[i], 'DUP'):
+        return None
+    size = _unary(seq, i + 1)
+    if not size:
+        return None
+    x = seq[i + 1:i + 1 + size]
+    j = i + 1 + size
+    if seq[j + 1:j + 1 + size] != x:
+        return None
+    if _plain(seq[j], 'DUP') and _n(seq[j]) == _n(seq[i]) + 1:
+        return 2 + 2 * size, [seq[i]] + x + [_prim('DUP')]
+    if _n(seq[i]) == 1 and _plain(seq[j], 'SWAP'):
+        return 2 + 2 * size, x + [_prim('DUP')]
+
+
+RULES: Dict[str, Rule] = {
+    'drop_dup': drop_dup,
+    'swap_swap': swap_swap,
+    'dig_dug': dig_dug,
+    'empty_dip': empty_dip,
+    'merge_drops': merge_drops,
+    'dup_swap': dup_swap,
+    'unpair': unpair,
+    'shared_lookup': shared_lookup,
+}
+
+
+def _code_args(instr: Dict[str, Any]) -> Tuple[int, ...]:
+    """Positions of the arguments of an instruction that are code, its other arguments are data or types"""
+    args = instr.get('args', [])
+    if instr['prim'] == 'DIP':
+        return (len(args) - 1,) if args else ()
+    return CODE_ARGS.get(instr['prim'], ())
+
+
+def optimize_code(code, stats: Counter):
+    """Rewrite a code block and the blocks nested in it until no rule applies"""
+    if isinstance(code, dict):
+        positions = _code_args(code) if 'prim' in code else ()
+        if not positions:
+            return code
+        return dict(code, args=[optimize_code(arg, stats) if i in positions else arg
+                                for i, arg in enumerate(code['args'])])
+    if not isinstance(code, list):
+        return code
+    seq = []
+    for instr in map(lambda item: optimize_code(item, stats), code):
+        if isinstance(instr, list):
+            # A nested block (e.g. an expanded macro) runs as if it was inlined
+            seq.extend(instr)
+            stats['flatten'] += 1
+        else:
+            seq.append(instr)
+    changed = True
+    while changed:
+        changed = False
+        i = 0
+        while i < len(seq):
+            for name, rule in RULES.items():
+                match = rule(seq, i)
+                if match:
+                    count, replacement = match
+                    seq[i:i + count] = replacement
+                    stats[name] += 1
+                    changed = True
+                    i = max(0, i - 3)
+                    break
+            else:
+                i += 1
+    return seq
+
+
+def optimize(script: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Counter]:
+    """Optimize the code and the views of a script, returns it with the number of rewrites per rule"""
+    stats: Counter = Counter()
+    sections = []
+    for section in script:
+        if section.get('prim') == 'code':
+            section = dict(section, args=[optimize_code(section['args'][0], stats)])
+        elif section.get('prim') == 'view':
+            *head, code = section['args']
+            section = dict(section, args=head + [optimize_code(code, stats)])
+        sections.append(section)
+    return sections, stats
+
+
+def script_size(script: List[Dict[str, Any]]) -> int:
+    return len(forge_micheline(script))
+
+
+def gas_report(vault: str, current: str, candidate: str, calls: List[Dict[str, Any]],
+               node_url: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Mean executed instructions (and gas, given a node) per entrypoint of both builds,
+    fails if any call behaves differently"""
+    totals: Dict[str, Counter] = {}
+    for report in replay_all(calls, {vault: candidate}, node_url=node_url, current={vault: current}):
+        if report['divergence']:
+            raise AssertionError(f'call {report["id"]} diverged: {report["divergence"]}')
+        item = totals.setdefault(report['entrypoint'], Counter())
+        for field in ('steps', 'gas'):
+            if report.get(f'{field}_diff') is not None:
+                item[f'{field}_calls'] += 1
+                item[f'{field}_before'] += report[f'{field}_current']
+                item[f'{field}_after'] += report[f'{field}_candidate']
+    result: Dict[str, Dict[str, Any]] = {}
+    for entrypoint, item in sorted(totals.items()):
+        for field in ('steps', 'gas'):
+            calls_count = item[f'{field}_calls']
+            if calls_count:
+                result.setdefault(entrypoint, {})[field] = {'calls': calls_count,
+                                                            'before': round(item[f'{field}_before'] / calls_count, 1),
+                                                            'after': round(item[f'{field}_after'] / calls_count, 1)}
+    return result
+
+
+def run_tests() -> bool:
+    return subprocess.run([sys.executable, '-m', 'pytest', '-q'], cwd=project_dir).returncode == 0
+
+
+def install(path: str, output: str, tests: Callable[[], bool] = run_tests) -> bool:
+    """Put the optimized build in place of the vault build, keep it only if the tests pass"""
+    target = join(build_dir, basename(output))
+    backup = f'{target}.orig'
+    existed = os.path.exists(target)
+    if existed:
+        shutil.copyfile(target, backup)
+    shutil.copyfile(path, target)
+    passed = False
+    try:
+        passed = tests()
+        if passed:
+            shutil.copyfile(path, output)
+    finally:
+        if existed:
+            if not passed or os.path.abspath(target) != os.path.abspath(output):
+                shutil.copyfile(backup, target)
+            os.remove(backup)
+        elif not passed or os.path.abspath(target) != os.path.abspath(output):
+            os.remove(target)
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Optimize a compiled vault')
+    parser.add_argument('contract', type=str, help='path to the compiled vault (.tz)')
+    parser.add_argument('-o', type=str, help='output file, the input is overwritten by default')
+    parser.add_argument('--calls', type=str, help='JSON lines dump of calls to compare (see atomex.replay), '
+                                                  'random fuzzer cases by default')
+    parser.add_argument('--cases', type=int, default=50, help='fuzzer cases to compare')
+    parser.add_argument('-n', type=str, help='node URL used to measure gas')
+    args = parser.parse_args()
+
+    vault = splitext(basename(args.contract))[0]
+    script = ContractInterface.from_file(args.contract).context.script['code']
+    optimized, stats = optimize(script)
+    candidate = f'{splitext(args.contract)[0]}.opt.tz'
+    with open(candidate, 'w') as f:
+        f.write(micheline_to_michelson(optimized, inline=False) + '\n')
+
+    report = {'vault': vault, 'rewrites': dict(stats),
+              'size': {'before': script_size(script), 'after': script_size(optimized)}}
+    try:
+        if args.calls:
+            with open(args.calls) as f:
+                calls = [call for call in map(json.loads, filter(str.strip, f)) if call['vault'] == vault]
+        else:
+            calls = list(record_calls(vault, 0, range(args.cases), 25, args.contract))
+        report['entrypoints'] = gas_report(vault, args.contract, candidate, calls, args.n)
+        print(json.dumps(report, indent=2))
+        if not install(candidate, args.o or args.contract):
+            sys.exit(f'tests failed against the optimized {vault}, output not written')
+    finally:
+        os.remove(candidate)
@@ -0,0 +1,332 @@
+"""Asyncio orchestrator driving cross-chain swaps through the Tezos and Ethereum vaults.
+
+Every swap has two legs with the same hashed secret: the initiator locks funds on the
+first leg, the counterparty on the second one. The orchestrator knows the secret and
+walks each swap through
+
+    new -> initiated -> counter_initiated -> activated -> redeemed -> done
+
+redeeming the counter leg first (which reveals the secret) and then the first leg. Legs
+whose redeem window is missed are refunded instead (-> refunding -> refunded). A leg
+that is gone before its refund time was redeemed (e.g. by a relayer) and counts as such.
+A swap that keeps failing is refunded too, it is only marked as failed once no leg is
+left open. The state is persisted in SQLite after every transition and every action first checks
+the chain, so a restarted orchestrator resumes without repeating operations. Chain calls
+are blocking, they run in a pool of `concurrency` worker threads.
+
+The `amount` of a leg is everything its initiator locks, the payoff included: the tez
+sent to tez_vault, `totalAmount` of the FA vaults, `msg.value` of the Ethereum vault.
+"""
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Dict, Iterable, List, Optional
+
+from pytezos.rpc.node import RpcNotFoundError
+
+from atomex import metrics
+from atomex.ethereum import INITIATED as ETH_INITIATED, EthereumRpc, Vault
+from atomex.vaults import FA12_VAULT, TEZ_VAULT, swaps_big_map
+
+NEW = 'new'
+INITIATED = 'initiated'
+COUNTER_INITIATED = 'counter_initiated'
+ACTIVATED = 'activated'
+REDEEMED = 'redeemed'
+DONE = 'done'
+REFUNDING = 'refunding'
+REFUNDED = 'refunded'
+FAILED = 'failed'
+FINAL_STATES = (DONE, REFUNDED, FAILED)
+
+# state: (action, leg, next state)
+TRANSITIONS = {
+    NEW: ('initiate', 0, INITIATED),
+    INITIATED: ('initiate', 1, COUNTER_INITIATED),
+    COUNTER_INITIATED: ('activate', 1, ACTIVATED),
+    ACTIVATED: ('redeem', 1, REDEEMED),
+    REDEEMED: ('redeem', 0, DONE),
+}
+
+
+class SwapStore:
+    """Swaps keyed by hashed secret, each row holds the whole swap as JSON"""
+
+    def __init__(self, path: str = ':memory:'):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS swaps ('
+                        'hashed_secret TEXT PRIMARY KEY, state TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL)')
+        self.db.commit()
+
+    def add(self, swap: Dict[str, Any]) -> bool:
+        """Add a new swap, returns False if it is already known"""
+        swap.setdefault('state', NEW)
+        cursor = self.db.execute('INSERT OR IGNORE INTO swaps VALUES (?, ?, ?, ?)',
+                                 (swap['hashed_secret'], swap['state'], json.dumps(swap), time()))
+        self.db.commit()
+        return cursor.rowcount == 1
+
+    def save(self, swap: Dict[str, Any]):
+        self.db.execute('UPDATE swaps SET state = ?, data = ?, updated_at = ? WHERE hashed_secret = ?',
+                        (swap['state'], json.dumps(swap), time(), swap['hashed_secret']))
+        self.db.commit()
+
+    def get(self, hashed_secret: str) -> Optional[Dict[str, Any]]:
+        row = self.db.execute('SELECT data FROM swaps WHERE hashed_secret = ?', (hashed_secret,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def active(self) -> List[Dict[str, Any]]:
+        placeholders = ', '.join('?' * len(FINAL_STATES))
+        rows = self.db.execute(f'SELECT data FROM swaps WHERE state NOT IN ({placeholders})', FINAL_STATES)
+        return [json.loads(data) for data, in rows]
+
+
+class TezosChain:
+    """Tezos legs, `clients` are pytezos clients keyed by the address of their key.
+
+    A source can only have one manager operation per block, so the operations of a key are
+    sent one after another, each once the previous one is included.
+    """
+
+    def __init__(self, clients: Dict[str, Any], vaults: Dict[str, str]):
+        self.clients = clients
+        self.vaults = vaults
+        self._reader = next(iter(clients.values()))
+        self._names = {address: name for name, address in vaults.items()}
+        self._locks = {account: Lock() for account in clients}
+
+    def _call(self, leg, account: str, entrypoint: str, *args, **kwargs):
+        client = self.clients[account]
+        return getattr(client.contract(self.vaults[leg['vault']]), entrypoint)(*args, **kwargs)
+
+    def _send(self, account: str, call):
+        with self._locks[account]:
+            opg = call.send(min_confirmations=1)
+        metrics.track_gas(self._names, opg.opg_result)
+        return opg
+
+    def initiate(self, leg, hashed_secret: bytes):
+        client = self.clients[leg['initiator']]
+        vault_address = self.vaults[leg['vault']]
+        if leg['vault'] == TEZ_VAULT:
+            call = self._call(leg, leg['initiator'], 'initiate',
+                              participant=leg['participant'],
+                              hashed_secret=hashed_secret,
+                              refund_time=leg['refund_time'],
+                              payoff=leg['payoff'],
+                              bounty=leg.get('bounty', 0)).with_amount(leg['amount'])
+            return self._send(leg['initiator'], call)
+
+        token = client.contract(leg['token'])
+        if leg['vault'] == FA12_VAULT:
+            approve = token.approve(spender=vault_address, value=leg['amount'])
+            call = self._call(leg, leg['initiator'], 'initiate',
+                              hashedSecret=hashed_secret,
+                              participant=leg['participant'],
+                              refundTime=leg['refund_time'],
+                              tokenAddress=leg['token'],
+                              totalAmount=leg['amount'],
+                              payoffAmount=leg['payoff'],
+                              bountyAmount=leg.get('bounty', 0))
+        else:
+            approve = token.update_operators([{'add_operator': {
+                'owner': leg['initiator'], 'operator': vault_address, 'token_id': leg['token_id']}}])
+            call = self._call(leg, leg['initiator'], 'initiate',
+                              hashedSecret=hashed_secret,
+                              participant=leg['participant'],
+                              refundTime=leg['refund_time'],
+                              tokenAddress=leg['token'],
+                              tokenId=leg['token_id'],
+                              totalAmount=leg['amount'],
+                              bountyAmount=leg.get('bounty', 0))
+        return self._send(leg['initiator'], client.bulk(approve, call))
+
+    def activate(self, leg, hashed_secret: bytes):
+        pass
+
+    def redeem(self, leg, hashed_secret: bytes, secret: bytes):
+        return self._send(leg['participant'], self._call(leg, leg['participant'], 'redeem', secret))
+
+    def refund(self, leg, hashed_secret: bytes):
+        return self._send(leg['initiator'], self._call(leg, leg['initiator'], 'refund', hashed_secret))
+
+    def is_open(self, leg, hashed_secret: bytes) -> bool:
+        storage = self._reader.contract(self.vaults[leg['vault']]).storage
+        try:
+            return swaps_big_map(leg['vault'], storage)[hashed_secret]() is not None
+        except (KeyError, RpcNotFoundError):
+            return False
+
+    def now(self) -> int:
+        return int(self._reader.now())
+
+
+class EthereumChain:
+    """Ethereum legs, transactions are sent from accounts unlocked on the node"""
+
+    def __init__(self, rpc: EthereumRpc, vaults: Dict[str, str]):
+        self.rpc = rpc
+        self.vaults = {kind: Vault(rpc, address, kind) for kind, address in vaults.items()}
+
+    @staticmethod
+    def _track_gas(leg, entrypoint: str, receipt: Dict[str, Any]) -> Dict[str, Any]:
+        metrics.gas_used.observe(int(receipt['gasUsed'], 16), vault=leg['vault'], entrypoint=entrypoint)
+        return receipt
+
+    def initiate(self, leg, hashed_secret: bytes):
+        receipt = self.vaults[leg['vault']].initiate(sender=leg['initiator'],
+                                                  hashed_secret=hashed_secret,
+                                                  participant=leg['participant'],
+                                                  refund_timestamp=leg['refund_time'],
+                                                  countdown=leg.get('countdown', 0),
+                                                  value=leg['amount'],
+                                                  payoff=leg['payoff'],
+                                                  active=leg.get('active', True),
+                                                  token=leg.get('token'))
+        return self._track_gas(leg, 'initiate', receipt)
+
+    def activate(self, leg, hashed_secret: bytes):
+        vault = self.vaults[leg['vault']]
+        if not vault.swap(hashed_secret)['active']:
+            return self._track_gas(leg, 'activate', vault.activate(leg['initiator'], hashed_secret))
+
+    def redeem(self, leg, hashed_secret: bytes, secret: bytes):
+        return self._track_gas(leg, 'redeem', self.vaults[leg['vault']].redeem(leg['participant'], hashed_secret, secret))
+
+    def refund(self, leg, hashed_secret: bytes):
+        return self._track_gas(leg, 'refund', self.vaults[leg['vault']].refund(leg['initiator'], hashed_secret))
+
+    def is_open(self, leg, hashed_secret: bytes) -> bool:
+        return self.vaults[leg['vault']].swap(hashed_secret)['state'] == ETH_INITIATED
+
+    def now(self) -> int:
+        return int(self.rpc.call('eth_getBlockByNumber', 'latest', False)['timestamp'], 16)
+
+
+class Orchestrator:
+
+    def __init__(self, store: SwapStore, chains: Dict[str, Any], concurrency: int = 64,
+                 poll_interval: float = 5, max_attempts: int = 5):
+        """
+        :param store: where swap states are persisted
+        :param chains: chain adapters keyed by chain name, `tezos` and `ethereum` by default
+        :param concurrency: number of worker threads running chain calls
+        :param poll_interval: seconds between checks of a swap waiting for its refund time
+        :param max_attempts: consecutive failures after which a swap is refunded, or failed with no open leg left
+        """
+        self.store = store
+        self.chains = chains
+        self.concurrency = concurrency
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+
+    async def _chain(self, leg, method: str, *args):
+        chain = self.chains[leg['chain']]
+        return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: getattr(chain, method)(leg, *args))
+
+    async def _now(self, leg) -> int:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.chains[leg['chain']].now)
+
+    def _transition(self, swap, state: str, **fields):
+        swap.update(state=state, attempts=0, **fields)
+        self.store.save(swap)
+
+    async def step(self, swap: Dict[str, Any]) -> bool:
+        """Take the next action of a swap, returns False if it has to wait"""
+        hashed_secret = bytes.fromhex(swap['hashed_secret'])
+        if swap['state'] == REFUNDING:
+            return await self._refund(swap, hashed_secret)
+
+        action, index, next_state = TRANSITIONS[swap['state']]
+        leg = swap['legs'][index]
+        if action == 'redeem' and await self._now(leg) >= leg['refund_time']:
+            self._transition(swap, REFUNDING)
+            return True
+
+        started_at = monotonic()
+        is_open = await self._chain(leg, 'is_open', hashed_secret)
+        if action == 'initiate' and not is_open:
+            await self._chain(leg, 'initiate', hashed_secret)
+            metrics.initiate_inclusion_seconds.observe(monotonic() - started_at, chain=leg['chain'], vault=leg['vault'])
+        elif action == 'activate':
+            await self._chain(leg, 'activate', hashed_secret)
+        elif action == 'redeem' and is_open:
+            # Remember the redeem is on its way, a restart then finds the leg closed by it
+            swap['redeeming'] = index
+            self.store.save(swap)
+            await self._chain(leg, 'redeem', hashed_secret, bytes.fromhex(swap['secret']))
+            if 'revealed_at' in swap:
+                metrics.redeem_injection_seconds.observe(time() - swap['revealed_at'], chain=leg['chain'], vault=leg['vault'])
+        elif action == 'redeem' and swap.get('redeeming') != index and await self._now(leg) >= leg['refund_time']:
+            # Gone once it could be refunded, what is left of the swap has to be refunded too
+            self._transition(swap, REFUNDING, error=f'leg {index} is no longer open')
+            return True
+
+        fields = {'revealed_at': time()} if next_state == REDEEMED else {}
+        self._transition(swap, next_state, **fields)
+        return True
+
+    async def _refund(self, swap, hashed_secret: bytes) -> bool:
+        waiting = False
+        for leg in swap['legs']:
+            if not await self._chain(leg, 'is_open', hashed_secret):
+                continue
+            now = await self._now(leg)
+            if now < leg['refund_time']:
+                waiting = True
+                continue
+            await self._chain(leg, 'refund', hashed_secret)
+            metrics.refund_inclusion_seconds.observe(max(0, now - leg['refund_time']), chain=leg['chain'], vault=leg['vault'])
+        if waiting:
+            return False
+        self._transition(swap, REFUNDED)
+        return True
+
+    async def _give_up(self, swap):
+        """Refund a swap that keeps failing, only a swap with no open leg left is failed"""
+        hashed_secret = bytes.fromhex(swap['hashed_secret'])
+        try:
+            is_open = any([await self._chain(leg, 'is_open', hashed_secret) for leg in swap['legs']])
+        except Exception:
+            is_open = True  # can't tell, keep trying to get the funds back
+        swap.update(state=REFUNDING if is_open else FAILED, attempts=0)
+
+    async def drive(self, swap: Dict[str, Any]):
+        """Advance a swap until it reaches a final state"""
+        while swap['state'] not in FINAL_STATES:
+            try:
+                if not await self.step(swap):
+                    await asyncio.sleep(self.poll_interval)
+            except Exception as e:
+                swap['attempts'] = swap.get('attempts', 0) + 1
+                swap['error'] = str(e)
+                action, index, _ = TRANSITIONS.get(swap['state'], ('refund', 0, None))
+                metrics.track_failure(swap['legs'][index]['vault'], action, e)
+                if swap['attempts'] >= self.max_attempts:
+                    await self._give_up(swap)
+                self.store.save(swap)
+                await asyncio.sleep(self.poll_interval * min(2 ** swap['attempts'], 64))
+
+    async def run(self, swaps: Iterable[Dict[str, Any]] = ()):
+        """Register new swaps and drive them together with every unfinished swap of the store"""
+        for swap in swaps:
+            self.store.add(swap)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            await asyncio.gather(*(self.drive(swap) for swap in self.store.active()))
+        finally:
+            self.executor.shutdown()
+
+
+def default_chains(tezos_clients: Dict[str, Any], tezos_vaults: Dict[str, str],
+                   ethereum_url: str, ethereum_vaults: Dict[str, str]) -> Dict[str, Any]:
+    """Chain adapters for a Tezos node (e.g. a sandbox) and an Ethereum node (e.g. anvil or ganache)"""
+    return {
+        'tezos': TezosChain(tezos_clients, tezos_vaults),
+        'ethereum': EthereumChain(EthereumRpc(ethereum_url), ethereum_vaults),
+    }
+
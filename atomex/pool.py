@@ -0,0 +1,194 @@
+"""Pool of Tezos nodes scored by latency and head level.
+
+Reads are spread over healthy nodes in inverse proportion to their latency, a node is healthy
+when it answers and its head is at most `max_lag` levels behind the highest head of the pool.
+When the answer takes longer than the `hedge_quantile` latency of that node, the same request
+is sent to another healthy node and the first answer wins. Injections are never duplicated,
+they are pinned to the best node at the current head and only move when that node falls
+behind or fails. The pool is a pytezos `RpcNode`, so it plugs into any client:
+
+    pytezos.using(shell=tezos_shell('http://node-1:8732,http://node-2:8732'))
+"""
+import random
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from time import monotonic
+from typing import Deque, List, Optional
+
+import requests
+from pytezos import pytezos
+from pytezos.rpc.node import RpcNode
+from pytezos.rpc.shell import ShellQuery
+
+HEAD_PATH = '/chains/main/blocks/head/header'
+INJECTION_PREFIX = '/injection/'
+MIN_LATENCY = 0.001
+
+
+class NodeHealth:
+    """Latency window, head level and failures of a node"""
+
+    def __init__(self, uri: str, window: int = 100):
+        self.node = RpcNode(uri)
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.level: Optional[int] = None
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def uri(self) -> str:
+        return self.node.uri[0]
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def score(self) -> float:
+        """Expected latency, failures make a node look slower (lower is better)"""
+        median = self.quantile(0.5) or 0.0
+        return median * (1 + self.failures)
+
+    def succeeded(self, latency: float):
+        self.latencies.append(latency)
+        self.failures = 0
+
+    def failed(self, latency: float, cooldown: float):
+        self.latencies.append(latency)
+        self.failures += 1
+        self.retry_at = monotonic() + cooldown * min(self.failures, 10)
+
+
+class NoHealthyNode(Exception):
+    pass
+
+
+class RpcPool(RpcNode):
+
+    def __init__(self, uris: List[str], max_lag: int = 2, hedge_quantile: float = 0.95,
+                 hedge_delay: float = 1.0, min_samples: int = 10, head_interval: float = 5.0,
+                 head_timeout: float = 2.0, cooldown: float = 5.0, window: int = 100, workers: int = 16):
+        super().__init__(uris)
+        self.nodes = [NodeHealth(uri, window) for uri in self.uri]
+        self.max_lag = max_lag
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.head_interval = head_interval
+        self.head_timeout = head_timeout
+        self.cooldown = cooldown
+        self.pinned: Optional[NodeHealth] = None
+        self._refreshed_at: Optional[float] = None
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = Lock()
+
+    def __repr__(self) -> str:
+        return '\n'.join([object.__repr__(self), '\nNodes'] +
+                         [f'{n.uri} level={n.level} p50={n.quantile(0.5)} failures={n.failures}' for n in self.nodes])
+
+    @property
+    def head(self) -> Optional[int]:
+        levels = [node.level for node in self.nodes if node.level is not None]
+        return max(levels) if levels else None
+
+    def _call(self, node: NodeHealth, method: str, path: str, **kwargs):
+        start = monotonic()
+        try:
+            res = node.node.request(method, path, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                node.failed(monotonic() - start, self.cooldown)
+            raise
+        except Exception:
+            # The node answered, with an error of the request itself
+            with self._lock:
+                node.succeeded(monotonic() - start)
+            raise
+        with self._lock:
+            node.succeeded(monotonic() - start)
+        return res
+
+    def refresh(self):
+        """Update the head level of every node, nodes that don't answer in time keep no level"""
+        futures = {self._executor.submit(self._call, node, 'GET', HEAD_PATH, timeout=self.head_timeout): node
+                   for node in self.nodes}
+        done, _ = wait(futures, timeout=self.head_timeout)
+        for future, node in futures.items():
+            if future in done and future.exception() is None:
+                node.level = future.result().json()['level']
+            else:
+                node.level = None
+        self._refreshed_at = monotonic()
+
+    def _maybe_refresh(self):
+        if self._refreshed_at is None or monotonic() - self._refreshed_at > self.head_interval:
+            self.refresh()
+
+    def healthy(self, at_head: bool = False) -> List[NodeHealth]:
+        """Responsive nodes within `max_lag` of the head (exactly at it if `at_head`), best first"""
+        head, now = self.head, monotonic()
+        lag = 0 if at_head else self.max_lag
+        nodes = [node for node in self.nodes
+                 if node.level is not None and node.level >= head - lag and node.retry_at <= now]
+        return sorted(nodes, key=NodeHealth.score)
+
+    def _pick(self, nodes: List[NodeHealth]) -> NodeHealth:
+        """Random node, the share of each one is inversely proportional to its score"""
+        return random.choices(nodes, weights=[1 / max(node.score(), MIN_LATENCY) for node in nodes])[0]
+
+    def _hedge_delay(self, node: NodeHealth) -> float:
+        if len(node.latencies) < self.min_samples:
+            return self.hedge_delay
+        return node.quantile(self.hedge_quantile)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        self._maybe_refresh()
+        if method == 'POST' and path.startswith(INJECTION_PREFIX):
+            return self._inject(method, path, **kwargs)
+
+        candidates = self.healthy()
+        if not candidates:
+            raise NoHealthyNode(f'no node of {self.uri} is healthy')
+        first = self._pick(candidates)
+        pending = {self._executor.submit(self._call, first, method, path, **kwargs)}
+        backups = [node for node in candidates if node is not first]
+        timeout: Optional[float] = self._hedge_delay(first)
+        error: Optional[Exception] = None
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except requests.RequestException as e:
+                    error = e
+            if backups and (not done or not pending):
+                # Too slow, or failed with nothing else in flight
+                pending.add(self._executor.submit(self._call, backups.pop(0), method, path, **kwargs))
+            timeout = self._hedge_delay(first) if backups else None
+        raise error
+
+    def _inject(self, method: str, path: str, **kwargs) -> requests.Response:
+        self.refresh()
+        candidates = self.healthy(at_head=True)
+        if self.pinned in candidates:
+            candidates.remove(self.pinned)
+            candidates.insert(0, self.pinned)
+        error: Optional[Exception] = NoHealthyNode(f'no node of {self.uri} is at the head')
+        for node in candidates:
+            try:
+                res = self._call(node, method, path, **kwargs)
+            except requests.RequestException as e:
+                error = e
+                continue
+            self.pinned = node
+            return res
+        raise error
+
+
+def tezos_shell(uris: str) -> ShellQuery:
+    """Shell of a single node, or of a pool of comma separated nodes"""
+    if ',' not in uris:
+        return pytezos.using(shell=uris).shell
+    return ShellQuery(node=RpcPool(uris.split(',')))
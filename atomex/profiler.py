@@ -0,0 +1,219 @@
+"""Per-instruction gas profiler for the vaults.
+
+The builtin pytezos interpreter does not account gas, so a call is traced by a node
+(`helpers/scripts/trace_code`, a sandbox is enough) and every trace step is mapped back
+to the Michelson instruction at its location. Reports are written in the folded stack
+format understood by flamegraph.pl, speedscope and inferno:
+
+    python -m atomex.profiler build/contracts/tez_vault.tz redeem '0xdca1...' \\
+        --storage 'Pair {} Unit' -n http://localhost:20000 > redeem.folded
+
+Running the test suite with `pytest --profile-gas http://localhost:20000` profiles every
+successful `interpret` call of the tests the same way.
+"""
+import argparse
+from collections import Counter
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pytezos import ContractInterface, pytezos
+from pytezos.contract.call import ContractCall
+from pytezos.michelson.parse import michelson_to_micheline
+from pytezos.michelson.sections.storage import StorageSection
+from pytezos.operation.content import format_mutez
+
+STARTUP_FRAME = '[startup]'
+DEFAULT_GAS_LIMIT = 1040000
+
+# Labels of the branches of control instructions, in the order of their arguments
+BRANCHES = {
+    'IF': ('true', 'false'),
+    'IF_LEFT': ('left', 'right'),
+    'IF_NONE': ('none', 'some'),
+    'IF_CONS': ('cons', 'nil'),
+}
+BODIES = {'DIP', 'LOOP', 'LOOP_LEFT', 'ITER', 'MAP', 'LAMBDA', 'LAMBDA_REC', 'CREATE_CONTRACT'}
+
+Frames = Tuple[str, ...]
+
+
+def _entrypoint(node) -> Optional[str]:
+    return next((annot[1:] for annot in node.get('annots', []) if annot.startswith('%')), None)
+
+
+def index_locations(script: List[Dict[str, Any]]) -> Dict[int, Tuple[str, Frames]]:
+    """Map every node location of a script to its primitive and the control frames around it.
+
+    Locations are numbered in pre-order starting from the script root, the same way the node does.
+    IF_LEFT branches mirroring the `or` tree of the parameter are named after the entrypoints,
+    which labels the dispatch of both the hand-written and the LIGO-compiled vaults.
+    """
+    index: Dict[int, Tuple[str, Frames]] = {}
+    locations = iter(range(1 << 62))
+    parameter = next((section['args'][0] for section in script if section.get('prim') == 'parameter'), None)
+
+    def walk(node, frames: Frames, dispatch):
+        location = next(locations)
+        if isinstance(node, list):
+            for item in node:
+                dispatch = walk(item, frames, dispatch)
+            return dispatch
+        if not isinstance(node, dict) or 'prim' not in node:
+            return dispatch
+
+        prim, args = node['prim'], node.get('args', [])
+        index[location] = (prim, frames)
+        if prim.islower():
+            for arg in args:
+                walk(arg, frames + (prim,), dispatch if prim == 'code' else None)
+        elif prim == 'IF_LEFT' and isinstance(dispatch, dict) and dispatch.get('prim') == 'or':
+            for arg, param, label in zip(args, dispatch['args'], BRANCHES[prim]):
+                walk(arg, frames + (_entrypoint(param) or f'{prim}:{label}',), param)
+            return None
+        elif prim in BRANCHES:
+            for arg, label in zip(args, BRANCHES[prim]):
+                walk(arg, frames + (f'{prim}:{label}',), dispatch)
+        else:
+            for arg in args:
+                walk(arg, frames + (prim,) if prim in BODIES else frames, None)
+        return dispatch
+
+    walk(script, (), parameter)
+    return index
+
+
+def attribute(trace: Iterable[Dict[str, Any]], index: Dict[int, Tuple[str, Frames]],
+              gas_limit=DEFAULT_GAS_LIMIT) -> Counter:
+    """Sum the gas spent by every instruction of a trace, keyed by frames.
+
+    Each trace step carries the gas remaining after the instruction at its location was executed,
+    so the difference with the previous step is the cost of that instruction. Gas consumed up to the
+    first step (deserialization and typechecking included) is put under the startup frame.
+    """
+    report: Counter = Counter()
+    remaining = Decimal(gas_limit)
+    for i, step in enumerate(trace):
+        if step.get('gas') in (None, 'unaccounted'):
+            continue
+        gas = Decimal(step['gas'])
+        if i == 0:
+            key: Frames = (STARTUP_FRAME,)
+        else:
+            prim, frames = index.get(step['location'], ('?', ()))
+            key = frames + (f'{prim}@{step["location"]}',)
+        report[key] += remaining - gas
+        remaining = gas
+    return report
+
+
+def folded(report: Counter, root: str = '') -> str:
+    """Render a report as folded stacks, in milligas so that every sample is an integer"""
+    lines = []
+    for frames, gas in sorted(report.items()):
+        path = ';'.join(((root,) if root else ()) + frames)
+        lines.append(f'{path} {int(gas * 1000)}')
+    return ''.join(line + '\n' for line in lines)
+
+
+def trace_code(shell, script, entrypoint, parameter, storage, source=None, sender=None, amount=0,
+               balance=0, now=None, level=None, gas_limit=DEFAULT_GAS_LIMIT) -> Dict[str, Any]:
+    """Run Micheline script, parameter and storage through the node and return the result with the trace"""
+    query = {
+        'script': script,
+        'storage': storage,
+        'entrypoint': entrypoint,
+        'input': parameter,
+        'amount': format_mutez(amount or 0),
+        'balance': format_mutez(balance or 0),
+        'chain_id': shell.chains.main.chain_id(),
+        'gas': str(gas_limit),
+    }
+    if sender or source:
+        query['source'] = sender or source
+    if source:
+        query['payer'] = source
+    if now is not None:
+        query['now'] = str(now)
+    if level is not None:
+        query['level'] = str(level)
+    return shell.blocks.head.helpers.scripts.trace_code.post(query)
+
+
+def profile(call: ContractCall, shell, storage=None, source=None, sender=None, amount=None, balance=None,
+            now=None, level=None, gas_limit=DEFAULT_GAS_LIMIT) -> Counter:
+    """Profile a contract call, takes the same context arguments as `ContractCall.interpret`"""
+    storage_ty = StorageSection.match(call.context.storage_expr)
+    if storage is None:
+        initial_storage = storage_ty.dummy(call.context).to_micheline_value(lazy_diff=True)
+    else:
+        initial_storage = storage_ty.from_python_object(storage).to_micheline_value(lazy_diff=True)
+    script = call.context.script['code']
+    res = trace_code(shell, script,
+                     entrypoint=call.parameters['entrypoint'],
+                     parameter=call.parameters['value'],
+                     storage=initial_storage,
+                     source=source,
+                     sender=sender,
+                     amount=amount or call.amount,
+                     balance=balance,
+                     now=now,
+                     level=level,
+                     gas_limit=gas_limit)
+    return attribute(res['trace'], index_locations(script), gas_limit=gas_limit)
+
+
+class GasProfiler:
+    """Profiles every successful `ContractCall.interpret` while installed, grouping samples by `root`"""
+
+    def __init__(self, shell):
+        self.shell = shell
+        self.root = ''
+        self.reports: Dict[str, Counter] = {}
+        self._interpret = None
+
+    def install(self):
+        self._interpret = interpret = ContractCall.interpret
+        profiler = self
+
+        def interpret_and_profile(call, *args, **kwargs):
+            res = interpret(call, *args, **kwargs)
+            context = {k: v for k, v in kwargs.items() if k in ('storage', 'source', 'sender', 'amount', 'balance', 'now', 'level')}
+            report = profile(call, profiler.shell, **context)
+            profiler.reports.setdefault(profiler.root, Counter()).update(report)
+            return res
+
+        ContractCall.interpret = interpret_and_profile
+
+    def uninstall(self):
+        if self._interpret:
+            ContractCall.interpret = self._interpret
+            self._interpret = None
+
+    def write(self, filename: str):
+        with open(filename, 'w') as f:
+            for root, report in sorted(self.reports.items()):
+                f.write(folded(report, root))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile gas of a vault entrypoint call')
+    parser.add_argument('contract', type=str, help='path to the compiled contract')
+    parser.add_argument('entrypoint', type=str, help='entrypoint name')
+    parser.add_argument('parameter', type=str, help='entrypoint parameter, in Michelson')
+    parser.add_argument('--storage', type=str, help='initial storage, in Michelson', required=True)
+    parser.add_argument('--source', type=str, help='SOURCE and SENDER of the call')
+    parser.add_argument('--amount', type=int, default=0, help='AMOUNT, in mutez')
+    parser.add_argument('--now', type=int, help='NOW, as a unix timestamp')
+    parser.add_argument('-n', type=str, help='node URL', default='http://localhost:20000')
+    args = parser.parse_args()
+
+    contract = ContractInterface.from_file(args.contract)
+    script = contract.context.script['code']
+    res = trace_code(pytezos.using(shell=args.n).shell, script,
+                     entrypoint=args.entrypoint,
+                     parameter=michelson_to_micheline(args.parameter),
+                     storage=michelson_to_micheline(args.storage),
+                     source=args.source,
+                     amount=args.amount,
+                     now=args.now)
+    print(folded(attribute(res['trace'], index_locations(script)), root=args.entrypoint), end='')
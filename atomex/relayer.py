@@ -0,0 +1,156 @@
+"""Third-party redeem relayer.
+
+Redeeming on behalf of the participant pays the swap payoff to the sender (`payoff` of
+tez_vault, `payoffAmount` of fa12_vault). The relayer takes secrets revealed elsewhere,
+finds the swaps they unlock, keeps those whose payoff covers the estimated fee and
+sends them as a single operation group per block.
+"""
+from time import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pytezos.rpc.node import RpcError, RpcNotFoundError
+
+from atomex import metrics
+from atomex.bots import Prices, estimate_fees, pending_calls, select_profitable, value_in_mutez
+from atomex.vaults import FA2_VAULT, Swap, hash_secret, swap_from_storage, swaps_big_map
+
+# Blocks an injected operation group can take to be included (max_operations_ttl)
+OPERATION_TTL = 120
+
+
+class Relayer:
+
+    def __init__(self, client, vaults: Dict[str, str], prices: Optional[Prices] = None, min_profit: int = 0,
+                 refund_margin: int = 60, max_batch: int = 50, clock: Callable[[], float] = time):
+        """
+        :param client: pytezos client with the relayer key
+        :param vaults: vault name to address, fa2_vault is ignored as it pays no payoff
+        :param prices: token unit prices in mutez for FA1.2 payoffs
+        :param min_profit: minimal payoff minus fee, in mutez
+        :param refund_margin: seconds before refund time after which a swap is no longer worth racing for
+        """
+        self.client = client
+        self.vaults = {name: address for name, address in vaults.items() if name != FA2_VAULT}
+        self.prices = prices or {}
+        self.min_profit = min_profit
+        self.refund_margin = refund_margin
+        self.max_batch = max_batch
+        self.clock = clock
+        self.secrets: Dict[bytes, bytes] = {}
+        self._seen_at: Dict[bytes, float] = {}
+        self._contracts = {name: client.contract(address) for name, address in self.vaults.items()}
+        self._names = {address: name for name, address in self.vaults.items()}
+        # Hashes of the injected operation groups not yet seen in a block, with the blocks left to wait for them
+        self._injected: Dict[str, int] = {}
+
+    def add_secret(self, secret: bytes):
+        hashed_secret = hash_secret(secret)
+        self.secrets.setdefault(hashed_secret, secret)
+        self._seen_at.setdefault(hashed_secret, self.clock())
+
+    def find_swaps(self) -> List[Tuple[Swap, bytes]]:
+        """Look up the swaps unlocked by the known secrets, forgetting secrets with nothing left to redeem.
+
+        Only a missing key means there is no swap in a vault, a secret whose lookup failed otherwise
+        is kept for the next pass.
+        """
+        found, now = [], self.clock()
+        for hashed_secret, secret in list(self.secrets.items()):
+            swaps, failed = [], False
+            for name, contract in self._contracts.items():
+                try:
+                    state = swaps_big_map(name, contract.storage)[hashed_secret]()
+                except (KeyError, RpcNotFoundError):
+                    continue
+                except RpcError:
+                    failed = True
+                    continue
+                if state:
+                    swaps.append(swap_from_storage(name, hashed_secret, state))
+            swaps = [swap for swap in swaps if swap.refund_time - self.refund_margin > now]
+            if not swaps and not failed:
+                self.forget(hashed_secret)
+            found.extend((swap, secret) for swap in swaps)
+        return found
+
+    def forget(self, hashed_secret: bytes):
+        self.secrets.pop(hashed_secret, None)
+        self._seen_at.pop(hashed_secret, None)
+
+    def redeem_call(self, swap: Swap, secret: bytes):
+        return self._contracts[swap.vault].redeem(secret)
+
+    def estimate_fees(self, candidates: List[Tuple[Swap, bytes]]) -> List[Tuple[Tuple[Swap, bytes], int]]:
+        """Estimate the fee of every redeem within one batch, dropping those that fail to simulate"""
+        return estimate_fees(self.client, candidates, lambda candidate: self.redeem_call(*candidate),
+                             lambda candidate, e: metrics.track_failure(candidate[0].vault, 'redeem', e))
+
+    def step(self):
+        """Redeem every profitable swap not yet being redeemed by somebody else, returns the operation group"""
+        candidates = self.find_swaps()
+        if not candidates:
+            return None
+
+        pending = {hash_secret(secret) for secret in
+                   pending_calls(self.client.shell.mempool.pending_operations(), self.vaults, 'redeem')}
+        candidates = [(swap, secret) for swap, secret in candidates if swap.hashed_secret not in pending]
+        batch = select_profitable(self.estimate_fees(candidates),
+                                  lambda candidate: value_in_mutez(candidate[0], candidate[0].payoff, self.prices),
+                                  self.min_profit)[:self.max_batch]
+        if not batch:
+            return None
+
+        try:
+            opg = self.client.bulk(*[self.redeem_call(swap, secret) for swap, secret in batch]).send()
+        except RpcError as e:
+            for swap, _ in batch:
+                metrics.track_failure(swap.vault, 'redeem', e)
+            raise
+
+        injected_at = self.clock()
+        metrics.rpc_requests.inc(endpoint='injection')
+        self._injected[opg.opg_hash] = OPERATION_TTL
+        for swap, _ in batch:
+            metrics.redeem_injection_seconds.observe(
+                injected_at - self._seen_at.get(swap.hashed_secret, injected_at), chain='tezos', vault=swap.vault)
+        return opg
+
+    def track_included(self):
+        """Observe the gas of the injected operation groups included in the head block"""
+        if not self._injected:
+            return
+        for opg in self.client.shell.blocks.head.operations.managers():
+            if self._injected.pop(opg['hash'], None) is not None:
+                metrics.track_gas(self._names, opg)
+        self._injected = {opg_hash: blocks - 1 for opg_hash, blocks in self._injected.items() if blocks > 1}
+
+    def run(self, secret_sources: Iterable[Callable[[], Iterable[bytes]]]):
+        """Poll secret sources and relay once per new block"""
+        while True:
+            self.track_included()
+            for source in secret_sources:
+                for secret in source():
+                    self.add_secret(secret)
+            self.step()
+            self.client.shell.wait_next_block()
+
+
+def tezos_secrets(client, vaults: Dict[str, str]) -> Callable[[], List[bytes]]:
+    """Secret source reading the redeems applied in the head block of the given vaults"""
+    addresses = set(vaults.values())
+
+    def fetch() -> List[bytes]:
+        secrets = []
+        for opg in client.shell.blocks.head.operations.managers():
+            for content in opg['contents']:
+                results = [content['metadata']['operation_result']]
+                results.extend(op['result'] for op in content['metadata'].get('internal_operation_results', []))
+                calls = [content] + content['metadata'].get('internal_operation_results', [])
+                for call, result in zip(calls, results):
+                    parameters = call.get('parameters', {})
+                    if call.get('kind') == 'transaction' and call.get('destination') in addresses \
+                            and parameters.get('entrypoint') == 'redeem' and result.get('status') == 'applied':
+                        secrets.append(bytes.fromhex(parameters['value']['bytes']))
+        return secrets
+
+    return fetch
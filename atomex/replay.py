@@ -0,0 +1,226 @@
+"""Replay historical vault calls against the current and a candidate build.
+
+The dump is a JSON lines file, one call per line:
+
+    {"vault": "tez_vault", "entrypoint": "redeem", "parameter": <Micheline>,
+     "storage": <Micheline, big_map entries the call touches inlined>,
+     "sender": "tz1...", "source": "tz1...", "amount": 0, "timestamp": 1630000000}
+
+Every call is interpreted by both builds, the report tells the instructions each build
+executes, the big_map bytes it allocates and whether the resulting storage, big_map diff,
+emitted operations or failure differ. Gas is not accounted by the builtin interpreter, it
+is measured with the node `trace_code` RPC when a node URL is given:
+
+    python -m atomex.replay calls.jsonl --candidate tez_vault=build/candidate/tez_vault.tz -n http://localhost:20000
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from os.path import join
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pytezos import ContractInterface, MichelsonRuntimeError, pytezos
+from pytezos.context.impl import ExecutionContext
+from pytezos.michelson.forge import forge_micheline
+from pytezos.michelson.program import MichelsonProgram
+from pytezos.michelson.stack import MichelsonStack
+
+from atomex.profiler import DEFAULT_GAS_LIMIT, trace_code
+from atomex.vaults import build_dir
+
+_current: Dict[str, str] = {}
+_candidates: Dict[str, str] = {}
+_shell = None
+
+
+@lru_cache(maxsize=None)
+def load_script(path: str) -> List[Dict[str, Any]]:
+    return ContractInterface.from_file(path).context.script['code']
+
+
+@lru_cache(maxsize=None)
+def load_program(path: str):
+    """Parse a script into a program type once, instantiating it per call is cheap"""
+    context = ExecutionContext(script={'code': load_script(path), 'storage': None})
+    return MichelsonProgram.load(context, with_code=True)
+
+
+def interpret(path: str, call: Dict[str, Any],
+              stdout: Optional[List[str]] = None) -> Tuple[List[dict], Any, List[dict], Optional[Exception]]:
+    """Interpret a call with a cached program, same semantics as pytezos Interpreter.run_code.
+
+    The interpreter logs every instruction it executes to `stdout`, see `count_steps`.
+    """
+    context = ExecutionContext(amount=call.get('amount', 0),
+                               source=call.get('source'),
+                               sender=call.get('sender') or call.get('source'),
+                               balance=call.get('balance'),
+                               now=call.get('timestamp'),
+                               level=call.get('level'),
+                               address=call.get('self'),
+                               script={'code': load_script(path), 'storage': call['storage']})
+    stack = MichelsonStack()
+    stdout = [] if stdout is None else stdout
+    try:
+        program = load_program(path).instantiate(entrypoint=call['entrypoint'],
+                                                 parameter=call['parameter'],
+                                                 storage=call['storage'])
+        program.begin(stack, stdout, context)
+        program.execute(stack, stdout, context)
+        operations, storage, lazy_diff, _ = program.end(stack, stdout)
+        return operations, storage, lazy_diff, None
+    except MichelsonRuntimeError as e:
+        return [], None, [], e
+
+
+def count_steps(stdout: List[str]) -> int:
+    """Instructions executed by a call, a gas proxy that doesn't need a node"""
+    return sum(not line.startswith(('BEGIN', 'END')) for line in stdout)
+
+
+def _elements(node) -> Iterator[Tuple[Any, Any]]:
+    if isinstance(node, list):
+        for item in node:
+            yield from _elements(item)
+    elif isinstance(node, dict):
+        if node.get('prim') == 'Elt':
+            yield node['args'][0], node['args'][1]
+        for arg in node.get('args', []):
+            yield from _elements(arg)
+
+
+def _updates(lazy_diff: List[dict]) -> Dict[bytes, Optional[dict]]:
+    return {forge_micheline(update['key']): update.get('value')
+            for diff in lazy_diff if diff['kind'] == 'big_map'
+            for update in diff['diff'].get('updates', [])}
+
+
+def big_map_delta(pre_storage, lazy_diff: List[dict]) -> int:
+    """Bytes of keys and values a call adds to (or, if negative, frees from) the big_maps"""
+    before = {forge_micheline(key): len(forge_micheline(value)) for key, value in _elements(pre_storage)}
+    delta = 0
+    for key, value in _updates(lazy_diff).items():
+        if key in before:
+            delta -= len(key) + before[key]
+        if value is not None:
+            delta += len(key) + len(forge_micheline(value))
+    return delta
+
+
+def measure_gas(path: str, call: Dict[str, Any]) -> Optional[int]:
+    if _shell is None:
+        return None
+    res = trace_code(_shell, load_script(path),
+                     entrypoint=call['entrypoint'],
+                     parameter=call['parameter'],
+                     storage=call['storage'],
+                     source=call.get('source'),
+                     sender=call.get('sender'),
+                     amount=call.get('amount', 0),
+                     now=call.get('timestamp'),
+                     level=call.get('level'))
+    remaining = [float(step['gas']) for step in res['trace'] if step.get('gas') not in (None, 'unaccounted')]
+    return int(DEFAULT_GAS_LIMIT - min(remaining)) if remaining else None
+
+
+def run_build(path: str, call: Dict[str, Any]) -> Dict[str, Any]:
+    stdout: List[str] = []
+    operations, storage, lazy_diff, error = interpret(path, call, stdout)
+    result = {
+        'error': error.format_stdout() if error else None,
+        'storage': storage,
+        'big_map_diff': {key.hex(): value for key, value in _updates(lazy_diff).items()},
+        'operations': operations,
+        'big_map_delta': None if error else big_map_delta(call['storage'], lazy_diff),
+        'steps': None if error else count_steps(stdout),
+        'gas': None,
+    }
+    if error is None:
+        result['gas'] = measure_gas(path, call)
+    return result
+
+
+def replay(call: Dict[str, Any]) -> Dict[str, Any]:
+    vault = call['vault']
+    current_path = _current.get(vault, join(build_dir, f'{vault}.tz'))
+    current = run_build(current_path, call)
+    candidate = run_build(_candidates.get(vault, current_path), call)
+
+    divergence = [field for field in ('error', 'storage', 'big_map_diff', 'operations')
+                  if current[field] != candidate[field]]
+    report = {
+        'vault': vault,
+        'entrypoint': call['entrypoint'],
+        'id': call.get('id'),
+        'divergence': divergence,
+        'error': current['error'],
+    }
+    for field in ('gas', 'steps', 'big_map_delta'):
+        report[f'{field}_current'] = current[field]
+        report[f'{field}_candidate'] = candidate[field]
+        if current[field] is not None and candidate[field] is not None:
+            report[f'{field}_diff'] = candidate[field] - current[field]
+    return report
+
+
+def init_worker(candidates: Dict[str, str], node_url: Optional[str] = None, current: Optional[Dict[str, str]] = None):
+    """Set the builds to compare in this process, paths default to build/contracts"""
+    global _current, _candidates, _shell
+    _current = current or {}
+    _candidates = candidates
+    _shell = pytezos.using(shell=node_url).shell if node_url else None
+
+
+def replay_all(calls: Iterable[Dict[str, Any]], candidates: Dict[str, str], node_url: Optional[str] = None,
+               current: Optional[Dict[str, str]] = None, workers: Optional[int] = None,
+               chunksize: int = 64) -> Iterator[Dict[str, Any]]:
+    """Replay calls over a pool of `workers` processes (all cores by default), yielding reports in order"""
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             initializer=init_worker,
+                             initargs=(candidates, node_url, current)) as executor:
+        yield from executor.map(replay, calls, chunksize=chunksize)
+
+
+def summarize(reports: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Aggregate reports per vault entrypoint"""
+    summary: Dict[str, Dict[str, Any]] = {}
+    for report in reports:
+        item = summary.setdefault(f'{report["vault"]}%{report["entrypoint"]}', {
+            'calls': 0, 'diverged': 0, 'gas_diff': 0, 'steps_diff': 0, 'big_map_delta_diff': 0,
+        })
+        item['calls'] += 1
+        item['diverged'] += bool(report['divergence'])
+        item['gas_diff'] += report.get('gas_diff', 0)
+        item['steps_diff'] += report.get('steps_diff', 0)
+        item['big_map_delta_diff'] += report.get('big_map_delta_diff', 0)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay vault calls against a candidate build')
+    parser.add_argument('dump', type=str, help='JSON lines file with the calls')
+    parser.add_argument('--candidate', type=str, action='append', default=[], help='vault=path to the candidate build')
+    parser.add_argument('-n', type=str, help='node URL used to measure gas')
+    parser.add_argument('-j', type=int, help='number of worker processes, all cores by default')
+    parser.add_argument('-o', type=str, help='where to write per-call reports (JSON lines)')
+    args = parser.parse_args()
+
+    candidates = dict(item.split('=', 1) for item in args.candidate)
+    with open(args.dump) as f:
+        calls = [json.loads(line) for line in f if line.strip()]
+
+    reports = []
+    out = open(args.o, 'w') if args.o else None
+    for report in replay_all(calls, candidates, node_url=args.n, workers=args.j):
+        reports.append(report)
+        if out:
+            out.write(json.dumps(report) + '\n')
+    if out:
+        out.close()
+
+    print(json.dumps(summarize(reports), indent=2))
+    if any(report['divergence'] for report in reports):
+        sys.exit(1)
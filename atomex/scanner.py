@@ -0,0 +1,240 @@
+"""Chunked, parallel scanner of AtomexEthVault and AtomexErc20Vault logs.
+
+Block ranges are fetched with `eth_getLogs` by a pool of workers. A range the node refuses
+to serve at once (too many results, response too large) is split in two and both halves
+are queued again, ranges that succeed make the next ones larger. Logs are decoded into
+compact records and progress is checkpointed as the highest block below which every
+range is done, so an interrupted backfill resumes from there.
+
+    python -m atomex.scanner http://localhost:8545 0x5FbDB2315678afecb367f032d93F642f64180aa3 --from-block 0
+"""
+import argparse
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from atomex.ethereum import TOPICS, EthereumRpc, EthereumRpcError, decode_words, topic
+
+EVENTS = ('Initiated', 'Added', 'Activated', 'Redeemed', 'Refunded')
+TOO_MANY_RESULTS = ('more than', 'too many', 'limit exceeded', 'response size', 'range is too large', 'block range')
+
+# topic 0 -> event name, indexed fields after the hashed secret, data fields
+# (the ERC-20 Initiated signature differs as it also indexes the token contract)
+DATA_FIELDS = {
+    TOPICS['Initiated']: ('Initiated', (), (('initiator', 'address'), ('refund_timestamp', 'uint256'),
+                                            ('countdown', 'uint256'), ('value', 'uint256'),
+                                            ('payoff', 'uint256'), ('active', 'bool'))),
+    TOPICS['Erc20Initiated']: ('Initiated', ('token',), (('initiator', 'address'), ('refund_timestamp', 'uint256'),
+                                                         ('countdown', 'uint256'), ('value', 'uint256'),
+                                                         ('payoff', 'uint256'), ('active', 'bool'))),
+    TOPICS['Added']: ('Added', (), (('sender', 'address'), ('value', 'uint256'))),
+    TOPICS['Activated']: ('Activated', (), ()),
+    TOPICS['Redeemed']: ('Redeemed', (), (('secret', 'bytes32'),)),
+    TOPICS['Refunded']: ('Refunded', (), ()),
+}
+
+
+class SwapEvent(NamedTuple):
+    block: int
+    log_index: int
+    vault: str
+    event: str
+    hashed_secret: bytes
+    participant: Optional[str] = None
+    initiator: Optional[str] = None
+    token: Optional[str] = None
+    refund_timestamp: Optional[int] = None
+    countdown: Optional[int] = None
+    value: Optional[int] = None
+    payoff: Optional[int] = None
+    active: Optional[bool] = None
+    sender: Optional[str] = None
+    secret: Optional[bytes] = None
+    tx_hash: Optional[str] = None
+
+
+def decode_log(log: Dict[str, Any]) -> Optional[SwapEvent]:
+    """Decode a vault log into a swap event, None for logs of other events"""
+    topics = log['topics']
+    if not topics or topics[0] not in DATA_FIELDS:
+        return None
+    event, indexed, fields = DATA_FIELDS[topics[0]]
+    record = {'hashed_secret': bytes.fromhex(topics[1][2:])}
+    if event == 'Initiated':
+        for name, value in zip(indexed + ('participant',), topics[2:]):
+            record[name] = '0x' + value[-40:]
+    record.update(zip((name for name, _ in fields), decode_words(log['data'], [t for _, t in fields])))
+    return SwapEvent(block=int(log['blockNumber'], 16),
+                     log_index=int(log['logIndex'], 16),
+                     vault=log['address'].lower(),
+                     event=event,
+                     tx_hash=log.get('transactionHash'),
+                     **record)
+
+
+def build_filters(vaults: Sequence[str], events: Iterable[str] = EVENTS,
+                  hashed_secrets: Sequence[bytes] = (), participants: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """eth_getLogs filters (without block range) selecting the requested vault logs.
+
+    Participants only narrow Initiated logs, where `_participant` is the second indexed topic of
+    AtomexEthVault and the third one of AtomexErc20Vault (after `_contract`).
+    """
+    events = list(events)
+    secrets_topic = [topic(h, 'bytes32') for h in hashed_secrets] or None
+    address = list(vaults)
+    filters = []
+    others = [TOPICS[event] for event in events if event != 'Initiated']
+    if 'Initiated' in events and participants:
+        participants_topic = [topic(p, 'address') for p in participants]
+        filters.append({'address': address, 'topics': [TOPICS['Initiated'], secrets_topic, participants_topic]})
+        filters.append({'address': address, 'topics': [TOPICS['Erc20Initiated'], secrets_topic, None, participants_topic]})
+    elif 'Initiated' in events:
+        others = [TOPICS['Initiated'], TOPICS['Erc20Initiated']] + others
+    if others:
+        filters.append({'address': address, 'topics': [others, secrets_topic]})
+    for log_filter in filters:
+        while log_filter['topics'] and log_filter['topics'][-1] is None:
+            log_filter['topics'].pop()
+    return filters
+
+
+def is_too_many_results(error: EthereumRpcError) -> bool:
+    return error.code == -32005 or any(marker in error.message.lower() for marker in TOO_MANY_RESULTS)
+
+
+class Checkpoint:
+    """Highest block below which every range was scanned, stored in a JSON file"""
+
+    def __init__(self, path: Optional[str], start: int):
+        self.path = path
+        self.block = start - 1
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.block = max(self.block, json.load(f)['block'])
+        self._done: Dict[int, int] = {}
+        self._lock = Lock()
+
+    def complete(self, start: int, end: int):
+        with self._lock:
+            self._done[start] = end
+            moved = False
+            while self.block + 1 in self._done:
+                self.block = self._done.pop(self.block + 1)
+                moved = True
+            if moved and self.path:
+                tmp = f'{self.path}.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump({'block': self.block}, f)
+                os.replace(tmp, self.path)
+
+
+class Scanner:
+
+    def __init__(self, rpc: EthereumRpc, filters: List[Dict[str, Any]], workers: int = 8,
+                 chunk_size: int = 2000, min_chunk_size: int = 1, max_chunk_size: int = 100000):
+        self.rpc = rpc
+        self.filters = filters
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self._lock = Lock()
+
+    def fetch(self, start: int, end: int) -> List[SwapEvent]:
+        events = []
+        for log_filter in self.filters:
+            logs = self.rpc.call('eth_getLogs', dict(log_filter, fromBlock=hex(start), toBlock=hex(end)))
+            events.extend(event for event in map(decode_log, logs) if event)
+        events.sort()
+        return events
+
+    def _adapt(self, succeeded: bool, size: int):
+        with self._lock:
+            if succeeded:
+                self.chunk_size = min(self.max_chunk_size, max(self.chunk_size, size * 2))
+            else:
+                self.chunk_size = max(self.min_chunk_size, min(self.chunk_size, size // 2))
+
+    def scan(self, from_block: int, to_block: int, checkpoint: Optional[Checkpoint] = None,
+             on_events: Optional[Callable[[List[SwapEvent]], None]] = None) -> List[SwapEvent]:
+        """Scan [from_block, to_block], returns the events ordered by block and log index.
+
+        `on_events` gets every chunk as soon as it is fetched (chunks may come out of order),
+        the checkpoint is advanced right after, so handing events over there is crash-safe.
+        """
+        checkpoint = checkpoint or Checkpoint(None, from_block)
+        next_block = max(from_block, checkpoint.block + 1)
+        results: List[SwapEvent] = []
+        retry: List[Tuple[int, int]] = []
+
+        def next_range() -> Optional[Tuple[int, int]]:
+            nonlocal next_block
+            if retry:
+                return retry.pop()
+            if next_block > to_block:
+                return None
+            start, end = next_block, min(to_block, next_block + self.chunk_size - 1)
+            next_block = end + 1
+            return start, end
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            while True:
+                while len(pending) < self.workers:
+                    block_range = next_range()
+                    if block_range is None:
+                        break
+                    pending[executor.submit(self.fetch, *block_range)] = block_range
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = pending.pop(future)
+                    try:
+                        events = future.result()
+                    except EthereumRpcError as e:
+                        if not is_too_many_results(e) or start == end:
+                            raise
+                        self._adapt(False, end - start + 1)
+                        middle = (start + end) // 2
+                        retry.extend([(middle + 1, end), (start, middle)])
+                        continue
+                    self._adapt(True, end - start + 1)
+                    if on_events:
+                        on_events(events)
+                    results.extend(events)
+                    checkpoint.complete(start, end)
+
+        results.sort()
+        return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scan Atomex Ethereum vault logs')
+    parser.add_argument('node', type=str, help='node URL')
+    parser.add_argument('vaults', type=str, nargs='+', help='vault addresses')
+    parser.add_argument('--from-block', type=int, default=0)
+    parser.add_argument('--to-block', type=int, help='last block to scan, the head by default')
+    parser.add_argument('--hashed-secret', type=str, action='append', default=[], help='filter by hashed secret')
+    parser.add_argument('--participant', type=str, action='append', default=[], help='filter Initiated by participant')
+    parser.add_argument('-j', type=int, default=8, help='number of workers')
+    parser.add_argument('--checkpoint', type=str, default='build/eth_scanner.json')
+    args = parser.parse_args()
+
+    rpc = EthereumRpc(args.node)
+    to_block = args.to_block if args.to_block is not None else int(rpc.call('eth_blockNumber'), 16)
+    filters = build_filters(args.vaults,
+                            hashed_secrets=[bytes.fromhex(h[2:] if h.startswith('0x') else h) for h in args.hashed_secret],
+                            participants=args.participant)
+    os.makedirs(os.path.dirname(os.path.abspath(args.checkpoint)), exist_ok=True)
+
+    def dump(events):
+        for event in events:
+            record = {k: (f'0x{v.hex()}' if isinstance(v, bytes) else v) for k, v in event._asdict().items()}
+            print(json.dumps(record), flush=True)
+
+    Scanner(rpc, filters, workers=args.j).scan(args.from_block, to_block,
+                                               checkpoint=Checkpoint(args.checkpoint, args.from_block),
+                                               on_events=dump)
@@ -0,0 +1,105 @@
+"""Layouts of the Tezos vaults and a common record for their swaps"""
+from functools import lru_cache
+from hashlib import sha256
+from os.path import dirname, join
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from pytezos import ContractInterface
+from pytezos.michelson.types.base import MichelsonType
+
+project_dir = dirname(dirname(__file__))
+build_dir = join(project_dir, 'build/contracts')
+
+TEZ_VAULT = 'tez_vault'
+FA12_VAULT = 'fa12_vault'
+FA2_VAULT = 'fa2_vault'
+VAULTS = (TEZ_VAULT, FA12_VAULT, FA2_VAULT)
+
+
+class Swap(NamedTuple):
+    vault: str
+    hashed_secret: bytes
+    initiator: str
+    participant: str
+    refund_time: int
+    amount: int
+    payoff: int = 0
+    token_address: Optional[str] = None
+    token_id: Optional[int] = None
+    bounty: int = 0
+
+    @property
+    def total(self) -> int:
+        """Everything locked in the swap, i.e. what a refund returns"""
+        return self.amount + self.payoff if self.vault == TEZ_VAULT else self.amount
+
+    @property
+    def redeem_amount(self) -> int:
+        """What the participant receives on redeem"""
+        return self.amount if self.vault == TEZ_VAULT else self.amount - self.payoff
+
+    @property
+    def refund_amount(self) -> int:
+        """What the initiator receives on refund, the bounty goes to whoever refunds"""
+        return self.total - self.bounty
+
+
+def hash_secret(secret: bytes) -> bytes:
+    return sha256(sha256(secret).digest()).digest()
+
+
+def swap_from_storage(vault: str, hashed_secret: bytes, state: Dict[str, Any]) -> Swap:
+    """Convert a big_map value decoded by pytezos into a swap record"""
+    if vault == TEZ_VAULT:
+        return Swap(vault=vault,
+                    hashed_secret=hashed_secret,
+                    initiator=state['initiator'],
+                    participant=state['participant'],
+                    refund_time=int(state['refund_time']),
+                    amount=int(state['amount']),
+                    payoff=int(state['payoff']),
+                    bounty=int(state['bounty']))
+    return Swap(vault=vault,
+                hashed_secret=hashed_secret,
+                initiator=state['initiator'],
+                participant=state['participant'],
+                refund_time=int(state['refundTime']),
+                amount=int(state['totalAmount']),
+                payoff=int(state.get('payoffAmount', 0)),
+                token_address=state['tokenAddress'],
+                token_id=state.get('tokenId'),
+                bounty=int(state.get('bountyAmount', 0)))
+
+
+def swaps_big_map(vault: str, storage):
+    """The `swaps` big_map of a vault storage, works both with decoded values and with ContractStorage"""
+    return storage[0] if vault == TEZ_VAULT else storage
+
+
+@lru_cache(maxsize=None)
+def load_vault(vault: str, path: Optional[str] = None) -> ContractInterface:
+    """Load a compiled vault once per process, parsing the script is the slow part of every call"""
+    return ContractInterface.from_file(path or join(build_dir, f'{vault}.tz'))
+
+
+def _big_map_args(expr):
+    if isinstance(expr, list):
+        return next(filter(None, map(_big_map_args, expr)), None)
+    if isinstance(expr, dict):
+        if expr.get('prim') == 'big_map':
+            return expr['args']
+        return _big_map_args(expr.get('args', []))
+    return None
+
+
+def swaps_type_exprs(vault: str, path: Optional[str] = None) -> Tuple[Any, Any]:
+    """Micheline key and value types of the `swaps` big_map"""
+    key, value = _big_map_args(load_vault(vault, path).context.storage_expr)
+    return key, value
+
+
+@lru_cache(maxsize=None)
+def swaps_types(vault: str, path: Optional[str] = None) -> Tuple[MichelsonType, MichelsonType]:
+    """Key and value types of the `swaps` big_map, to decode its diffs"""
+    key, value = swaps_type_exprs(vault, path)
+    return MichelsonType.match(key), MichelsonType.match(value)
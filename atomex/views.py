@@ -0,0 +1,83 @@
+"""Views of the Tezos vaults: TZIP-16 metadata and local execution.
+
+Every vault has the on-chain views `get_swap(hashed_secret)`, `get_swaps(list of hashed secrets)`
+and `is_redeemable(hashed_secret, now)`. The TZIP-16 metadata exposes the same code as off-chain
+(`michelsonStorageView`) views, so both flavours return the same values. Either can be executed
+through pytezos without a node, against a storage given as a Python object:
+
+    python -m atomex.views build/contracts/tez_vault.tz -o build/metadata/tez_vault.json
+"""
+import argparse
+import json
+import os
+from functools import lru_cache
+from os.path import basename, join, splitext
+from typing import Any, Dict, List, Optional
+
+from pytezos.contract.metadata import ContractMetadata
+
+from atomex.vaults import build_dir, load_vault
+
+VIEWS = ('get_swap', 'get_swaps', 'is_redeemable')
+
+
+def onchain_views(script: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """`view` sections of a Micheline script by name"""
+    views = {}
+    for section in script:
+        if section.get('prim') == 'view':
+            name, parameter, return_type, code = section['args']
+            views[name['string']] = {'parameter': parameter, 'returnType': return_type, 'code': code}
+    return views
+
+
+def build_metadata(vault: str, script: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """TZIP-16 metadata with an off-chain view for every on-chain view of the script"""
+    return {
+        'name': f'Atomex {vault}',
+        'description': 'Atomic swap vault, https://atomex.me',
+        'interfaces': ['TZIP-016'],
+        'views': [
+            {'name': name, 'pure': True, 'implementations': [{'michelsonStorageView': view}]}
+            for name, view in onchain_views(script).items()
+        ],
+    }
+
+
+def _camelcase(name: str) -> str:
+    head, *tail = name.split('_')
+    return head + ''.join(word.capitalize() for word in tail)
+
+
+@lru_cache(maxsize=None)
+def load_metadata(vault: str, path: Optional[str] = None) -> ContractMetadata:
+    contract = load_vault(vault, path)
+    return ContractMetadata.from_json(build_metadata(vault, contract.context.script['code']), contract.context)
+
+
+def run_view(vault: str, name: str, argument: Any, storage: Any, offchain: bool = False,
+             path: Optional[str] = None) -> Any:
+    """Execute a view locally, `storage` is the vault storage as a Python object"""
+    if offchain:
+        view = getattr(load_metadata(vault, path), _camelcase(name))
+        return view(argument).storage_view(storage=storage)
+    return load_vault(vault, path).view[name](argument).onchain_view(storage=storage)
+
+
+def fetch_swaps(contract, hashed_secrets: List[bytes]) -> Dict[bytes, Dict[str, Any]]:
+    """Swaps of many hashed secrets with a single `run_script_view` RPC, `contract` is bound to a node"""
+    return contract.view.get_swaps(list(hashed_secrets)).run_view()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate TZIP-16 metadata of a compiled vault')
+    parser.add_argument('contract', type=str, help='path to the compiled vault (.tz)')
+    parser.add_argument('-o', type=str, help='output file, build/metadata/<vault>.json by default')
+    args = parser.parse_args()
+
+    vault = splitext(basename(args.contract))[0]
+    metadata = build_metadata(vault, load_vault(vault, args.contract).context.script['code'])
+    output = args.o or join(build_dir, '..', 'metadata', f'{vault}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(metadata, f, indent=2)
@@ -0,0 +1,403 @@
+"""Sharded swap watcher.
+
+Open swaps of the Tezos vaults (tez_vault, fa12_vault, fa2_vault) and of the Ethereum vaults
+are spread over worker processes by the first byte of their hashed secret, so both legs of an
+atomic swap are watched by the same worker. Blocks and logs are fetched and decoded once, by
+the coordinator, which sends every worker the diffs of its prefixes over a pipe. Workers
+report the swaps to act on: `redeemable` ones, once a leg with the same hashed secret was
+redeemed (revealing the secret) and `refundable` ones, once their refund time has come.
+
+A hashed secret with no open leg left is kept with its secret for `retention` seconds of chain
+time, so a leg of another chain reported later (e.g. by a backfill reading Tezos before
+Ethereum) still gets its `redeemable` alert.
+
+The coordinator keeps the diffs of the swaps still known, so when a worker joins or leaves only
+the prefixes that change owner are moved, by replaying their diffs to the new owner; a worker
+that dies is replaced the same way. Alerts may be repeated after a move.
+
+    python -m atomex.watcher --tezos-node http://localhost:20000 --tezos-vault tez_vault=KT1... --from-level 100 \\
+        --ethereum-node http://localhost:8545 --ethereum-vault eth_vault=0x... --from-block 0 -j 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from collections import defaultdict
+from time import sleep, time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from atomex.events import VaultEvent, block_events
+from atomex.scanner import Scanner, SwapEvent, build_filters
+from atomex.vaults import TEZ_VAULT, Swap, swap_from_storage
+
+PREFIXES = 256
+RETENTION = 86400
+TEZOS = 'tezos'
+ETHEREUM = 'ethereum'
+
+
+class Diff(NamedTuple):
+    chain: str
+    vault: str
+    tag: str
+    hashed_secret: bytes
+    level: int
+    swap: Optional[Swap] = None
+    amount: Optional[int] = None
+    secret: Optional[bytes] = None
+
+
+class Alert(NamedTuple):
+    kind: str
+    chain: str
+    vault: str
+    hashed_secret: bytes
+    secret: Optional[bytes] = None
+
+
+def prefix(hashed_secret: bytes) -> int:
+    return hashed_secret[0]
+
+
+def tezos_diffs(events: Iterable[VaultEvent], vaults: Dict[str, str]) -> List[Diff]:
+    """Diffs of Tezos vault events, `vaults` maps vault addresses to vault names"""
+    diffs = []
+    for event in events:
+        vault = vaults[event.vault]
+        diff = Diff(TEZOS, vault, event.tag, event.hashed_secret, event.level)
+        if event.tag == 'initiated':
+            state = event.payload if vault == TEZ_VAULT else event.payload['swap']
+            diff = diff._replace(swap=swap_from_storage(vault, event.hashed_secret, state))
+        elif event.tag == 'added':
+            amount = event.payload['amount'] if vault == TEZ_VAULT else event.payload['totalAmount']
+            diff = diff._replace(amount=int(amount))
+        elif event.tag == 'redeemed':
+            diff = diff._replace(secret=event.payload['secret'])
+        diffs.append(diff)
+    return diffs
+
+
+def ethereum_diffs(events: Iterable[SwapEvent], vaults: Dict[str, str]) -> List[Diff]:
+    """Diffs of Ethereum vault events, `vaults` maps lowercase vault addresses to vault names"""
+    diffs = []
+    for event in events:
+        tag = event.event.lower()
+        if tag == 'activated':
+            continue
+        vault = vaults[event.vault]
+        diff = Diff(ETHEREUM, vault, tag, event.hashed_secret, event.block)
+        if tag == 'initiated':
+            diff = diff._replace(swap=Swap(vault=vault,
+                                           hashed_secret=event.hashed_secret,
+                                           initiator=event.initiator,
+                                           participant=event.participant,
+                                           refund_time=event.refund_timestamp,
+                                           amount=event.value,
+                                           payoff=event.payoff,
+                                           token_address=event.token))
+        elif tag == 'added':
+            diff = diff._replace(amount=event.value)
+        elif tag == 'redeemed':
+            diff = diff._replace(secret=event.secret)
+        diffs.append(diff)
+    return diffs
+
+
+def assign(owners: Sequence[Optional[int]], workers: Iterable[int]) -> List[int]:
+    """Owner of every prefix once workers joined or left, moving as few prefixes as possible"""
+    workers = sorted(workers)
+    if not workers:
+        raise ValueError('no workers to assign prefixes to')
+    share, extra = divmod(len(owners), len(workers))
+    quota = {worker: share + (i < extra) for i, worker in enumerate(workers)}
+    counts = dict.fromkeys(workers, 0)
+    result: List[Optional[int]] = [None] * len(owners)
+    for i, owner in enumerate(owners):
+        if owner in counts and counts[owner] < quota[owner]:
+            result[i] = owner
+            counts[owner] += 1
+    vacancies = iter([worker for worker in workers for _ in range(quota[worker] - counts[worker])])
+    return [next(vacancies) if owner is None else owner for owner in result]
+
+
+class Shard:
+    """Open swaps of some prefixes, the state of one worker"""
+
+    def __init__(self, retention: int = RETENTION):
+        self.retention = retention
+        self.swaps: Dict[bytes, Dict[Tuple[str, str], Swap]] = {}
+        self.secrets: Dict[bytes, bytes] = {}
+        self.reported: Set[Tuple[str, str, str, bytes]] = set()
+        self.closed: Set[bytes] = set()
+        # Hashed secrets with no open leg left, with the time of the first check that saw them so
+        self.emptied: Dict[bytes, Optional[int]] = {}
+
+    def apply(self, diffs: Iterable[Diff]):
+        for diff in diffs:
+            legs = self.swaps.setdefault(diff.hashed_secret, {})
+            key = (diff.chain, diff.vault)
+            if diff.tag == 'initiated':
+                legs[key] = diff.swap
+            elif diff.tag == 'added' and key in legs:
+                legs[key] = legs[key]._replace(amount=diff.amount)
+            elif diff.tag in ('redeemed', 'refunded'):
+                legs.pop(key, None)
+                self.reported.discard(('redeemable', *key, diff.hashed_secret))
+                self.reported.discard(('refundable', *key, diff.hashed_secret))
+                if diff.secret is not None:
+                    self.secrets[diff.hashed_secret] = diff.secret
+            if legs:
+                self.emptied.pop(diff.hashed_secret, None)
+            else:
+                self.emptied.setdefault(diff.hashed_secret, None)
+
+    def _forget(self, hashed_secret: bytes):
+        self.swaps.pop(hashed_secret, None)
+        self.secrets.pop(hashed_secret, None)
+        self.emptied.pop(hashed_secret, None)
+        self.closed.add(hashed_secret)
+
+    def check(self, now: int) -> Tuple[List[Alert], List[bytes]]:
+        """New alerts, and the hashed secrets forgotten since the last check, `retention` after their last leg closed"""
+        for hashed_secret, since in list(self.emptied.items()):
+            if since is None:
+                self.emptied[hashed_secret] = since = now
+            if now - since >= self.retention:
+                self._forget(hashed_secret)
+        alerts = []
+        for hashed_secret, legs in self.swaps.items():
+            secret = self.secrets.get(hashed_secret)
+            for (chain, vault), swap in legs.items():
+                if secret is not None and now < swap.refund_time:
+                    alert = Alert('redeemable', chain, vault, hashed_secret, secret)
+                elif swap.refund_time <= now:
+                    alert = Alert('refundable', chain, vault, hashed_secret)
+                else:
+                    continue
+                if alert[:4] not in self.reported:
+                    self.reported.add(alert[:4])
+                    alerts.append(alert)
+        closed = list(self.closed)
+        self.closed = set()
+        return alerts, closed
+
+    def drop(self, prefixes: Iterable[int]):
+        """Forget the swaps of prefixes moved to another worker"""
+        prefixes = set(prefixes)
+        for hashed_secret in [h for h in self.swaps if prefix(h) in prefixes]:
+            del self.swaps[hashed_secret]
+            self.secrets.pop(hashed_secret, None)
+            self.emptied.pop(hashed_secret, None)
+        self.reported = {item for item in self.reported if prefix(item[3]) not in prefixes}
+
+
+def serve(conn, retention: int = RETENTION):
+    """Worker loop, commands come from the coordinator over `conn`"""
+    shard = Shard(retention)
+    while True:
+        command, payload = conn.recv()
+        if command == 'diffs':
+            shard.apply(payload)
+        elif command == 'check':
+            conn.send(shard.check(payload))
+        elif command == 'drop':
+            shard.drop(payload)
+        elif command == 'stop':
+            break
+    conn.close()
+
+
+class Watcher:
+
+    def __init__(self, workers: Optional[int] = None, context=None, retention: int = RETENTION):
+        """
+        :param workers: number of worker processes, one per core by default
+        :param context: multiprocessing context to start the workers with
+        :param retention: seconds a hashed secret with no open leg left is kept for
+        """
+        self.context = context or multiprocessing.get_context()
+        self.retention = retention
+        self.workers: Dict[int, tuple] = {}
+        self.owners: List[Optional[int]] = [None] * PREFIXES
+        self.journal: List[Dict[bytes, List[Diff]]] = [{} for _ in range(PREFIXES)]
+        self._next_id = 0
+        for _ in range(workers or os.cpu_count()):
+            self.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def join(self) -> int:
+        """Start a worker and give it its share of the prefixes"""
+        worker = self._next_id
+        self._next_id += 1
+        conn, child = self.context.Pipe()
+        process = self.context.Process(target=serve, args=(child, self.retention), daemon=True)
+        process.start()
+        child.close()
+        self.workers[worker] = (process, conn)
+        self._rebalance()
+        return worker
+
+    def leave(self, worker: int):
+        """Stop a worker, its prefixes are moved to the others"""
+        process, conn = self.workers.pop(worker)
+        self._rebalance()
+        try:
+            conn.send(('stop', None))
+        except OSError:
+            pass
+        conn.close()
+        process.join()
+
+    def close(self):
+        for process, conn in self.workers.values():
+            try:
+                conn.send(('stop', None))
+            except OSError:
+                pass
+            conn.close()
+            process.join()
+        self.workers = {}
+
+    def _lost(self, worker: int):
+        process, conn = self.workers.pop(worker)
+        conn.close()
+        process.join()
+        self._rebalance()
+
+    def _send(self, worker: int, message) -> bool:
+        try:
+            self.workers[worker][1].send(message)
+            return True
+        except OSError:
+            return False
+
+    def _rebalance(self):
+        owners = assign(self.owners, self.workers)
+        dropped: Dict[int, List[int]] = defaultdict(list)
+        moved: Dict[int, List[Diff]] = defaultdict(list)
+        for i, (old, new) in enumerate(zip(self.owners, owners)):
+            if old == new:
+                continue
+            if old in self.workers:
+                dropped[old].append(i)
+            for diffs in self.journal[i].values():
+                moved[new].extend(diffs)
+        self.owners = owners
+        lost = [worker for worker, prefixes in dropped.items() if not self._send(worker, ('drop', prefixes))]
+        lost.extend(worker for worker, diffs in moved.items() if not self._send(worker, ('diffs', diffs)))
+        for worker in lost:
+            if worker in self.workers:
+                self._lost(worker)
+
+    def ingest(self, diffs: Iterable[Diff]):
+        """Journal the diffs and send every worker the ones of its prefixes"""
+        shards: Dict[int, List[Diff]] = defaultdict(list)
+        for diff in diffs:
+            i = prefix(diff.hashed_secret)
+            self.journal[i].setdefault(diff.hashed_secret, []).append(diff)
+            shards[self.owners[i]].append(diff)
+        lost = [worker for worker, shard in shards.items() if not self._send(worker, ('diffs', shard))]
+        for worker in lost:
+            if worker in self.workers:
+                self._lost(worker)
+
+    def check(self, now: int) -> List[Alert]:
+        """Alerts of every worker, replacing the workers that died"""
+        alerts = []
+        while True:
+            asked = [worker for worker in list(self.workers) if self._send(worker, ('check', now))]
+            lost = set(self.workers) - set(asked)
+            for worker in asked:
+                try:
+                    shard_alerts, closed = self.workers[worker][1].recv()
+                except (EOFError, OSError):
+                    lost.add(worker)
+                    continue
+                alerts.extend(shard_alerts)
+                for hashed_secret in closed:
+                    self.journal[prefix(hashed_secret)].pop(hashed_secret, None)
+            if not lost:
+                return alerts
+            for worker in lost:
+                self._lost(worker)
+
+    def run(self, sources: Sequence[Callable[[], List[Diff]]], on_alert: Callable[[Alert], None],
+            interval: float = 5, clock: Callable[[], float] = time):
+        while True:
+            for source in sources:
+                self.ingest(source())
+            for alert in self.check(int(clock())):
+                on_alert(alert)
+            sleep(interval)
+
+
+def tezos_source(shell, vaults: Dict[str, str], from_level: int) -> Callable[[], List[Diff]]:
+    """Diffs of the blocks baked since the last call, `vaults` maps vault addresses to vault names"""
+    next_level = from_level
+
+    def fetch() -> List[Diff]:
+        nonlocal next_level
+        diffs = []
+        head = shell.head.header()['level']
+        for level in range(next_level, head + 1):
+            operations = shell.blocks[level].operations.managers()
+            diffs.extend(tezos_diffs(block_events(operations, list(vaults), level), vaults))
+        next_level = max(next_level, head + 1)
+        return diffs
+
+    return fetch
+
+
+def ethereum_source(rpc, vaults: Dict[str, str], from_block: int) -> Callable[[], List[Diff]]:
+    """Diffs of the blocks mined since the last call, `vaults` maps lowercase vault addresses to vault names"""
+    scanner = Scanner(rpc, build_filters(list(vaults)))
+    next_block = from_block
+
+    def fetch() -> List[Diff]:
+        nonlocal next_block
+        head = int(rpc.call('eth_blockNumber'), 16)
+        if head < next_block:
+            return []
+        events = scanner.scan(next_block, head)
+        next_block = head + 1
+        return ethereum_diffs(events, vaults)
+
+    return fetch
+
+
+if __name__ == '__main__':
+    from atomex.ethereum import EthereumRpc
+    from atomex.pool import tezos_shell
+
+    parser = argparse.ArgumentParser(description='Watch open swaps with one worker process per core')
+    parser.add_argument('--tezos-node', type=str, help='node URL, or comma separated URLs of a pool')
+    parser.add_argument('--tezos-vault', type=str, action='append', default=[], help='name=address')
+    parser.add_argument('--from-level', type=int, default=0)
+    parser.add_argument('--ethereum-node', type=str)
+    parser.add_argument('--ethereum-vault', type=str, action='append', default=[], help='name=address')
+    parser.add_argument('--from-block', type=int, default=0)
+    parser.add_argument('-j', type=int, help='number of workers, one per core by default')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between polls')
+    parser.add_argument('--retention', type=int, default=RETENTION,
+                        help='seconds a secret is kept after the last known leg of its swap closed')
+    args = parser.parse_args()
+
+    sources = []
+    if args.tezos_node:
+        tezos_vaults = {address: name for name, address in (item.split('=', 1) for item in args.tezos_vault)}
+        sources.append(tezos_source(tezos_shell(args.tezos_node), tezos_vaults, args.from_level))
+    if args.ethereum_node:
+        ethereum_vaults = {address.lower(): name for name, address in (item.split('=', 1) for item in args.ethereum_vault)}
+        sources.append(ethereum_source(EthereumRpc(args.ethereum_node), ethereum_vaults, args.from_block))
+
+    def dump(alert: Alert):
+        record = {k: (v.hex() if isinstance(v, bytes) else v) for k, v in alert._asdict().items()}
+        print(json.dumps(record), flush=True)
+
+    with Watcher(args.j, retention=args.retention) as watcher:
+        watcher.run(sources, dump, args.interval)
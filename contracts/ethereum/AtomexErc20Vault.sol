@@ -4,27 +4,30 @@ pragma solidity ^0.8.0;
 
 import "@openzeppelin/contracts/security/ReentrancyGuard.sol";
 import "@openzeppelin/contracts/utils/Address.sol";
+import "@openzeppelin/contracts/utils/math/SafeCast.sol";
 import "@openzeppelin/contracts/utils/math/SafeMath.sol";
 import "@openzeppelin/contracts/token/ERC20/IERC20.sol";
+import "@openzeppelin/contracts/token/ERC20/extensions/draft-IERC20Permit.sol";
 import "@openzeppelin/contracts/token/ERC20/utils/SafeERC20.sol";
 
 contract AtomexErc20Vault is ReentrancyGuard {
+    using SafeCast for uint256;
     using SafeMath for uint256;
     using SafeERC20 for IERC20;
 
     enum State { Empty, Initiated, Redeemed, Refunded }
 
+    // Packed into 4 slots, the hashed secret is the mapping key
     struct Swap {
-        bytes32 hashedSecret;
-        address contractAddr;
-        address participant;
         address payable initiator;
-        uint256 refundTimestamp;
-        uint256 countdown;
-        uint256 value;
-        uint256 payoff;
+        uint64 refundTimestamp;
         bool active;
         State state;
+        address participant;
+        uint64 countdown;
+        address contractAddr;
+        uint128 value;
+        uint128 payoff;
     }
 
     event Initiated(
@@ -58,6 +61,14 @@ contract AtomexErc20Vault is ReentrancyGuard {
         bytes32 indexed _hashedSecret
     );
 
+    // Transfers of a batch, merged per token and recipient
+    struct Payouts {
+        address[] tokens;
+        address[] recipients;
+        uint256[] amounts;
+        uint256 count;
+    }
+
     mapping(bytes32 => Swap) public swaps;
 
     modifier onlyByInitiator(bytes32 _hashedSecret) {
@@ -111,16 +122,16 @@ contract AtomexErc20Vault is ReentrancyGuard {
     {
         IERC20(_contract).safeTransferFrom(msg.sender, address(this), _value);
 
-        swaps[_hashedSecret].value = _value.sub(_payoff);
-        swaps[_hashedSecret].hashedSecret = _hashedSecret;
-        swaps[_hashedSecret].contractAddr = _contract;
-        swaps[_hashedSecret].participant = _participant;
-        swaps[_hashedSecret].initiator = payable(msg.sender);
-        swaps[_hashedSecret].refundTimestamp = _refundTimestamp;
-        swaps[_hashedSecret].countdown = _countdown;
-        swaps[_hashedSecret].payoff = _payoff;
-        swaps[_hashedSecret].active = _active;
-        swaps[_hashedSecret].state = State.Initiated;
+        Swap storage swap = swaps[_hashedSecret];
+        swap.initiator = payable(msg.sender);
+        swap.refundTimestamp = _refundTimestamp.toUint64();
+        swap.active = _active;
+        swap.state = State.Initiated;
+        swap.participant = _participant;
+        swap.countdown = _countdown.toUint64();
+        swap.contractAddr = _contract;
+        swap.value = _value.sub(_payoff).toUint128();
+        swap.payoff = _payoff.toUint128();
 
         emit Initiated(
             _hashedSecret,
@@ -135,13 +146,26 @@ contract AtomexErc20Vault is ReentrancyGuard {
         );
     }
 
+    // Approves the vault with an EIP-2612 permit and initiates in the same transaction.
+    // If the token has no permit or the permit fails (e.g. it was already submitted by someone else),
+    // the initiation relies on the allowance the initiator has granted so far.
+    function initiateWithPermit (
+        bytes32 _hashedSecret, address _contract, address _participant, uint256 _refundTimestamp,
+        uint256 _countdown, uint256 _value, uint256 _payoff, bool _active,
+        uint256 _deadline, uint8 _v, bytes32 _r, bytes32 _s)
+        external
+    {
+        permit(_contract, _value, _deadline, _v, _r, _s);
+        initiate(_hashedSecret, _contract, _participant, _refundTimestamp, _countdown, _value, _payoff, _active);
+    }
+
     function add (bytes32 _hashedSecret, uint _value)
         public nonReentrant isInitiated(_hashedSecret) isAddable(_hashedSecret)
     {
         IERC20(swaps[_hashedSecret].contractAddr)
             .safeTransferFrom(msg.sender, address(this), _value);
 
-        swaps[_hashedSecret].value = swaps[_hashedSecret].value.add(_value);
+        swaps[_hashedSecret].value = uint256(swaps[_hashedSecret].value).add(_value).toUint128();
 
         emit Added(
             _hashedSecret,
@@ -163,43 +187,131 @@ contract AtomexErc20Vault is ReentrancyGuard {
     function redeem(bytes32 _hashedSecret, bytes32 _secret)
         public nonReentrant isInitiated(_hashedSecret) isActivated(_hashedSecret) isRedeemable(_hashedSecret, _secret)
     {
-        swaps[_hashedSecret].state = State.Redeemed;
+        Swap memory swap = swaps[_hashedSecret];
+        spend(_hashedSecret, State.Redeemed);
 
-        if (block.timestamp > swaps[_hashedSecret].refundTimestamp.sub(swaps[_hashedSecret].countdown)) {
+        if (block.timestamp > uint256(swap.refundTimestamp).sub(swap.countdown)) {
 
-            IERC20(swaps[_hashedSecret].contractAddr)
-                .safeTransfer(swaps[_hashedSecret].participant, swaps[_hashedSecret].value);
+            IERC20(swap.contractAddr)
+                .safeTransfer(swap.participant, swap.value);
 
-            if(swaps[_hashedSecret].payoff > 0) {
-                IERC20(swaps[_hashedSecret].contractAddr)
-                    .safeTransfer(msg.sender, swaps[_hashedSecret].payoff);
+            if(swap.payoff > 0) {
+                IERC20(swap.contractAddr)
+                    .safeTransfer(msg.sender, swap.payoff);
             }
         }
         else {
-            IERC20(swaps[_hashedSecret].contractAddr)
-                .safeTransfer(swaps[_hashedSecret].participant, swaps[_hashedSecret].value.add(swaps[_hashedSecret].payoff));
+            IERC20(swap.contractAddr)
+                .safeTransfer(swap.participant, uint256(swap.value).add(swap.payoff));
         }
 
         emit Redeemed(
             _hashedSecret,
             _secret
         );
-
-        delete swaps[_hashedSecret];
     }
 
     function refund(bytes32 _hashedSecret)
         public nonReentrant isInitiated(_hashedSecret) isRefundable(_hashedSecret)
     {
-        swaps[_hashedSecret].state = State.Refunded;
+        Swap memory swap = swaps[_hashedSecret];
+        spend(_hashedSecret, State.Refunded);
 
-        IERC20(swaps[_hashedSecret].contractAddr)
-            .safeTransfer(swaps[_hashedSecret].initiator, swaps[_hashedSecret].value.add(swaps[_hashedSecret].payoff));
+        IERC20(swap.contractAddr)
+            .safeTransfer(swap.initiator, uint256(swap.value).add(swap.payoff));
 
         emit Refunded(
             _hashedSecret
         );
+    }
+
+    function redeemBatch(bytes32[] calldata _hashedSecrets, bytes32[] calldata _secrets)
+        external nonReentrant
+    {
+        require(_hashedSecrets.length == _secrets.length, "hashes and secrets lengths differ");
+        Payouts memory payouts = newPayouts(_hashedSecrets.length * 2);
+
+        for (uint256 i = 0; i < _hashedSecrets.length; i++) {
+            Swap memory swap = swaps[_hashedSecrets[i]];
+            require(swap.state == State.Initiated, "swap for this hash is empty or already spent");
+            require(swap.active, "swap is not active");
+            require(block.timestamp < swap.refundTimestamp, "refundTimestamp has already come");
+            require(sha256(abi.encodePacked(sha256(abi.encodePacked(_secrets[i])))) == _hashedSecrets[i], "secret is not correct");
+            spend(_hashedSecrets[i], State.Redeemed);
+
+            if (block.timestamp > uint256(swap.refundTimestamp).sub(swap.countdown)) {
+                credit(payouts, swap.contractAddr, swap.participant, swap.value);
+                credit(payouts, swap.contractAddr, msg.sender, swap.payoff);
+            }
+            else {
+                credit(payouts, swap.contractAddr, swap.participant, uint256(swap.value).add(swap.payoff));
+            }
+
+            emit Redeemed(
+                _hashedSecrets[i],
+                _secrets[i]
+            );
+        }
+
+        pay(payouts);
+    }
 
+    function refundBatch(bytes32[] calldata _hashedSecrets)
+        external nonReentrant
+    {
+        Payouts memory payouts = newPayouts(_hashedSecrets.length);
+
+        for (uint256 i = 0; i < _hashedSecrets.length; i++) {
+            Swap memory swap = swaps[_hashedSecrets[i]];
+            require(swap.state == State.Initiated, "swap for this hash is empty or already spent");
+            require(block.timestamp >= swap.refundTimestamp, "refundTimestamp has not come");
+            spend(_hashedSecrets[i], State.Refunded);
+
+            credit(payouts, swap.contractAddr, swap.initiator, uint256(swap.value).add(swap.payoff));
+
+            emit Refunded(
+                _hashedSecrets[i]
+            );
+        }
+
+        pay(payouts);
+    }
+
+    // Clears the swap slots but keeps the final state so that the hashed secret can't be initiated again
+    function spend(bytes32 _hashedSecret, State _state) internal {
         delete swaps[_hashedSecret];
+        swaps[_hashedSecret].state = _state;
+    }
+
+    function newPayouts(uint256 _size) internal pure returns (Payouts memory) {
+        return Payouts(new address[](_size), new address[](_size), new uint256[](_size), 0);
+    }
+
+    function credit(Payouts memory _payouts, address _token, address _recipient, uint256 _amount) internal pure {
+        if (_amount == 0) {
+            return;
+        }
+        for (uint256 i = 0; i < _payouts.count; i++) {
+            if (_payouts.tokens[i] == _token && _payouts.recipients[i] == _recipient) {
+                _payouts.amounts[i] = _payouts.amounts[i].add(_amount);
+                return;
+            }
+        }
+        _payouts.tokens[_payouts.count] = _token;
+        _payouts.recipients[_payouts.count] = _recipient;
+        _payouts.amounts[_payouts.count] = _amount;
+        _payouts.count++;
+    }
+
+    function pay(Payouts memory _payouts) internal {
+        for (uint256 i = 0; i < _payouts.count; i++) {
+            IERC20(_payouts.tokens[i]).safeTransfer(_payouts.recipients[i], _payouts.amounts[i]);
+        }
+    }
+
+    function permit(address _token, uint256 _value, uint256 _deadline, uint8 _v, bytes32 _r, bytes32 _s) internal {
+        try IERC20Permit(_token).permit(msg.sender, address(this), _value, _deadline, _v, _r, _s) {
+        } catch {
+        }
     }
 }
\ No newline at end of file
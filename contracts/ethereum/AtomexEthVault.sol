@@ -3,23 +3,25 @@
 pragma solidity ^0.8.0;
 
 import "@openzeppelin/contracts/security/ReentrancyGuard.sol";
+import "@openzeppelin/contracts/utils/math/SafeCast.sol";
 import "@openzeppelin/contracts/utils/math/SafeMath.sol";
 
 contract AtomexEthVault is ReentrancyGuard {
+    using SafeCast for uint256;
     using SafeMath for uint256;
 
     enum State { Empty, Initiated, Redeemed, Refunded }
 
+    // Packed into 3 slots, the hashed secret is the mapping key
     struct Swap {
-        bytes32 hashedSecret;
         address payable initiator;
-        address payable participant;
-        uint256 refundTimestamp;
-        uint256 countdown;
-        uint256 value;
-        uint256 payoff;
+        uint64 refundTimestamp;
         bool active;
         State state;
+        address payable participant;
+        uint64 countdown;
+        uint128 value;
+        uint128 payoff;
     }
 
     event Initiated(
@@ -52,6 +54,13 @@ contract AtomexEthVault is ReentrancyGuard {
         bytes32 indexed _hashedSecret
     );
 
+    // Transfers of a batch, merged per recipient
+    struct Payouts {
+        address payable[] recipients;
+        uint256[] amounts;
+        uint256 count;
+    }
+
     mapping(bytes32 => Swap) public swaps;
 
     modifier onlyByInitiator(bytes32 _hashedSecret) {
@@ -104,15 +113,15 @@ contract AtomexEthVault is ReentrancyGuard {
         uint256 _countdown, uint256 _payoff, bool _active)
         public payable nonReentrant isInitiatable(_hashedSecret, _participant, _refundTimestamp, _countdown)
     {
-        swaps[_hashedSecret].value = msg.value.sub(_payoff);
-        swaps[_hashedSecret].hashedSecret = _hashedSecret;
-        swaps[_hashedSecret].participant = _participant;
-        swaps[_hashedSecret].initiator = payable(msg.sender);
-        swaps[_hashedSecret].refundTimestamp = _refundTimestamp;
-        swaps[_hashedSecret].countdown = _countdown;
-        swaps[_hashedSecret].payoff = _payoff;
-        swaps[_hashedSecret].active = _active;
-        swaps[_hashedSecret].state = State.Initiated;
+        Swap storage swap = swaps[_hashedSecret];
+        swap.initiator = payable(msg.sender);
+        swap.refundTimestamp = _refundTimestamp.toUint64();
+        swap.active = _active;
+        swap.state = State.Initiated;
+        swap.participant = _participant;
+        swap.countdown = _countdown.toUint64();
+        swap.value = msg.value.sub(_payoff).toUint128();
+        swap.payoff = _payoff.toUint128();
 
         emit Initiated(
             _hashedSecret,
@@ -129,7 +138,7 @@ contract AtomexEthVault is ReentrancyGuard {
     function add (bytes32 _hashedSecret)
         public payable nonReentrant isInitiated(_hashedSecret) isAddable(_hashedSecret)
     {
-        swaps[_hashedSecret].value = swaps[_hashedSecret].value.add(msg.value);
+        swaps[_hashedSecret].value = uint256(swaps[_hashedSecret].value).add(msg.value).toUint128();
 
         emit Added(
             _hashedSecret,
@@ -151,37 +160,118 @@ contract AtomexEthVault is ReentrancyGuard {
     function redeem(bytes32 _hashedSecret, bytes32 _secret)
         public nonReentrant isInitiated(_hashedSecret) isActivated(_hashedSecret) isRedeemable(_hashedSecret, _secret)
     {
-        swaps[_hashedSecret].state = State.Redeemed;
+        Swap memory swap = swaps[_hashedSecret];
+        spend(_hashedSecret, State.Redeemed);
 
         emit Redeemed(
             _hashedSecret,
             _secret
         );
 
-        if (block.timestamp > swaps[_hashedSecret].refundTimestamp.sub(swaps[_hashedSecret].countdown)) {
-            swaps[_hashedSecret].participant.transfer(swaps[_hashedSecret].value);
-            if (swaps[_hashedSecret].payoff > 0) {
-                payable(msg.sender).transfer(swaps[_hashedSecret].payoff);
+        if (block.timestamp > uint256(swap.refundTimestamp).sub(swap.countdown)) {
+            swap.participant.transfer(swap.value);
+            if (swap.payoff > 0) {
+                payable(msg.sender).transfer(swap.payoff);
             }
         }
         else {
-            swaps[_hashedSecret].participant.transfer(swaps[_hashedSecret].value.add(swaps[_hashedSecret].payoff));
+            swap.participant.transfer(uint256(swap.value).add(swap.payoff));
         }
-
-        delete swaps[_hashedSecret];
     }
 
     function refund(bytes32 _hashedSecret)
         public isInitiated(_hashedSecret) isRefundable(_hashedSecret)
     {
-        swaps[_hashedSecret].state = State.Refunded;
+        Swap memory swap = swaps[_hashedSecret];
+        spend(_hashedSecret, State.Refunded);
 
         emit Refunded(
             _hashedSecret
         );
 
-        swaps[_hashedSecret].initiator.transfer(swaps[_hashedSecret].value.add(swaps[_hashedSecret].payoff));
+        swap.initiator.transfer(uint256(swap.value).add(swap.payoff));
+    }
+
+    function redeemBatch(bytes32[] calldata _hashedSecrets, bytes32[] calldata _secrets)
+        external nonReentrant
+    {
+        require(_hashedSecrets.length == _secrets.length, "hashes and secrets lengths differ");
+        Payouts memory payouts = newPayouts(_hashedSecrets.length + 1);
+
+        for (uint256 i = 0; i < _hashedSecrets.length; i++) {
+            Swap memory swap = swaps[_hashedSecrets[i]];
+            require(swap.state == State.Initiated, "swap for this hash is empty or already spent");
+            require(swap.active, "swap is not active");
+            require(block.timestamp < swap.refundTimestamp, "refundTimestamp has already come");
+            require(sha256(abi.encodePacked(sha256(abi.encodePacked(_secrets[i])))) == _hashedSecrets[i], "secret is not correct");
+            spend(_hashedSecrets[i], State.Redeemed);
+
+            emit Redeemed(
+                _hashedSecrets[i],
+                _secrets[i]
+            );
+
+            if (block.timestamp > uint256(swap.refundTimestamp).sub(swap.countdown)) {
+                credit(payouts, swap.participant, swap.value);
+                credit(payouts, payable(msg.sender), swap.payoff);
+            }
+            else {
+                credit(payouts, swap.participant, uint256(swap.value).add(swap.payoff));
+            }
+        }
+
+        pay(payouts);
+    }
+
+    function refundBatch(bytes32[] calldata _hashedSecrets)
+        external nonReentrant
+    {
+        Payouts memory payouts = newPayouts(_hashedSecrets.length);
+
+        for (uint256 i = 0; i < _hashedSecrets.length; i++) {
+            Swap memory swap = swaps[_hashedSecrets[i]];
+            require(swap.state == State.Initiated, "swap for this hash is empty or already spent");
+            require(block.timestamp >= swap.refundTimestamp, "refundTimestamp has not come");
+            spend(_hashedSecrets[i], State.Refunded);
+
+            emit Refunded(
+                _hashedSecrets[i]
+            );
+
+            credit(payouts, swap.initiator, uint256(swap.value).add(swap.payoff));
+        }
+
+        pay(payouts);
+    }
 
+    // Clears the swap slots but keeps the final state so that the hashed secret can't be initiated again
+    function spend(bytes32 _hashedSecret, State _state) internal {
         delete swaps[_hashedSecret];
+        swaps[_hashedSecret].state = _state;
+    }
+
+    function newPayouts(uint256 _size) internal pure returns (Payouts memory) {
+        return Payouts(new address payable[](_size), new uint256[](_size), 0);
+    }
+
+    function credit(Payouts memory _payouts, address payable _recipient, uint256 _amount) internal pure {
+        if (_amount == 0) {
+            return;
+        }
+        for (uint256 i = 0; i < _payouts.count; i++) {
+            if (_payouts.recipients[i] == _recipient) {
+                _payouts.amounts[i] = _payouts.amounts[i].add(_amount);
+                return;
+            }
+        }
+        _payouts.recipients[_payouts.count] = _recipient;
+        _payouts.amounts[_payouts.count] = _amount;
+        _payouts.count++;
+    }
+
+    function pay(Payouts memory _payouts) internal {
+        for (uint256 i = 0; i < _payouts.count; i++) {
+            _payouts.recipients[i].transfer(_payouts.amounts[i]);
+        }
     }
 }
\ No newline at end of file
@@ -0,0 +1,19 @@
+// SPDX-License-Identifier: GPL-3.0
+
+pragma solidity ^0.8.0;
+
+import "@openzeppelin/contracts/token/ERC20/extensions/draft-ERC20Permit.sol";
+import "@openzeppelin/contracts/token/ERC20/presets/ERC20PresetFixedSupply.sol";
+
+
+// FiatTokenV1 with EIP-2612 permit (version "1" of the EIP-712 domain)
+contract FiatTokenV2 is ERC20PresetFixedSupply, ERC20Permit {
+
+    constructor(
+        string memory name,
+        string memory symbol,
+        uint256 initialSupply,
+        address owner
+    ) ERC20PresetFixedSupply(name, symbol, initialSupply, owner) ERC20Permit(name) {
+    }
+}
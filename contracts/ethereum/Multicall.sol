@@ -0,0 +1,24 @@
+// SPDX-License-Identifier: MIT
+
+pragma solidity ^0.8.0;
+
+/// Aggregates read-only calls into a single eth_call, ABI compatible with MakerDAO Multicall
+contract Multicall {
+
+    struct Call {
+        address target;
+        bytes callData;
+    }
+
+    function aggregate(Call[] calldata calls)
+        external view returns (uint256 blockNumber, bytes[] memory returnData)
+    {
+        blockNumber = block.number;
+        returnData = new bytes[](calls.length);
+        for (uint256 i = 0; i < calls.length; i++) {
+            (bool success, bytes memory ret) = calls[i].target.staticcall(calls[i].callData);
+            require(success, "multicall call failed");
+            returnData[i] = ret;
+        }
+    }
+}
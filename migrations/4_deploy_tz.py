@@ -1,32 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from urllib.parse import urlencode
+from urllib.request import urlopen
 from pytezos import ContractInterface, pytezos
+from pytezos.michelson.forge import forge_micheline, forge_script_expr
+from pytezos.operation.result import OperationResult
+from pytezos.rpc.node import RpcNotFoundError
+from atomex.pool import tezos_shell
 import argparse
+import json
 import os
+import sys
 
 
-def deploy_contract(filename, ptz):
-    print(f'deploying {filename}...')
+def code_hash(code):
+    return forge_script_expr(b'\x05' + forge_micheline(code))
+
+
+def is_origination(content, source, address=None):
+    """An applied origination by `source`, of `address` if given"""
+    if content['kind'] != 'origination' or content['source'] != source:
+        return False
+    result = content['metadata']['operation_result']
+    return result['status'] == 'applied' and (address is None or address in result.get('originated_contracts', []))
+
+
+def find_deployment(ptz, deployment, expected_hash):
+    """Check that a manifest entry is an origination by our key of the same code.
+
+    Only a contract the node doesn't know or a mismatch mean it is not deployed, any other
+    error is raised so that a failing node can't make us originate the contract twice.
+    """
+    try:
+        script = ptz.shell.contracts[deployment['address']].script()
+    except RpcNotFoundError:
+        return False
+    if code_hash(script['code']) != expected_hash:
+        return False
+
+    source = ptz.key.public_key_hash()
+    for opg in ptz.shell.blocks[deployment['level']].operations.managers():
+        if opg['hash'] == deployment['operation']:
+            return any(is_origination(content, source, deployment['address']) for content in opg['contents'])
+    return False
+
+
+def indexer_originations(indexer_url, source, page=1000):
+    """Applied originations sent by `source`, newest first, from a TzKT indexer"""
+    last_id = None
+    while True:
+        query = {'sender': source, 'status': 'applied', 'sort.desc': 'id', 'limit': page}
+        if last_id is not None:
+            query['id.lt'] = last_id
+        with urlopen(f'{indexer_url.rstrip("/")}/v1/operations/originations?{urlencode(query)}', timeout=30) as res:
+            originations = json.loads(res.read())
+        for origination in originations:
+            if origination.get('originatedContract'):
+                yield {'address': origination['originatedContract']['address'], 'level': origination['level'],
+                       'operation': origination['hash']}
+        if len(originations) < page:
+            return
+        last_id = originations[-1]['id']
+
+
+def find_origination(ptz, expected_hash, originations):
+    """First of the originations by our key (see `indexer_originations`) the node confirms is of the same code,
+    e.g. one sent right before a crash that left the manifest unwritten"""
+    for candidate in originations:
+        deployment = dict(candidate, code_hash=expected_hash, originator=ptz.key.public_key_hash())
+        if find_deployment(ptz, deployment, expected_hash):
+            return deployment
+    return None
+
+
+def inclusion_level(ptz, opg_result):
+    """Level of the block including an operation group, searched from the head down to its branch"""
+    branch_level = ptz.shell.blocks[opg_result['branch']].header()['level']
+    head = ptz.shell.head.header()['level']
+    for level in range(head, branch_level, -1):
+        if any(opg_result['hash'] in hashes for hashes in ptz.shell.blocks[level].operation_hashes()):
+            return level
+    raise ValueError(f'operation {opg_result["hash"]} is not included between levels {branch_level} and {head}')
+
+
+def deploy_contract(filename, ptz, deployments, log, indexer_url=None):
+    name = os.path.splitext(os.path.basename(filename))[0]
     with open(filename, 'r') as f:
         contract_michelson = f.read()
 
     contract = ContractInterface.from_michelson(contract_michelson)
-    opg = ptz.origination(contract.script()).send(ttl=1)
-    print(f'success: {opg.opg_hash}')
+    script = contract.script()
+    expected_hash = code_hash(script['code'])
+
+    deployment = deployments.get(name)
+    if deployment and deployment['code_hash'] == expected_hash and find_deployment(ptz, deployment, expected_hash):
+        log(f'{name} is already deployed at {deployment["address"]}, skipping')
+        return deployment
+
+    if indexer_url is None:
+        raise ValueError(f'{name} has no matching manifest entry and there is no indexer to look up earlier originations')
+    deployment = find_origination(ptz, expected_hash, indexer_originations(indexer_url, ptz.key.public_key_hash()))
+    if deployment:
+        log(f'{name} was originated by our key at {deployment["address"]}, skipping')
+        return deployment
+
+    log(f'deploying {name}...')
+    opg = ptz.origination(script).send(min_confirmations=1)
+    address = OperationResult.originated_contracts(opg.opg_result)[0]
+    log(f'success: {opg.opg_hash}, {name} is deployed at {address}')
+    return {
+        'address': address,
+        'code_hash': expected_hash,
+        'level': inclusion_level(ptz, opg.opg_result),
+        'operation': opg.opg_hash,
+        'originator': ptz.key.public_key_hash(),
+    }
+
+
+def deploy_network(node_url, private_key, files, manifest, lock, indexer_url=None):
+    ptz = pytezos.using(shell=tezos_shell(node_url), key=private_key)
+    chain_id = ptz.shell.chains.main.chain_id()
+    log = lambda message: print(f'[{node_url}] {message}', flush=True)
+
+    with lock:
+        network = manifest.setdefault(chain_id, {'contracts': {}})
+        network['network'] = node_url
+        deployments = network['contracts']
+
+    for file in files:
+        name = os.path.splitext(os.path.basename(file))[0]
+        deployment = deploy_contract(file, ptz, deployments, log, indexer_url)
+        with lock:
+            deployments[name] = deployment
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Deploy Atomex contracts to tezos')
-    parser.add_argument('-n', type=str, help='node URL', required=True, default='https://rpc.tzkt.io/mainnet')
+    parser.add_argument('-n', type=str, nargs='+', help='node URLs, one per network (comma separated nodes of a network are pooled)', required=True, default=['https://rpc.tzkt.io/mainnet'])
     parser.add_argument('-p', type=str, help='private key', required=True)
+    parser.add_argument('-m', type=str, help='deployment manifest', default='build/deployments.json')
+    parser.add_argument('-i', type=str, nargs='+', help='TzKT indexer URLs, in the order of the node URLs, to look up originations missing from the manifest', default=[])
     args = parser.parse_args()
 
-    if args.n == '':    
+    if '' in args.n:
         raise argparse.ArgumentError(None, 'empty node URL')
 
-    print(f'Node URL: {args.n}')
+    print(f'Node URLs: {", ".join(args.n)}')
+    if args.i and len(args.i) != len(args.n):
+        raise argparse.ArgumentError(None, 'one indexer URL per node URL')
+    indexers = dict(zip(args.n, args.i))
     if args.p == '':
         raise argparse.ArgumentError(None, 'empty private key')
 
-    ptz = pytezos.using(shell=args.n, key=args.p)
-
     cwd = os.getcwd()
     files = [
         f'{cwd}/build/contracts/tez_vault.tz',
@@ -34,5 +159,26 @@ if __name__ == '__main__':
         f'{cwd}/build/contracts/fa2_vault.tz',
     ]
 
-    for file in files:
-        deploy_contract(file, ptz)
+    manifest = {}
+    if os.path.exists(args.m):
+        with open(args.m, 'r') as f:
+            manifest = json.load(f)
+
+    failed = []
+    lock = Lock()
+    with ThreadPoolExecutor(max_workers=len(args.n)) as executor:
+        futures = {url: executor.submit(deploy_network, url, args.p, files, manifest, lock, indexers.get(url)) for url in args.n}
+        for url, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f'[{url}] failed: {e}')
+                failed.append(url)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.m)), exist_ok=True)
+    with open(args.m, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f'manifest: {args.m}')
+
+    if failed:
+        sys.exit(1)
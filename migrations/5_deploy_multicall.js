@@ -0,0 +1,5 @@
+var Multicall = artifacts.require("../contracts/ethereum/Multicall.sol");
+
+module.exports = function(deployer) {
+  deployer.deploy(Multicall);
+};
@@ -0,0 +1,101 @@
+"""Pytest hooks of the gas profiler, and fixtures shared by the tests of the relayer and the keeper"""
+from types import SimpleNamespace
+
+from atomex.vaults import TEZ_VAULT, Swap
+
+fa_address = 'KT1TjdF4H8H2qzxichtEbiCwHxCRM1SVx6B7'
+vault_address = 'KT1VG2WtYdSWz5E7chTeAdDPZNy2MpP8pTWL'
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+secret = bytes.fromhex('dca15ce0c01f61ab03139b4673f4bd902203dc3b898a89a5d35bad794e5cfd4f')
+hashed_secret = bytes.fromhex('05bce5c12071fbca95b13d49cb5ef45323e0216d618bb4575c519b74be75e3da')
+
+
+def make_swap(vault=TEZ_VAULT, payoff=20000, bounty=5000, token_address=None):
+    return Swap(vault=vault,
+                hashed_secret=hashed_secret,
+                initiator=source,
+                participant=party,
+                refund_time=6 * 3600,
+                amount=980000,
+                payoff=payoff,
+                token_address=token_address,
+                bounty=bounty)
+
+
+def make_mempool(entrypoint, argument):
+    """Mempool with a call of the vault entrypoint in each class, and one to another contract"""
+    call = {
+        'kind': 'transaction',
+        'destination': vault_address,
+        'parameters': {'entrypoint': entrypoint, 'value': {'bytes': argument.hex()}},
+    }
+    return {
+        'validated': [{'hash': 'oo1', 'contents': [call]}],
+        'branch_delayed': [['oo2', {'contents': [{**call, 'destination': fa_address}]}]],
+        'refused': [['oo3', {'contents': [call]}]],
+    }
+
+
+class Getter:
+    """Subscriptable RPC path, e.g. `shell.blocks[level]`, answered by `get`"""
+
+    def __init__(self, get):
+        self.get = get
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+
+class StandInClient:
+    """Just enough of a pytezos client for the bots: vault calls are tuples, every call of an operation
+    group simulates to `fee` and sent groups are recorded"""
+
+    def __init__(self, storage=None, mempool=None, fee=1000):
+        self.storage = storage
+        self.fee = fee
+        self.sent = []
+        self.shell = SimpleNamespace(mempool=SimpleNamespace(pending_operations=lambda: mempool or {}))
+
+    def contract(self, address):
+        return SimpleNamespace(storage=self.storage,
+                               redeem=lambda secret: ('redeem', secret),
+                               refund=lambda hashed_secret: ('refund', hashed_secret))
+
+    def bulk(self, *calls):
+        def send():
+            self.sent.append(list(calls))
+            return SimpleNamespace(opg_hash=f'oo{len(self.sent)}')
+
+        return SimpleNamespace(autofill=lambda: SimpleNamespace(contents=[{'fee': str(self.fee)} for _ in calls]),
+                               send=send)
+
+
+def pytest_addoption(parser):
+    parser.addoption('--profile-gas', metavar='NODE_URL', default=None,
+                     help='trace every successful interpret call on the node and attribute its gas')
+    parser.addoption('--profile-output', metavar='PATH', default='gas.folded',
+                     help='where to write the folded gas stacks')
+
+
+def pytest_configure(config):
+    node_url = config.getoption('--profile-gas')
+    if node_url:
+        from pytezos import pytezos
+        from atomex.profiler import GasProfiler
+
+        config._gas_profiler = GasProfiler(pytezos.using(shell=node_url).shell)
+        config._gas_profiler.install()
+
+
+def pytest_runtest_setup(item):
+    profiler = getattr(item.config, '_gas_profiler', None)
+    if profiler:
+        profiler.root = item.name
+
+
+def pytest_unconfigure(config):
+    profiler = getattr(config, '_gas_profiler', None)
+    if profiler:
+        profiler.uninstall()
+        profiler.write(config.getoption('--profile-output'))
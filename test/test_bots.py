@@ -0,0 +1,59 @@
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import TestCase
+
+from pytezos.rpc.node import RpcError
+
+from atomex.bots import estimate_fees, pending_calls, select_profitable, value_in_mutez
+from atomex.vaults import FA12_VAULT, TEZ_VAULT
+from conftest import fa_address, hashed_secret, make_mempool, make_swap, secret, vault_address
+
+
+class Batch:
+    """Operation group simulating to a fee of 100 per call unless one of its calls is bad"""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def autofill(self):
+        if 'bad' in self.calls:
+            raise RpcError('script_rejected')
+        return SimpleNamespace(contents=[{'fee': '100'} for _ in self.calls])
+
+
+class BotsTest(TestCase):
+
+    def test_value_in_mutez(self):
+        self.assertEqual(20000, value_in_mutez(make_swap(), 20000, {}))
+        fa12_swap = make_swap(vault=FA12_VAULT, payoff=10, token_address=fa_address)
+        self.assertIsNone(value_in_mutez(fa12_swap, 10, {}))
+        self.assertEqual(15, value_in_mutez(fa12_swap, 10, {(fa_address, None): Decimal('1.5')}))
+
+    def test_pending_calls(self):
+        mempool = make_mempool('redeem', secret)
+        self.assertEqual({secret}, pending_calls(mempool, {TEZ_VAULT: vault_address}, 'redeem'))
+        self.assertEqual(set(), pending_calls(mempool, {TEZ_VAULT: vault_address}, 'refund'))
+        self.assertEqual(set(), pending_calls({'refused': mempool['refused']}, {TEZ_VAULT: vault_address}, 'redeem'))
+        self.assertEqual({hashed_secret}, pending_calls(make_mempool('refund', hashed_secret),
+                                                        {TEZ_VAULT: vault_address}, 'refund'))
+
+    def test_select_profitable(self):
+        cheap, rich, poor = make_swap(payoff=1000), make_swap(payoff=5000), make_swap(payoff=500)
+        candidates = [(cheap, 900), (rich, 900), (poor, 900)]
+        self.assertEqual([rich, cheap], select_profitable(candidates, lambda swap: swap.payoff))
+        self.assertEqual([rich], select_profitable(candidates, lambda swap: swap.payoff, min_profit=1000))
+        self.assertEqual([], select_profitable(candidates, lambda swap: None))
+
+    def test_estimate_fees(self):
+        batches, failed = [], []
+
+        def bulk(*calls):
+            batches.append(len(calls))
+            return Batch(calls)
+
+        items = ['a', 'bad', 'c', 'd', 'e']
+        fees = estimate_fees(SimpleNamespace(bulk=bulk), items, lambda item: item,
+                             lambda item, e: failed.append(item))
+        self.assertEqual([('a', 100), ('c', 100), ('d', 100), ('e', 100)], fees)
+        self.assertEqual(['bad'], failed)
+        self.assertEqual([5, 2, 1, 1, 3], batches)
@@ -0,0 +1,103 @@
+from unittest import TestCase
+
+from pytezos.michelson.forge import forge_micheline
+from pytezos.michelson.types.base import MichelsonType
+
+from atomex.decoder import compare, compile_type, corpus
+from atomex.vaults import TEZ_VAULT, load_vault, swaps_type_exprs
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+hashed_secret = bytes.fromhex('05bce5c12071fbca95b13d49cb5ef45323e0216d618bb4575c519b74be75e3da')
+
+
+def field(prim, name, *args):
+    return {'prim': prim, 'annots': [f'%{name}'], 'args': list(args)} if args else {'prim': prim, 'annots': [f'%{name}']}
+
+
+def record(*fields):
+    """Record with the tree layout of LIGO, fields sorted by name"""
+    fields = sorted(fields, key=lambda f: f['annots'][0])
+
+    def tree(items):
+        if len(items) == 1:
+            return items[0]
+        middle = len(items) // 2
+        return {'prim': 'pair', 'args': [tree(items[:middle]), tree(items[middle:])]}
+
+    return tree(fields)
+
+
+fa12_swap = record(field('address', 'initiator'), field('address', 'participant'), field('timestamp', 'refundTime'),
+                   field('address', 'tokenAddress'), field('nat', 'totalAmount'), field('nat', 'payoffAmount'),
+                   field('nat', 'bountyAmount'))
+fa2_swap = record(field('address', 'initiator'), field('address', 'participant'), field('timestamp', 'refundTime'),
+                  field('address', 'tokenAddress'), field('nat', 'tokenId'), field('nat', 'totalAmount'),
+                  field('nat', 'bountyAmount'))
+fa12_parameter = {'prim': 'or', 'args': [
+    {'prim': 'or', 'args': [
+        dict(record(field('bytes', 'hashedSecret'), field('nat', 'addAmount')), annots=['%add']),
+        dict(record(field('bytes', 'hashedSecret'), field('address', 'participant'), field('timestamp', 'refundTime'),
+                    field('address', 'tokenAddress'), field('nat', 'totalAmount'), field('nat', 'payoffAmount'),
+                    field('nat', 'bountyAmount')), annots=['%initiate'])]},
+    {'prim': 'or', 'args': [field('bytes', 'redeem'), field('bytes', 'refund')]}]}
+fa2_events = {'prim': 'pair', 'args': [field('bytes', 'hashedSecret'), dict(fa2_swap, annots=['%swap'])]}
+
+
+class DecoderTest(TestCase):
+
+    def assertSame(self, type_expr, samples=300):
+        report = compare(type_expr, corpus(type_expr, samples, seed=7), rounds=1)
+        self.assertEqual([], report['micheline']['mismatches'])
+        self.assertEqual([], report['binary']['mismatches'])
+
+    def test_tez_vault(self):
+        self.assertSame(swaps_type_exprs(TEZ_VAULT)[1])
+        self.assertSame(load_vault(TEZ_VAULT).context.parameter_expr['args'][0])
+
+    def test_fa_vaults(self):
+        for type_expr in (fa12_swap, fa2_swap, fa12_parameter, fa2_events):
+            self.assertSame(type_expr)
+
+    def test_collections(self):
+        self.assertSame({'prim': 'pair', 'args': [
+            {'prim': 'map', 'args': [{'prim': 'pair', 'args': [{'prim': 'address'}, {'prim': 'nat'}]},
+                                     {'prim': 'list', 'args': [{'prim': 'option', 'args': [{'prim': 'bytes'}]}]}]},
+            {'prim': 'set', 'args': [{'prim': 'or', 'args': [{'prim': 'int'}, {'prim': 'string'}]}]},
+            {'prim': 'or', 'args': [{'prim': 'unit', 'annots': ['%a']}, {'prim': 'unit', 'annots': ['%b']}]},
+            {'prim': 'bool'}]})
+
+    def test_fallback(self):
+        type_expr = {'prim': 'pair', 'args': [{'prim': 'big_map', 'args': [{'prim': 'bytes'}, {'prim': 'nat'}]},
+                                              {'prim': 'nat', 'annots': ['%count']}]}
+        value = {'prim': 'Pair', 'args': [{'int': '42'}, {'int': '3'}]}
+        expected = MichelsonType.match(type_expr).from_micheline_value(value).to_python_object()
+        decoder = compile_type(type_expr)
+        self.assertEqual(expected, decoder.from_micheline(value))
+        self.assertEqual(expected, decoder.unpack(b'\x05' + forge_micheline(value)))
+
+    def test_comb_forms(self):
+        decoder = compile_type(swaps_type_exprs(TEZ_VAULT)[1])
+        expected = {'initiator': source, 'participant': source, 'amount': 1, 'refund_time': 60, 'payoff': 2,
+                    'bounty': 3}
+        addresses = [{'string': source}, {'string': source}]
+        for value in ({'prim': 'Pair', 'args': [{'prim': 'Pair', 'args': addresses},
+                                                [{'prim': 'Pair', 'args': [{'int': '1'}, {'string': '1970-01-01T00:01:00Z'}]},
+                                                 {'int': '2'}, {'int': '3'}]]},
+                      [addresses, {'prim': 'Pair', 'args': [{'int': '1'}, {'int': '60'}]}, {'int': '2'}, {'int': '3'}]):
+            self.assertEqual(expected, decoder.from_micheline(value))
+            self.assertEqual(expected, decoder.from_bytes(forge_micheline(value)))
+
+    def test_malformed_bytes(self):
+        decoder = compile_type({'prim': 'nat'})
+        data = forge_micheline({'int': '42'})
+        self.assertEqual(42, decoder.unpack(b'\x05' + data))
+        with self.assertRaisesRegex(ValueError, '1 trailing bytes'):
+            decoder.from_bytes(data + b'\x00')
+        with self.assertRaisesRegex(ValueError, 'packed data should start with 05'):
+            decoder.unpack(data)
+
+    def test_speedup(self):
+        type_expr = swaps_type_exprs(TEZ_VAULT)[1]
+        report = compare(type_expr, corpus(type_expr, 500))
+        self.assertGreater(report['micheline']['speedup'], 5)
+        self.assertGreater(report['binary']['speedup'], 5)
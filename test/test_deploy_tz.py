@@ -0,0 +1,133 @@
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from importlib.util import module_from_spec, spec_from_file_location
+from os.path import dirname, join
+from threading import Thread
+from types import SimpleNamespace
+from unittest import TestCase
+from urllib.parse import parse_qs, urlparse
+
+from pytezos import ContractInterface
+from pytezos.rpc.node import RpcNotFoundError
+
+from conftest import Getter
+
+project_dir = dirname(dirname(__file__))
+spec = spec_from_file_location('deploy_tz', join(project_dir, 'migrations/4_deploy_tz.py'))
+deploy_tz = module_from_spec(spec)
+spec.loader.exec_module(deploy_tz)
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+other = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+address = 'KT1VG2WtYdSWz5E7chTeAdDPZNy2MpP8pTfL'
+tez_vault = join(project_dir, 'contracts/tezos/tez_vault.tz')
+
+
+def origination(code, originator=source, status='applied'):
+    return {'kind': 'origination', 'source': originator, 'script': {'code': code},
+            'metadata': {'operation_result': {'status': status, 'originated_contracts': [address]}}}
+
+
+class Node:
+    """Chain of blocks keyed by level, each a list of manager operation groups"""
+
+    def __init__(self, blocks, contracts=None, error=None):
+        self.blocks = blocks
+        self.contracts = contracts or {}
+        self.error = error
+
+    def block(self, level):
+        if isinstance(level, str):  # block hashes of this chain are B<level>
+            level = int(level[1:])
+        return SimpleNamespace(
+            header=lambda: {'level': level},
+            operations=SimpleNamespace(managers=lambda: self.blocks.get(level, [])),
+            operation_hashes=lambda: [[], [], [], [opg['hash'] for opg in self.blocks.get(level, [])]])
+
+    def contract(self, address):
+        def script():
+            if self.error:
+                raise self.error
+            if address not in self.contracts:
+                raise RpcNotFoundError(f'Not found: /contracts/{address}/script')
+            return {'code': self.contracts[address]}
+        return SimpleNamespace(script=script)
+
+    def client(self):
+        shell = SimpleNamespace(contracts=Getter(self.contract), blocks=Getter(self.block),
+                                head=SimpleNamespace(header=lambda: {'level': max(self.blocks)}))
+        return SimpleNamespace(shell=shell, key=SimpleNamespace(public_key_hash=lambda: source))
+
+
+class DeployTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.code = ContractInterface.from_file(tez_vault).script()['code']
+        cls.code_hash = deploy_tz.code_hash(cls.code)
+
+    def test_find_deployment(self):
+        deployment = {'address': address, 'level': 5, 'operation': 'oo1', 'code_hash': self.code_hash}
+        node = Node({5: [{'hash': 'oo1', 'contents': [origination(self.code)]}]}, {address: self.code})
+        self.assertTrue(deploy_tz.find_deployment(node.client(), deployment, self.code_hash))
+        self.assertFalse(deploy_tz.find_deployment(node.client(), dict(deployment, operation='oo2'), self.code_hash))
+        self.assertFalse(deploy_tz.find_deployment(node.client(), deployment, 'expr'))
+        self.assertFalse(deploy_tz.find_deployment(Node({5: []}).client(), deployment, self.code_hash))
+
+        # Only a 404 means the contract is not there, any other failure is not an answer
+        with self.assertRaises(ConnectionError):
+            deploy_tz.find_deployment(Node({}, error=ConnectionError()).client(), deployment, self.code_hash)
+
+    def test_find_origination(self):
+        node = Node({
+            8: [{'hash': 'oo1', 'contents': [origination(self.code)]}],
+            9: [{'hash': 'oo2', 'contents': [origination(self.code, originator=other)]}],
+        }, {address: self.code})
+        candidates = [{'address': address, 'level': 9, 'operation': 'oo2'},
+                      {'address': address, 'level': 8, 'operation': 'oo1'}]
+        self.assertEqual({'address': address, 'code_hash': self.code_hash, 'level': 8, 'operation': 'oo1',
+                          'originator': source}, deploy_tz.find_origination(node.client(), self.code_hash, candidates))
+        self.assertIsNone(deploy_tz.find_origination(node.client(), self.code_hash, candidates[:1]))
+        self.assertIsNone(deploy_tz.find_origination(node.client(), 'expr', candidates))
+
+    def test_indexer_originations(self):
+        # Every origination of the sender, however old, in pages of `limit` newest first
+        originations = [{'id': i, 'level': i, 'hash': f'oo{i}', 'originatedContract': {'address': f'KT{i}'}}
+                        for i in range(1, 6)]
+        queries = []
+
+        class Indexer(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                queries.append(query)
+                page = [o for o in reversed(originations) if o['id'] < int(query.get('id.lt', 10 ** 9))]
+                body = json.dumps(page[:int(query['limit'])]).encode()
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Indexer)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            found = list(deploy_tz.indexer_originations(f'http://127.0.0.1:{server.server_port}', source, page=2))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual([5, 4, 3, 2, 1], [o['level'] for o in found])
+        self.assertEqual({'address': 'KT5', 'level': 5, 'operation': 'oo5'}, found[0])
+        self.assertEqual([None, '4', '2'], [q.get('id.lt') for q in queries])
+        self.assertEqual({source}, {q['sender'] for q in queries})
+
+    def test_require_manifest_or_indexer(self):
+        node = Node({1: []})
+        with self.assertRaises(ValueError):
+            deploy_tz.deploy_contract(tez_vault, node.client(), {}, print)
+
+    def test_inclusion_level(self):
+        node = Node({3: [], 4: [{'hash': 'oo1', 'contents': []}], 5: [], 6: []})
+        self.assertEqual(4, deploy_tz.inclusion_level(node.client(), {'hash': 'oo1', 'branch': 'B2'}))
+        with self.assertRaises(ValueError):
+            deploy_tz.inclusion_level(node.client(), {'hash': 'oo1', 'branch': 'B4'})
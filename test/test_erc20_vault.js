@@ -1,5 +1,7 @@
+const crypto = require('crypto');
 const AtomexErc20Vault = artifacts.require('./contracts/ethereum/AtomexErc20Vault.sol');
 const FiatTokenV1 = artifacts.require('./contracts/ethereum/FiatTokenV1.sol');
+const FiatTokenV2 = artifacts.require('./contracts/ethereum/FiatTokenV2.sol');
 
 const sleep = async function (time) {
     await web3.currentProvider.send({
@@ -20,6 +22,42 @@ const sleep = async function (time) {
     });
 }
 
+function hashSecret(secret) {
+    let once = crypto.createHash('sha256').update(Buffer.from(secret.slice(2), 'hex')).digest();
+    return '0x' + crypto.createHash('sha256').update(once).digest('hex');
+}
+
+function signPermit(token, owner, spender, value, nonce, deadline) {
+    return new Promise(async function(resolve, reject) {
+        let typedData = {
+            types: {
+                EIP712Domain: [
+                    {name: 'name', type: 'string'}, {name: 'version', type: 'string'},
+                    {name: 'chainId', type: 'uint256'}, {name: 'verifyingContract', type: 'address'}
+                ],
+                Permit: [
+                    {name: 'owner', type: 'address'}, {name: 'spender', type: 'address'}, {name: 'value', type: 'uint256'},
+                    {name: 'nonce', type: 'uint256'}, {name: 'deadline', type: 'uint256'}
+                ]
+            },
+            primaryType: 'Permit',
+            domain: {name: await token.name(), version: '1', chainId: await web3.eth.getChainId(), verifyingContract: token.address},
+            message: {owner: owner, spender: spender, value: value, nonce: nonce, deadline: deadline}
+        };
+        web3.currentProvider.send({
+            id: new Date().getTime(),
+            jsonrpc: "2.0",
+            method: "eth_signTypedData_v4",
+            params: [owner, JSON.stringify(typedData)]
+        }, function(error, result) {
+            if (error || result.error) return reject(error || result.error);
+            let signature = result.result.slice(2);
+            let v = parseInt(signature.slice(128, 130), 16);
+            resolve({r: '0x' + signature.slice(0, 64), s: '0x' + signature.slice(64, 128), v: v < 27 ? v + 27 : v});
+        });
+    });
+}
+
 function getCurrentTime() {
     return new Promise(function(resolve) {
       web3.eth.getBlock("latest").then(function(block) {
@@ -65,7 +103,6 @@ contract('AtomexErc20Vault', async (accounts) => {
         let active = true;
 
         let swap = await contractSwap.swaps(hashed_secret);
-        assert.equal(swap.hashedSecret, '0x0000000000000000000000000000000000000000000000000000000000000000');
         assert.equal(swap.contractAddr, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.participant, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.initiator, '0x0000000000000000000000000000000000000000');
@@ -82,7 +119,6 @@ contract('AtomexErc20Vault', async (accounts) => {
 
         swap = await contractSwap.swaps(hashed_secret);
         let contractBalance = await contractUSDC.balanceOf(contractSwap.address);
-        assert.equal(swap.hashedSecret, hashed_secret);
         assert.equal(swap.contractAddr, contractUSDC.address);
         assert.equal(swap.participant, participant);
         assert.equal(swap.initiator, sender);
@@ -117,7 +153,6 @@ contract('AtomexErc20Vault', async (accounts) => {
         swap = await contractSwap.swaps(hashed_secret);
         let contractBalance = await contractUSDC.balanceOf(contractSwap.address);
 
-        assert.equal(swap.hashedSecret, hashed_secret);
         assert.equal(swap.contractAddr, contractUSDC.address);
         assert.equal(swap.participant, participant);
         assert.equal(swap.initiator, sender);
@@ -308,7 +343,6 @@ contract('AtomexErc20Vault', async (accounts) => {
         let redeemerBalance = await contractUSDC.balanceOf(redeemer);
 
         swap = await contractSwap.swaps(hashed_secret);
-        assert.equal(swap.hashedSecret, '0x0000000000000000000000000000000000000000000000000000000000000000');
         assert.equal(swap.contractAddr, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.participant, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.initiator, '0x0000000000000000000000000000000000000000');
@@ -317,7 +351,7 @@ contract('AtomexErc20Vault', async (accounts) => {
         assert.equal(swap.value, 0);
         assert.equal(swap.payoff, 0);
         assert.equal(swap.active, false);
-        assert.equal(swap.state, 0);
+        assert.equal(swap.state, 2);
 
         assert.equal(contractBalance, 0);
         assert.deepEqual(BigInt(participantBalance), BigInt(value));
@@ -624,7 +658,6 @@ contract('AtomexErc20Vault', async (accounts) => {
         let new_senderBalance = await contractUSDC.balanceOf(sender);
 
         swap = await contractSwap.swaps(hashed_secret);
-        assert.equal(swap.hashedSecret, '0x0000000000000000000000000000000000000000000000000000000000000000');
         assert.equal(swap.contractAddr, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.participant, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.initiator, '0x0000000000000000000000000000000000000000');
@@ -633,7 +666,7 @@ contract('AtomexErc20Vault', async (accounts) => {
         assert.equal(swap.value, 0);
         assert.equal(swap.payoff, 0);
         assert.equal(swap.active, false);
-        assert.equal(swap.state, 0);
+        assert.equal(swap.state, 3);
 
         assert.equal(contractBalance, 0);
         assert.deepEqual(BigInt(new_senderBalance), BigInt(senderBalance));
@@ -846,6 +879,119 @@ contract('AtomexErc20Vault', async (accounts) => {
         }
     });
 
+    it('should redeem a batch of several tokens properly', async () => {
+        let secrets = ['0x1111111111111111111111111111111111111111111111111111111111111111', '0x2222222222222222222222222222222222222222222222222222222222222222', '0x3333333333333333333333333333333333333333333333333333333333333333'];
+        let hashes = secrets.map(hashSecret);
+        let refundTime = 60;
+        let refundTimestamp = (await getCurrentTime()) + refundTime;
+        let participant = accounts[1];
+        let redeemer = accounts[2];
+        let countdown = refundTime + 1;
+        let contractUSDT = await FiatTokenV1.new('usdt', 'usdt', supply, owner);
+        let tokens = [contractUSDC, contractUSDC, contractUSDT];
+
+        for (let i = 0; i < hashes.length; i++) {
+            await tokens[i].approve(contractSwap.address, 100);
+            await contractSwap.initiate(hashes[i], tokens[i].address, participant, refundTimestamp, countdown, 100, 1, true, {from: owner});
+        }
+
+        let res = await contractSwap.redeemBatch(hashes, secrets, {from: redeemer});
+
+        assert.equal(await contractUSDC.balanceOf(contractSwap.address), 0);
+        assert.equal(await contractUSDT.balanceOf(contractSwap.address), 0);
+        assert.equal(await contractUSDC.balanceOf(participant), 2 * 99);
+        assert.equal(await contractUSDT.balanceOf(participant), 99);
+        assert.equal(await contractUSDC.balanceOf(redeemer), 2);
+        assert.equal(await contractUSDT.balanceOf(redeemer), 1);
+        assert.equal(res.logs.filter(log => log.event === 'Redeemed').length, 3);
+    });
+
+    it('should refund a batch properly', async () => {
+        let hashes = ['0x1111111111111111111111111111111111111111111111111111111111111111', '0x2222222222222222222222222222222222222222222222222222222222222222'];
+        let refundTime = 60;
+        let refundTimestamp = (await getCurrentTime()) + refundTime;
+
+        await contractUSDC.approve(contractSwap.address, 200);
+        for (let hash of hashes) {
+            await contractSwap.initiate(hash, contractUSDC.address, accounts[1], refundTimestamp, 10, 100, 1, true, {from: owner});
+        }
+
+        await sleep(~~(refundTime + 1));
+        await contractSwap.refundBatch(hashes, {from: accounts[2]});
+
+        assert.equal(await contractUSDC.balanceOf(contractSwap.address), 0);
+        assert.equal(await contractUSDC.balanceOf(owner), supply);
+        assert.equal((await contractSwap.swaps(hashes[0])).state, 3);
+
+        try {
+            await contractSwap.refundBatch([hashes[0]], {from: accounts[2]});
+            assert.fail('refunded twice');
+        }
+        catch (error) {
+            assert(error.message.indexOf('swap for this hash is empty or already spent') >= 0);
+        }
+    });
+
+    it('should initiate with permit in one transaction', async () => {
+        let hashed_secret = '0x1111111111111111111111111111111111111111111111111111111111111111';
+        let refundTimestamp = (await getCurrentTime()) + 60;
+        let deadline = refundTimestamp;
+        let value = 100;
+        let token = await FiatTokenV2.new('usdc', 'usdc', supply, owner);
+        let permit = await signPermit(token, owner, contractSwap.address, value, 0, deadline);
+
+        await contractSwap.initiateWithPermit(hashed_secret, token.address, accounts[1], refundTimestamp, 10, value, 1, true,
+            deadline, permit.v, permit.r, permit.s, {from: owner});
+
+        let swap = await contractSwap.swaps(hashed_secret);
+        assert.equal(swap.state, 1);
+        assert.equal(swap.contractAddr, token.address);
+        assert.equal(await token.balanceOf(contractSwap.address), value);
+        assert.equal(await token.nonces(owner), 1);
+        assert.equal(await token.allowance(owner, contractSwap.address), 0);
+    });
+
+    it('should initiate with a permit already submitted by someone else', async () => {
+        let hashed_secret = '0x1111111111111111111111111111111111111111111111111111111111111111';
+        let refundTimestamp = (await getCurrentTime()) + 60;
+        let deadline = refundTimestamp;
+        let value = 100;
+        let token = await FiatTokenV2.new('usdc', 'usdc', supply, owner);
+        let permit = await signPermit(token, owner, contractSwap.address, value, 0, deadline);
+
+        // front-run: the permit is used, initiateWithPermit falls back to the allowance it granted
+        await token.permit(owner, contractSwap.address, value, deadline, permit.v, permit.r, permit.s, {from: accounts[3]});
+        await contractSwap.initiateWithPermit(hashed_secret, token.address, accounts[1], refundTimestamp, 10, value, 1, true,
+            deadline, permit.v, permit.r, permit.s, {from: owner});
+
+        assert.equal((await contractSwap.swaps(hashed_secret)).state, 1);
+        assert.equal(await token.balanceOf(contractSwap.address), value);
+        assert.equal(await token.nonces(owner), 1);
+        assert.equal(await token.allowance(owner, contractSwap.address), 0);
+    });
+
+    it('should initiate with permit using the allowance of tokens without permit', async () => {
+        let hashed_secret = '0x1111111111111111111111111111111111111111111111111111111111111111';
+        let refundTimestamp = (await getCurrentTime()) + 60;
+        let zero = '0x0000000000000000000000000000000000000000000000000000000000000000';
+
+        try {
+            await contractSwap.initiateWithPermit(hashed_secret, contractUSDC.address, accounts[1], refundTimestamp, 10, 100, 1, true,
+                refundTimestamp, 27, zero, zero, {from: owner});
+            assert.fail('initiated without allowance');
+        }
+        catch (error) {
+            assert(error.message.indexOf('insufficient allowance') >= 0 || error.message.indexOf('exceeds allowance') >= 0);
+        }
+
+        await contractUSDC.approve(contractSwap.address, 100);
+        await contractSwap.initiateWithPermit(hashed_secret, contractUSDC.address, accounts[1], refundTimestamp, 10, 100, 1, true,
+            refundTimestamp, 27, zero, zero, {from: owner});
+
+        assert.equal((await contractSwap.swaps(hashed_secret)).state, 1);
+        assert.equal(await contractUSDC.balanceOf(contractSwap.address), 100);
+    });
+
     it('should emit Initiated event', async () => {
         let hashed_secret = '0x1111111111111111111111111111111111111111111111111111111111111111';
         let refundTime = 60;
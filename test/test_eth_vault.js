@@ -1,3 +1,4 @@
+const crypto = require('crypto');
 const AtomexEthVault = artifacts.require('../contracts/ethereum/AtomexEthVault.sol');
 
 const sleep = async function (time) {
@@ -19,6 +20,11 @@ const sleep = async function (time) {
     });
 }
 
+function hashSecret(secret) {
+    let once = crypto.createHash('sha256').update(Buffer.from(secret.slice(2), 'hex')).digest();
+    return '0x' + crypto.createHash('sha256').update(once).digest('hex');
+}
+
 function getCurrentTime() {
     return new Promise(function(resolve) {
       web3.eth.getBlock("latest").then(function(block) {
@@ -46,7 +52,6 @@ contract('AtomexEthVault', async (accounts) => {
         let active = true;
 
         let swap = await contract.swaps(hashed_secret);
-        assert.equal(swap.hashedSecret, '0x0000000000000000000000000000000000000000000000000000000000000000');
         assert.equal(swap.initiator, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.participant, '0x0000000000000000000000000000000000000000');
         assert.equal(swap.refundTimestamp, 0);
@@ -61,7 +66,6 @@ contract('AtomexEthVault', async (accounts) => {
         //let lastBlock = await web3.eth.getBlock('latest');
         swap = await contract.swaps(hashed_secret);
         let contractBalance = await web3.eth.getBalance(contract.address);
-        assert.equal(swap.hashedSecret, hashed_secret);
         assert.equal(swap.participant, recipient);
         assert.equal(swap.initiator, sender);
         assert.deepEqual(BigInt(swap.refundTimestamp), BigInt(refundTimestamp));
@@ -95,7 +99,6 @@ contract('AtomexEthVault', async (accounts) => {
         swap = await contract.swaps(hashed_secret);
         let contractBalance = await web3.eth.getBalance(contract.address);
 
-        assert.equal(swap.hashedSecret, hashed_secret);
         assert.equal(swap.initiator, sender);
         assert.equal(swap.participant, recipient);
         assert.deepEqual(BigInt(swap.refundTimestamp), BigInt(refundTimestamp));
@@ -320,7 +323,6 @@ contract('AtomexEthVault', async (accounts) => {
         swap = await contract.swaps(hashed_secret);
 
         contractBalance = await web3.eth.getBalance(contract.address);
-        assert.equal(swap.hashedSecret, hashed_secret);
         assert.equal(swap.initiator, sender);
         assert.equal(swap.participant, recipient);
         assert.deepEqual(BigInt(swap.refundTimestamp), BigInt(refundTimestamp));
@@ -759,6 +761,102 @@ contract('AtomexEthVault', async (accounts) => {
         }
     });
 
+    it('should clear a spent swap but keep its state', async () => {
+        let secret = '0x1111111111111111111111111111111111111111111111111111111111111111';
+        let hashed_secret = '0x59420d36b80353ed5a5822ca464cc9bffb8abe9cd63959651d3cd85a8252d83f';
+        let refundTime = 60;
+        let refundTimestamp = (await getCurrentTime()) + refundTime;
+        let sender = accounts[0];
+        let recipient = accounts[1];
+
+        await contract.initiate(hashed_secret, recipient, refundTimestamp, 0, 1, true, {from: sender, value: 100});
+        await contract.redeem(hashed_secret, secret, {from: recipient, value: 0});
+
+        let swap = await contract.swaps(hashed_secret);
+        assert.equal(swap.initiator, '0x0000000000000000000000000000000000000000');
+        assert.equal(swap.participant, '0x0000000000000000000000000000000000000000');
+        assert.equal(swap.refundTimestamp, 0);
+        assert.equal(swap.value, 0);
+        assert.equal(swap.payoff, 0);
+        assert.equal(swap.state, 2);
+
+        try {
+            await contract.initiate(hashed_secret, recipient, refundTimestamp, 0, 1, true, {from: sender, value: 100});
+            assert.fail('initiated a spent hashed_secret');
+        }
+        catch (error) {
+            assert(error.message.indexOf('swap for this hash is already initiated') >= 0);
+        }
+    });
+
+    it('should redeem a batch properly', async () => {
+        let secrets = ['0x1111111111111111111111111111111111111111111111111111111111111111', '0x2222222222222222222222222222222222222222222222222222222222222222'];
+        let hashes = secrets.map(hashSecret);
+        let refundTimestamp = (await getCurrentTime()) + 60;
+        let sender = accounts[0];
+        let recipient = accounts[1];
+        let redeemer = accounts[2];
+
+        for (let hash of hashes) {
+            await contract.initiate(hash, recipient, refundTimestamp, 0, 1, true, {from: sender, value: 100});
+        }
+        let recipientBalance = await web3.eth.getBalance(recipient);
+
+        let res = await contract.redeemBatch(hashes, secrets, {from: redeemer});
+
+        let new_recipientBalance = await web3.eth.getBalance(recipient);
+        assert.deepEqual(BigInt(new_recipientBalance), BigInt(recipientBalance) + BigInt(2 * 100));
+        assert.equal(await web3.eth.getBalance(contract.address), 0);
+        assert.equal(res.logs.length, 2);
+        assert.equal(res.logs[1].event, 'Redeemed');
+        assert.equal(res.logs[1].args._secret, secrets[1]);
+        assert.equal((await contract.swaps(hashes[0])).state, 2);
+    });
+
+    it('should not redeem a batch with a wrong secret', async () => {
+        let secrets = ['0x1111111111111111111111111111111111111111111111111111111111111111', '0x2222222222222222222222222222222222222222222222222222222222222222'];
+        let hashes = secrets.map(hashSecret);
+        let refundTimestamp = (await getCurrentTime()) + 60;
+
+        for (let hash of hashes) {
+            await contract.initiate(hash, accounts[1], refundTimestamp, 0, 1, true, {from: accounts[0], value: 100});
+        }
+
+        try {
+            await contract.redeemBatch(hashes, [secrets[0], secrets[0]], {from: accounts[2]});
+            assert.fail('redeemed with a wrong secret');
+        }
+        catch (error) {
+            assert(error.message.indexOf('secret is not correct') >= 0);
+        }
+        assert.equal((await contract.swaps(hashes[0])).state, 1);
+    });
+
+    it('should refund a batch properly', async () => {
+        let hashes = ['0x1111111111111111111111111111111111111111111111111111111111111111', '0x2222222222222222222222222222222222222222222222222222222222222222'];
+        let refundTime = 60;
+        let refundTimestamp = (await getCurrentTime()) + refundTime;
+
+        for (let hash of hashes) {
+            await contract.initiate(hash, accounts[1], refundTimestamp, 0, 1, true, {from: accounts[0], value: 100});
+        }
+
+        try {
+            await contract.refundBatch(hashes, {from: accounts[2]});
+            assert.fail('refunded before refundTime');
+        }
+        catch (error) {
+            assert(error.message.indexOf('refundTimestamp has not come') >= 0);
+        }
+
+        await sleep(~~(refundTime + 1));
+        let res = await contract.refundBatch(hashes, {from: accounts[2]});
+
+        assert.equal(await web3.eth.getBalance(contract.address), 0);
+        assert.equal(res.logs.length, 2);
+        assert.equal((await contract.swaps(hashes[1])).state, 3);
+    });
+
     it('should emit Initiated event', async () => {
         let secret = '0x1111111111111111111111111111111111111111111111111111111111111111';
         let hashed_secret = '0x59420d36b80353ed5a5822ca464cc9bffb8abe9cd63959651d3cd85a8252d83f';
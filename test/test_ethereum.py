@@ -0,0 +1,129 @@
+import json
+from os import urandom
+from unittest import TestCase
+
+from atomex.ethereum import ERC20_VAULT, ETH_VAULT, INITIATED, NAME, SELECTORS, SWAP_FIELDS, SwapReader, Vault, \
+    decode_words, encode_arrays, topic
+
+vault_address = '0x00000000000000000000000000000000000000e1'
+multicall_address = '0x00000000000000000000000000000000000000c1'
+participant = '0x00000000000000000000000000000000000000b2'
+EMPTY_VALUES = {'address': '0x' + '00' * 20, 'bytes32': bytes(32)}
+
+
+def encode_bytes_array(block, items):
+    word = lambda value: value.to_bytes(32, 'big')
+    padded = [word(len(item)) + item.ljust((len(item) + 31) // 32 * 32, b'\x00') for item in items]
+    offsets, position = [], 32 * len(items)
+    for item in padded:
+        offsets.append(word(position))
+        position += len(item)
+    return '0x' + (word(block) + word(64) + word(len(items)) + b''.join(offsets) + b''.join(padded)).hex()
+
+
+class StandInNode:
+    """Executes Multicall aggregate over the `swaps` getter of an in-memory vault"""
+
+    def __init__(self, swaps):
+        self.swaps = swaps
+        self.calls = 0
+
+    def call(self, method, tx, block):
+        self.calls += 1
+        raw = bytes.fromhex(tx['data'][10:])
+        uint = lambda position: int.from_bytes(raw[position:position + 32], 'big')
+        count, base, results = uint(32), 64, []
+        for i in range(count):
+            item = base + uint(base + 32 * i)
+            target = '0x' + raw[item + 12:item + 32].hex()
+            data = raw[item + 96:item + 96 + uint(item + 64)]
+            assert target == vault_address and data[:4].hex() == SELECTORS[ETH_VAULT]['swaps'][2:]
+            swap = self.swaps.get(data[4:36], {})
+            results.append(b''.join(bytes.fromhex(topic(swap.get(name, EMPTY_VALUES.get(abi_type, 0)), abi_type)[2:])
+                                    for name, abi_type in SWAP_FIELDS[ETH_VAULT]))
+        return encode_bytes_array(42, results)
+
+
+class SwapReaderTest(TestCase):
+
+    def test_read_in_batches(self):
+        swaps = {}
+        for i in range(25):
+            hashed = urandom(32)
+            swaps[hashed] = {'participant': participant, 'value': 1000 + i,
+                             'refundTimestamp': 1700000000, 'active': True, 'state': INITIATED}
+        missing = urandom(32)
+        node = StandInNode(swaps)
+        reader = SwapReader(node, multicall_address, batch_size=10)
+
+        result = reader.swaps(Vault(node, vault_address), list(swaps) + [missing])
+
+        self.assertEqual(3, node.calls)
+        self.assertEqual(42, reader.block)
+        for hashed, swap in swaps.items():
+            self.assertEqual(swap['value'], result[hashed]['value'])
+            self.assertEqual(participant, result[hashed]['participant'])
+            self.assertEqual(INITIATED, result[hashed]['state'])
+        self.assertEqual(0, result[missing]['state'])
+
+
+class CodecTest(TestCase):
+
+    def test_encode_arrays(self):
+        hashes, secrets = [urandom(32) for _ in range(3)], [urandom(32) for _ in range(3)]
+        data = encode_arrays(SELECTORS[ETH_VAULT]['redeemBatch'], 'bytes32', hashes, secrets)
+        self.assertTrue(data.startswith(SELECTORS[ETH_VAULT]['redeemBatch']))
+
+        words = decode_words(data[10:], ['uint256'] * 2 + ['uint256'] + ['bytes32'] * 3 + ['uint256'] + ['bytes32'] * 3)
+        self.assertEqual([64, 64 + 32 * 4, 3], words[:3])
+        self.assertEqual(hashes, words[3:6])
+        self.assertEqual(3, words[6])
+        self.assertEqual(secrets, words[7:])
+
+
+class PermitNode:
+    """Answers the token reads and signs typed data like an unlocked node account"""
+
+    def __init__(self):
+        self.typed_data = None
+        self.transactions = []
+
+    def call(self, method, *params):
+        if method == 'eth_call':
+            if params[0]['data'] == NAME:
+                name = b'usdc'
+                return '0x' + (32).to_bytes(32, 'big').hex() + len(name).to_bytes(32, 'big').hex() + name.ljust(32, b'\x00').hex()
+            return '0x' + (7).to_bytes(32, 'big').hex()
+        if method == 'eth_chainId':
+            return '0x539'
+        if method == 'eth_signTypedData_v4':
+            self.typed_data = json.loads(params[1])
+            return '0x' + '11' * 32 + '22' * 32 + '00'
+        raise NotImplementedError(method)
+
+    def transact(self, sender, to, data, value=0):
+        self.transactions.append((sender, to, data))
+
+
+class PermitTest(TestCase):
+
+    def test_initiate_with_permit(self):
+        node = PermitNode()
+        vault = Vault(node, vault_address, ERC20_VAULT)
+        token = '0x00000000000000000000000000000000000000f1'
+        owner = '0x00000000000000000000000000000000000000a1'
+        hashed = urandom(32)
+
+        vault.initiate_with_permit(owner, hashed, participant, 1700000000, 100, 1000, 10, True, token, 1700000100)
+
+        domain, message = node.typed_data['domain'], node.typed_data['message']
+        self.assertEqual({'name': 'usdc', 'version': '1', 'chainId': 1337, 'verifyingContract': token}, domain)
+        self.assertEqual({'owner': owner, 'spender': vault_address, 'value': 1000, 'nonce': 7, 'deadline': 1700000100},
+                         message)
+        (sender, to, data), = node.transactions
+        self.assertEqual((owner, vault_address), (sender, to))
+        self.assertTrue(data.startswith(SELECTORS[ERC20_VAULT]['initiateWithPermit']))
+        words = decode_words(data[10:], ['bytes32', 'address', 'address'] + ['uint256'] * 4 + ['bool', 'uint256', 'uint8',
+                                                                                              'bytes32', 'bytes32'])
+        self.assertEqual([hashed, token, participant, 1700000000, 100, 1000, 10, True, 1700000100, 27,
+                          b'\x11' * 32, b'\x22' * 32], words)
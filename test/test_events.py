@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+from atomex.events import benchmark, block_events, decode_calls
+from atomex.vaults import TEZ_VAULT, hash_secret, load_vault
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+secret = bytes.fromhex('dca15ce0c01f61ab03139b4673f4bd902203dc3b898a89a5d35bad794e5cfd4f')
+hashed_secret = hash_secret(secret)
+vault_address = 'KT1BEqzn5Wx8uJrZNvuS9DVHmLvG9td3fDLi'
+swap = {
+    'initiator': source,
+    'participant': party,
+    'amount': 980000,
+    'refund_time': 6 * 3600,
+    'payoff': 20000,
+    'bounty': 0,
+}
+
+
+def receipt(call, res, op_hash='oo'):
+    """Operation group applied by a node, built from the result of an `interpret` call"""
+    internal = [dict(op, type=op.pop('event_type'), result={'status': 'applied'})
+                if op['kind'] == 'event' else dict(op, result={'status': 'applied'})
+                for op in res.operations]
+    return {
+        'hash': op_hash,
+        'contents': [{
+            'kind': 'transaction',
+            'destination': vault_address,
+            'parameters': call.parameters,
+            'metadata': {
+                'operation_result': {'status': 'applied', 'lazy_storage_diff': res.lazy_diff},
+                'internal_operation_results': internal,
+            },
+        }],
+    }
+
+
+class EventsTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.vault = load_vault(TEZ_VAULT)
+        initiate = cls.vault \
+            .initiate(participant=party, hashed_secret=hashed_secret, refund_time=6 * 3600, payoff=20000, bounty=0) \
+            .with_amount(1000000)
+        redeem = cls.vault.redeem(secret)
+        cls.operations = [
+            receipt(initiate, initiate.interpret(storage=[{}, None], source=source, now=0), 'oo1'),
+            receipt(redeem, redeem.interpret(storage=[{hashed_secret: swap}, None], source=party, now=0), 'oo2'),
+        ]
+
+    def test_block_events(self):
+        events = block_events(self.operations, [vault_address], level=7)
+        self.assertEqual(['initiated', 'redeemed'], [event.tag for event in events])
+        self.assertEqual([hashed_secret] * 2, [event.hashed_secret for event in events])
+        self.assertEqual(['oo1', 'oo2'], [event.op_hash for event in events])
+        self.assertDictEqual(dict(swap, hashed_secret=hashed_secret), events[0].payload)
+        self.assertEqual(secret, events[1].payload['secret'])
+        self.assertTrue(all(event.level == 7 and event.vault == vault_address for event in events))
+
+    def test_other_sources(self):
+        self.assertEqual([], block_events(self.operations, ['KT1PWx2mnDueood7fEmfbBDKx1D9BAnnXitn']))
+
+    def test_same_as_calls(self):
+        calls = decode_calls(self.operations, {vault_address: TEZ_VAULT})
+        self.assertEqual(['initiate', 'redeem'], [entrypoint for entrypoint, _, _ in calls])
+        self.assertEqual(secret, calls[1][1])
+        self.assertEqual([(hashed_secret, None)], calls[1][2])
+
+        timings = benchmark(self.operations, {vault_address: TEZ_VAULT}, rounds=2)
+        self.assertGreater(timings['calls'], 0)
+        self.assertGreater(timings['events'], 0)
@@ -0,0 +1,159 @@
+import os
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipIf
+
+from atomex.ethereum import TOPICS, topic
+from atomex.events import VaultEvent
+from atomex.export import SwapExporter, export_ethereum, pa, pq
+from atomex.scanner import SwapEvent
+from atomex.vaults import TEZ_VAULT
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+vault = 'KT1VG2WtYdSWz5E7chTeAdDPZNy2MpP8pTfL'
+secret = bytes.fromhex('dca15ce0c01f61ab03139b4673f4bd902203dc3b898a89a5d35bad794e5cfd4f')
+hashed_secret = bytes.fromhex('05bce5c12071fbca95b13d49cb5ef45323e0216d618bb4575c519b74be75e3da')
+eth_vault = '0x00000000000000000000000000000000000000e1'
+day = 86400
+
+
+def tezos_events():
+    state = {'initiator': source, 'participant': party, 'amount': 980000, 'refund_time': 2 * day, 'payoff': 20000,
+             'bounty': 0}
+    return [
+        VaultEvent(10, 'oo1', vault, 'initiated', hashed_secret, state),
+        VaultEvent(11, 'oo2', vault, 'added', hashed_secret, {'hashed_secret': hashed_secret, 'amount': 990000}),
+        VaultEvent(20, 'oo3', vault, 'redeemed', hashed_secret, {'hashed_secret': hashed_secret, 'secret': secret}),
+    ]
+
+
+def ethereum_logs():
+    def log(block, topics, data):
+        return {'blockNumber': hex(block), 'logIndex': '0x0', 'address': eth_vault, 'transactionHash': f'0x{block}',
+                'topics': topics, 'data': '0x' + ''.join(topic(value, abi_type)[2:] for value, abi_type in data)}
+
+    initiator, participant = '0x00000000000000000000000000000000000000a1', '0x00000000000000000000000000000000000000b2'
+    return [
+        log(5, [TOPICS['Initiated'], topic(hashed_secret, 'bytes32'), topic(participant, 'address')],
+            [(initiator, 'address'), (2 * day, 'uint256'), (0, 'uint256'), (10 ** 18, 'uint256'),
+             (10 ** 16, 'uint256'), (True, 'bool')]),
+        log(15, [TOPICS['Redeemed'], topic(hashed_secret, 'bytes32')], [(secret, 'bytes32')]),
+    ]
+
+
+class EthereumNode:
+    """Serves eth_getLogs of the vault and block timestamps of 100 seconds per block"""
+
+    def __init__(self, logs):
+        self.logs = logs
+        self.ranges = []
+
+    def call(self, method, *params):
+        if method == 'eth_getBlockByNumber':
+            return {'timestamp': hex(100 * int(params[0], 16))}
+        assert method == 'eth_getLogs'
+        start, end = int(params[0]['fromBlock'], 16), int(params[0]['toBlock'], 16)
+        self.ranges.append((start, end))
+        return [log for log in self.logs if start <= int(log['blockNumber'], 16) <= end
+                and log['topics'][0] in params[0]['topics'][0]]
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rows(self):
+        exporter = SwapExporter(self.tmp.name)
+        exporter.add_tezos(tezos_events(), {vault: TEZ_VAULT}, {10: 100, 11: 160, 20: day + 100})
+        initiated, added, redeemed = exporter.rows
+        self.assertEqual(('initiated', 980000, 20000, 2 * day, '1970-01-01'),
+                         (initiated['outcome'], initiated['amount'], initiated['payoff'], initiated['refund_time'],
+                          initiated['day']))
+        self.assertEqual(990000, added['amount'])
+        self.assertEqual((990000, party, secret, day, day, '1970-01-02'),
+                         (redeemed['amount'], redeemed['participant'], redeemed['secret'],
+                          redeemed['time_to_redeem'], redeemed['time_to_close'], redeemed['day']))
+        self.assertEqual({}, exporter.open)
+
+    def test_ethereum_refund(self):
+        events = [
+            SwapEvent(5, 0, '0xvault', 'Initiated', hashed_secret, participant='0xparty', initiator='0xinit',
+                      refund_timestamp=600, countdown=0, value=10 ** 18, payoff=10 ** 16, tx_hash='0x1'),
+            SwapEvent(9, 3, '0xvault', 'Refunded', hashed_secret, tx_hash='0x2'),
+        ]
+        exporter = SwapExporter(self.tmp.name)
+        exporter.add_ethereum(events, {'0xvault': 'eth_vault'}, {5: 0, 9: 700})
+        refunded = exporter.rows[-1]
+        self.assertEqual(('ethereum', 'eth_vault', 'refunded', 10 ** 18, None, 700),
+                         (refunded['chain'], refunded['vault'], refunded['outcome'], refunded['amount'],
+                          refunded['time_to_redeem'], refunded['time_to_close']))
+
+    def test_open_swaps_survive_runs(self):
+        initiated, added, redeemed = tezos_events()
+        exporter = SwapExporter(self.tmp.name)
+        exporter.add_tezos([initiated], {vault: TEZ_VAULT}, {10: 100})
+        exporter.cursors['tezos'] = 10
+        exporter.rows = []  # nothing to write, only the state
+        exporter.flush()
+
+        exporter = SwapExporter(self.tmp.name)
+        self.assertEqual({'tezos': 10}, exporter.cursors)
+        exporter.add_tezos([redeemed], {vault: TEZ_VAULT}, {20: 400})
+        self.assertEqual((source, 300), (exporter.rows[0]['initiator'], exporter.rows[0]['time_to_redeem']))
+
+    def test_unknown_swap(self):
+        exporter = SwapExporter(self.tmp.name)
+        exporter.add_tezos(tezos_events()[2:], {vault: TEZ_VAULT}, {20: 400})
+        row = exporter.rows[0]
+        self.assertEqual(('redeemed', hashed_secret, None, None), (row['outcome'], row['hashed_secret'],
+                                                                   row['initiator'], row['time_to_close']))
+
+    @skipIf(pa is None, 'pyarrow is not installed')
+    def test_partitions(self):
+        events = tezos_events()
+        exporter = SwapExporter(self.tmp.name)
+        exporter.add_tezos(events[:2], {vault: TEZ_VAULT}, {10: 100, 11: 160})
+        first = exporter.flush()
+        self.assertEqual([join(self.tmp.name, 'chain=tezos', f'vault={TEZ_VAULT}', 'day=1970-01-01',
+                               'part-10-11.parquet')], first)
+        written = os.stat(first[0]).st_mtime_ns
+
+        exporter = SwapExporter(self.tmp.name)
+        exporter.add_tezos(events[2:], {vault: TEZ_VAULT}, {20: day + 100})
+        second = exporter.flush()
+        self.assertEqual(written, os.stat(first[0]).st_mtime_ns)
+
+        table = pq.read_table(second[0])
+        self.assertEqual(['redeemed'], table.column('outcome').to_pylist())
+        self.assertEqual([day], table.column('time_to_redeem').to_pylist())
+        dataset = pq.ParquetDataset(self.tmp.name)
+        self.assertEqual(3, dataset.read().num_rows)
+
+    @skipIf(pa is None, 'pyarrow is not installed')
+    def test_export_ethereum(self):
+        node = EthereumNode(ethereum_logs())
+        flushed = []
+        export_ethereum(SwapExporter(self.tmp.name), node, {eth_vault: 'eth_vault'}, 0, 19, batch=10,
+                        on_flush=flushed.append)
+        self.assertEqual([[join(self.tmp.name, 'chain=ethereum', 'vault=eth_vault', 'day=1970-01-01',
+                                'part-5-5.parquet')],
+                          [join(self.tmp.name, 'chain=ethereum', 'vault=eth_vault', 'day=1970-01-01',
+                                'part-15-15.parquet')]], flushed)
+
+        # The swap initiated in the first batch is still known when it is redeemed in the second one
+        table = pq.read_table(flushed[1][0])
+        self.assertEqual((['redeemed'], [10 ** 18], [1000]), (table.column('outcome').to_pylist(),
+                                                             table.column('amount').to_pylist(),
+                                                             table.column('time_to_redeem').to_pylist()))
+
+        # A later run starts after the last exported block
+        node.ranges = []
+        exporter = SwapExporter(self.tmp.name)
+        export_ethereum(exporter, node, {eth_vault: 'eth_vault'}, 0, 25, batch=10)
+        self.assertEqual({(20, 25)}, set(node.ranges))
+        self.assertEqual(25, exporter.cursors['ethereum'])
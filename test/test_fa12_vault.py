@@ -3,6 +3,8 @@ from unittest import TestCase
 
 from pytezos import ContractInterface, MichelsonRuntimeError
 
+from atomex.views import run_view
+
 fa_address = 'KT1TjdF4H8H2qzxichtEbiCwHxCRM1SVx6B7' # should be deployed in the current test network
 source = 'tz1cShoBMAfpWX35DUcQRsXbqAgWAB4tz7kj'
 another_source = 'tz1grSQDByRpnVs7sPtaprNZRp531ZKz6Jmm'
@@ -43,7 +45,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           totalAmount=1000,
-                          payoffAmount=0) \
+                          payoffAmount=0,
+                          bountyAmount=0) \
                 .with_amount(1000) \
                 .interpret(storage=empty_storage,
                            source=source,
@@ -56,7 +59,8 @@ class AtomexContractTest(TestCase):
                       refundTime=6 * 3600,
                       tokenAddress=fa_address,
                       totalAmount=1000,
-                      payoffAmount=10) \
+                      payoffAmount=10,
+                      bountyAmount=0) \
             .interpret(storage=empty_storage,
                        source=source,
                        now=0)
@@ -66,13 +70,14 @@ class AtomexContractTest(TestCase):
                 'initiator': source,
                 'participant': party,
                 'payoffAmount': 10,
+                'bountyAmount': 0,
                 'totalAmount': 1000,
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address
             }
         }
         self.assertDictEqual(res_storage, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(src=source,
                             dst=res.operations[0]['source'],
                             amount=1000,
@@ -85,7 +90,8 @@ class AtomexContractTest(TestCase):
                       refundTime=6 * 3600,
                       tokenAddress=fa_address,
                       totalAmount=1000,
-                      payoffAmount=10) \
+                      payoffAmount=10,
+                      bountyAmount=0) \
             .interpret(storage=empty_storage,
                        sender=proxy,
                        source=source,
@@ -96,13 +102,14 @@ class AtomexContractTest(TestCase):
                 'initiator': proxy,
                 'participant': party,
                 'payoffAmount': 10,
+                'bountyAmount': 0,
                 'totalAmount': 1000,
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address
             }
         }
         self.assertDictEqual(res_storage, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(src=proxy,
                             dst=res.operations[0]['source'],
                             amount=1000,
@@ -116,7 +123,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 0
+                'payoffAmount': 0,
+                'bountyAmount': 0
             }
         }
 
@@ -127,7 +135,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           totalAmount=1000,
-                          payoffAmount=0) \
+                          payoffAmount=0,
+                          bountyAmount=0) \
                 .interpret(storage=initial_storage,
                            source=source,
                            now=0)
@@ -140,7 +149,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           totalAmount=100,
-                          payoffAmount=101) \
+                          payoffAmount=101,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            source=source,
                            now=0)
@@ -153,7 +163,8 @@ class AtomexContractTest(TestCase):
                           refundTime=0,
                           tokenAddress=fa_address,
                           totalAmount=1000,
-                          payoffAmount=0) \
+                          payoffAmount=0,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            source=source,
                            now=6 * 3600)
@@ -166,7 +177,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           totalAmount=1000,
-                          payoffAmount=0) \
+                          payoffAmount=0,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            sender=proxy,
                            source=party,
@@ -180,7 +192,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           totalAmount=1000,
-                          payoffAmount=0) \
+                          payoffAmount=0,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            sender=party,
                            source=source,
@@ -194,7 +207,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -203,7 +217,7 @@ class AtomexContractTest(TestCase):
             .interpret(storage=initial_storage, source=source, now=0)
 
         self.assertDictEqual({hashed_secret: None}, res.storage)
-        self.assertEqual(2, len(res.operations))
+        self.assertEqual(3, len(res.operations))
         self.assertTransfer(src=res.operations[0]['source'],
                             dst=party,
                             amount=990,
@@ -221,7 +235,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -238,7 +253,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -255,7 +271,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -273,7 +290,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -282,7 +300,7 @@ class AtomexContractTest(TestCase):
             .interpret(storage=initial_storage, source=source, now=60)
 
         self.assertDictEqual({hashed_secret: None}, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(src=res.operations[0]['source'],
                             dst=source,
                             amount=1000,
@@ -296,7 +314,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -305,12 +324,40 @@ class AtomexContractTest(TestCase):
             .interpret(storage=initial_storage, source=party, now=60)
 
         self.assertDictEqual({hashed_secret: None}, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(src=res.operations[0]['source'],
                             dst=source,
                             amount=1000,
                             parameters=res.operations[0]['parameters'])
 
+    def test_refund_with_bounty(self):
+        initial_storage = {
+            hashed_secret: {
+                'initiator': source,
+                'participant': party,
+                'refundTime': 0,
+                'tokenAddress': fa_address,
+                'totalAmount': 1000,
+                'payoffAmount': 10,
+                'bountyAmount': 5
+            }
+        }
+
+        res = self.atomex \
+            .refund(hashed_secret) \
+            .interpret(storage=initial_storage, source=party, now=60)
+
+        self.assertDictEqual({hashed_secret: None}, res.storage)
+        self.assertEqual(3, len(res.operations))
+        self.assertTransfer(src=res.operations[0]['source'],
+                            dst=source,
+                            amount=995,
+                            parameters=res.operations[0]['parameters'])
+        self.assertTransfer(src=res.operations[1]['source'],
+                            dst=party,
+                            amount=5,
+                            parameters=res.operations[1]['parameters'])
+
     def test_refund_before_expiration(self):
         initial_storage = {
             hashed_secret: {
@@ -319,7 +366,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 60,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -342,7 +390,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 60,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -366,7 +415,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -383,7 +433,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address,
                 'totalAmount': 1000,
-                'payoffAmount': 10
+                'payoffAmount': 10,
+                'bountyAmount': 0
             }
         }
 
@@ -396,14 +447,37 @@ class AtomexContractTest(TestCase):
                 'initiator': source,
                 'participant': party,
                 'payoffAmount': 10,
+                'bountyAmount': 0,
                 'totalAmount': 1100,
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address
             }
         }
         self.assertDictEqual(res_storage, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(src=another_source,
                             dst=res.operations[0]['source'],  # Atomex address
                             amount=100,
                             parameters=res.operations[0]['parameters'])
+
+    def test_views(self):
+        swap = {
+            'initiator': source,
+            'participant': party,
+            'refundTime': 6 * 3600,
+            'tokenAddress': fa_address,
+            'totalAmount': 1000,
+            'payoffAmount': 10,
+            'bountyAmount': 0
+        }
+        initial_storage = {hashed_secret: swap}
+        unknown = bytes(32)
+
+        for offchain in (False, True):
+            self.assertEqual(swap, run_view('fa12_vault', 'get_swap', hashed_secret, initial_storage, offchain))
+            self.assertIsNone(run_view('fa12_vault', 'get_swap', unknown, initial_storage, offchain))
+            self.assertEqual({hashed_secret: swap},
+                             run_view('fa12_vault', 'get_swaps', [hashed_secret, unknown], initial_storage, offchain))
+            self.assertTrue(run_view('fa12_vault', 'is_redeemable', (hashed_secret, 60), initial_storage, offchain))
+            self.assertFalse(run_view('fa12_vault', 'is_redeemable', (hashed_secret, 6 * 3600), initial_storage, offchain))
+            self.assertFalse(run_view('fa12_vault', 'is_redeemable', (unknown, 60), initial_storage, offchain))
@@ -5,6 +5,8 @@ from unittest import TestCase
 
 from pytezos import ContractInterface, pytezos, MichelsonRuntimeError
 
+from atomex.views import run_view
+
 fa_address = 'KT1TjdF4H8H2qzxichtEbiCwHxCRM1SVx6B7'  # just some valid address
 source = 'tz1cShoBMAfpWX35DUcQRsXbqAgWAB4tz7kj'
 another_source = 'tz1grSQDByRpnVs7sPtaprNZRp531ZKz6Jmm'
@@ -53,7 +55,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           tokenId=0,
-                          totalAmount=1000) \
+                          totalAmount=1000,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            source=source,
                            amount=1000,
@@ -66,7 +69,8 @@ class AtomexContractTest(TestCase):
                       refundTime=6 * 3600,
                       tokenAddress=fa_address,
                       tokenId=0,
-                      totalAmount=1000) \
+                      totalAmount=1000,
+                      bountyAmount=0) \
             .interpret(storage=empty_storage,
                        source=source,
                        now=0)
@@ -78,11 +82,12 @@ class AtomexContractTest(TestCase):
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
         self.assertDictEqual(res_storage, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(
             parameters=res.operations[0]['parameters'],
             from_=source,
@@ -96,7 +101,8 @@ class AtomexContractTest(TestCase):
                       refundTime=6 * 3600,
                       tokenAddress=fa_address,
                       tokenId=0,
-                      totalAmount=1000) \
+                      totalAmount=1000,
+                      bountyAmount=0) \
             .interpret(storage=empty_storage,
                        sender=proxy,
                        source=source,
@@ -109,11 +115,12 @@ class AtomexContractTest(TestCase):
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
         self.assertDictEqual(res_storage, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(
             parameters=res.operations[0]['parameters'],
             from_=proxy,
@@ -128,7 +135,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -139,7 +147,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           tokenId=0,
-                          totalAmount=1000) \
+                          totalAmount=1000,
+                          bountyAmount=0) \
                 .interpret(storage=initial_storage,
                            source=source,
                            now=0)
@@ -153,7 +162,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           tokenId=0,
-                          totalAmount=1000) \
+                          totalAmount=1000,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            source=source,
                            now=now)
@@ -166,7 +176,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           tokenId=0,
-                          totalAmount=1000) \
+                          totalAmount=1000,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            sender=proxy,
                            source=party,
@@ -180,7 +191,8 @@ class AtomexContractTest(TestCase):
                           refundTime=6 * 3600,
                           tokenAddress=fa_address,
                           tokenId=0,
-                          totalAmount=1000) \
+                          totalAmount=1000,
+                          bountyAmount=0) \
                 .interpret(storage=empty_storage,
                            sender=party,
                            source=source,
@@ -194,7 +206,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 6 * 3600,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -205,7 +218,7 @@ class AtomexContractTest(TestCase):
                        now=0)
 
         self.assertDictEqual({hashed_secret_bytes: None}, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(
             parameters=res.operations[0]['parameters'],
             from_=res.operations[0]['source'],
@@ -220,7 +233,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -239,7 +253,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 60,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -258,7 +273,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 60,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -278,7 +294,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -289,7 +306,7 @@ class AtomexContractTest(TestCase):
                        now=60)
 
         self.assertDictEqual({hashed_secret_bytes: None}, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(
             parameters=res.operations[0]['parameters'],
             from_=res.operations[0]['source'],
@@ -304,7 +321,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -315,13 +333,45 @@ class AtomexContractTest(TestCase):
                        now=60)
 
         self.assertDictEqual({hashed_secret_bytes: None}, res.storage)
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
         self.assertTransfer(
             parameters=res.operations[0]['parameters'],
             from_=res.operations[0]['source'],
             to_=source,
             txs=[(0, 1000)])
 
+    def test_refund_with_bounty(self):
+        initial_storage = {
+            hashed_secret_bytes: {
+                'initiator': source,
+                'participant': party,
+                'refundTime': 0,
+                'tokenAddress': fa_address,
+                'tokenId': 0,
+                'totalAmount': 1000,
+                'bountyAmount': 5
+            }
+        }
+
+        res = self.atomex \
+            .refund(hashed_secret) \
+            .interpret(storage=initial_storage,
+                       source=proxy,
+                       now=60)
+
+        self.assertDictEqual({hashed_secret_bytes: None}, res.storage)
+        self.assertEqual(3, len(res.operations))
+        self.assertTransfer(
+            parameters=res.operations[0]['parameters'],
+            from_=res.operations[0]['source'],
+            to_=source,
+            txs=[(0, 995)])
+        self.assertTransfer(
+            parameters=res.operations[1]['parameters'],
+            from_=res.operations[1]['source'],
+            to_=proxy,
+            txs=[(0, 5)])
+
     def test_refund_before_expiration(self):
         initial_storage = {
             hashed_secret_bytes: {
@@ -330,7 +380,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 60,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -357,7 +408,8 @@ class AtomexContractTest(TestCase):
                 'refundTime': 0,
                 'tokenAddress': fa_address,
                 'tokenId': 0,
-                'totalAmount': 1000
+                'totalAmount': 1000,
+                'bountyAmount': 0
             }
         }
 
@@ -367,4 +419,26 @@ class AtomexContractTest(TestCase):
                 .with_amount(100000) \
                 .interpret(storage=initial_storage,
                            source=source,
-                           now=60)
\ No newline at end of file
+                           now=60)
+
+    def test_views(self):
+        swap = {
+            'initiator': source,
+            'participant': party,
+            'refundTime': 6 * 3600,
+            'tokenAddress': fa_address,
+            'tokenId': 0,
+            'totalAmount': 1000,
+            'bountyAmount': 0
+        }
+        initial_storage = {hashed_secret_bytes: swap}
+        unknown = bytes(32)
+
+        for offchain in (False, True):
+            self.assertEqual(swap, run_view('fa2_vault', 'get_swap', hashed_secret_bytes, initial_storage, offchain))
+            self.assertIsNone(run_view('fa2_vault', 'get_swap', unknown, initial_storage, offchain))
+            self.assertEqual({hashed_secret_bytes: swap},
+                             run_view('fa2_vault', 'get_swaps', [hashed_secret_bytes, unknown], initial_storage, offchain))
+            self.assertTrue(run_view('fa2_vault', 'is_redeemable', (hashed_secret_bytes, 60), initial_storage, offchain))
+            self.assertFalse(run_view('fa2_vault', 'is_redeemable', (hashed_secret_bytes, 6 * 3600), initial_storage, offchain))
+            self.assertFalse(run_view('fa2_vault', 'is_redeemable', (unknown, 60), initial_storage, offchain))
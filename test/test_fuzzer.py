@@ -0,0 +1,64 @@
+from os.path import dirname, join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from atomex.fuzzer import Harness, fuzz, random_case, run_case, run_shard, shrink
+from atomex.vaults import TEZ_VAULT, hash_secret
+
+project_dir = dirname(dirname(__file__))
+tez_vault = join(project_dir, 'contracts/tezos/tez_vault.tz')
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+secret = bytes.fromhex('dca15ce0c01f61ab03139b4673f4bd902203dc3b898a89a5d35bad794e5cfd4f')
+
+
+class FuzzerTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = TemporaryDirectory()
+        # A vault letting initiators refund whenever they want
+        cls.early_refund = join(cls.tmp.name, 'tez_vault.tz')
+        with open(tez_vault) as src, open(cls.early_refund, 'w') as dst:
+            code = src.read()
+            check = 'NOW; IFCMPGE {} { PUSH string "refund_time has not come"; FAILWITH };'
+            assert check in code
+            dst.write(code.replace(check, 'DROP;'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_reproducible(self):
+        self.assertEqual(random_case(TEZ_VAULT, 1, 5, 30), random_case(TEZ_VAULT, 1, 5, 30))
+        self.assertNotEqual(random_case(TEZ_VAULT, 1, 5, 30), random_case(TEZ_VAULT, 1, 6, 30))
+
+    def test_lifecycle(self):
+        initiate = {'kind': 'initiate', 'now': 0, 'sender': source, 'source': source, 'amount': 1000,
+                    'participant': party, 'hashed_secret': hash_secret(secret), 'refund_time': 60, 'payoff': 10,
+                    'bounty': 0}
+        redeem = {'kind': 'redeem', 'now': 10, 'sender': source, 'source': source, 'amount': 0, 'secret': secret}
+        harness = Harness(TEZ_VAULT, tez_vault)
+        for step in (initiate, dict(initiate, now=1), redeem, redeem):
+            self.assertIsNone(harness.step(step))
+        self.assertEqual({}, harness.model.swaps)
+        self.assertEqual(-990, harness.ledger[('tez', source)])
+        self.assertEqual(990, harness.ledger[('tez', party)])
+
+    def test_vault_matches_model(self):
+        steps, failures = run_shard(TEZ_VAULT, 0, range(4), 40, tez_vault)
+        self.assertEqual(160, steps)
+        self.assertEqual([], failures)
+
+    def test_shrink_early_refund(self):
+        failing = next(case for case in map(lambda i: random_case(TEZ_VAULT, 0, i, 60), range(100))
+                       if run_case(TEZ_VAULT, case, self.early_refund))
+        shrunk = shrink(TEZ_VAULT, failing, self.early_refund)
+        self.assertEqual(['initiate', 'refund'], [step['kind'] for step in shrunk])
+        self.assertIn('refund time has not come', run_case(TEZ_VAULT, shrunk, self.early_refund)[1])
+
+    def test_fuzz_in_parallel(self):
+        steps, failures = fuzz(TEZ_VAULT, cases=4, steps=30, seed=1, workers=2, path=self.early_refund, shard_size=2)
+        self.assertEqual(120, steps)
+        self.assertTrue(failures)
+        self.assertTrue(all(len(failure['steps']) <= 3 for failure in failures))
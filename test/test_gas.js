@@ -0,0 +1,147 @@
+const crypto = require('crypto');
+const AtomexEthVault = artifacts.require('../contracts/ethereum/AtomexEthVault.sol');
+const AtomexErc20Vault = artifacts.require('../contracts/ethereum/AtomexErc20Vault.sol');
+const AtomexEthVaultBaseline = artifacts.require('../contracts/ethereum/baseline/AtomexEthVaultBaseline.sol');
+const AtomexErc20VaultBaseline = artifacts.require('../contracts/ethereum/baseline/AtomexErc20VaultBaseline.sol');
+const FiatTokenV1 = artifacts.require('../contracts/ethereum/FiatTokenV1.sol');
+
+// Gas used by initiate, redeem and refund of the vaults and of their baseline (unpacked Swap
+// struct), and per swap by batches of 1, 10 and 100 against single calls, printed as tables
+// after the suite:
+//     truffle test test/test_gas.js
+
+const sleep = async function (time) {
+    await web3.currentProvider.send({
+        id: new Date().getTime(),
+        jsonrpc: "2.0",
+        method: "evm_increaseTime",
+        params: [time]
+    }, function(error, result) {
+        if(error) console.error('evm_increaseTime: ' + error);
+    });
+    await web3.currentProvider.send({
+        id: new Date().getTime(),
+        jsonrpc: "2.0",
+        method: "evm_mine",
+        params: []
+    }, function(error, result){
+        if(error) console.error('evm_mine: ' + error);
+    });
+}
+
+function hashSecret(secret) {
+    let once = crypto.createHash('sha256').update(Buffer.from(secret.slice(2), 'hex')).digest();
+    return '0x' + crypto.createHash('sha256').update(once).digest('hex');
+}
+
+function makeSecrets(count, salt) {
+    return Array.from({length: count}, (_, i) => '0x' + salt.toString(16).padStart(2, '0') + i.toString(16).padStart(62, '0'));
+}
+
+function getCurrentTime() {
+    return new Promise(function(resolve) {
+      web3.eth.getBlock("latest").then(function(block) {
+            resolve(block.timestamp)
+        });
+    })
+}
+
+contract('Vault gas', async (accounts) => {
+    let secret = '0x1111111111111111111111111111111111111111111111111111111111111111';
+    let hashed_secret = '0x59420d36b80353ed5a5822ca464cc9bffb8abe9cd63959651d3cd85a8252d83f';
+    let refund_hashed_secret = '0x2222222222222222222222222222222222222222222222222222222222222222';
+    let gas = {};
+    let batchGas = {};
+
+    after(function() {
+        console.table(gas);
+        console.log('Gas per swap of redeemBatch/refundBatch, saved against single redeem/refund calls');
+        console.table(batchGas);
+    });
+
+    // Initiates and redeems a swap, initiates and refunds another one
+    async function measureCalls(vault, initiate) {
+        let refundTimestamp = (await getCurrentTime()) + 60;
+        let initiated = await initiate(hashed_secret, refundTimestamp);
+        let redeem = await vault.redeem(hashed_secret, secret, {from: accounts[2]});
+        await initiate(refund_hashed_secret, refundTimestamp);
+        await sleep(61);
+        let refund = await vault.refund(refund_hashed_secret, {from: accounts[0]});
+        return {initiate: initiated.receipt.gasUsed, redeem: redeem.receipt.gasUsed, refund: refund.receipt.gasUsed};
+    }
+
+    function compare(name, baseline, packed) {
+        for (let method of ['initiate', 'redeem', 'refund']) {
+            gas[`${name}.${method}`] = {
+                baseline: baseline[method],
+                packed: packed[method],
+                saved: baseline[method] - packed[method],
+            };
+            assert.isBelow(packed[method], baseline[method], `${name}.${method} uses more gas than the baseline`);
+        }
+    }
+
+    // Initiates `size` swaps with a common participant, redeems them in one batch and refunds another `size`
+    async function measureBatch(name, vault, initiate, size, salt) {
+        let secrets = makeSecrets(size, salt);
+        let hashes = secrets.map(hashSecret);
+        let refunds = makeSecrets(size, salt + 1).map(hashSecret);
+        let refundTimestamp = (await getCurrentTime()) + 600;
+        for (let hash of hashes.concat(refunds)) {
+            await initiate(hash, refundTimestamp);
+        }
+
+        let redeem = await vault.redeemBatch(hashes, secrets, {from: accounts[2]});
+        await sleep(601);
+        let refund = await vault.refundBatch(refunds, {from: accounts[2]});
+
+        let row = batchGas[`${name} x${size}`] = {
+            redeem: Math.round(redeem.receipt.gasUsed / size),
+            refund: Math.round(refund.receipt.gasUsed / size),
+        };
+        for (let method of ['redeem', 'refund']) {
+            // Against one redeem or refund call of the same vault, measured above
+            let single = gas[`${name}.${method}`].packed;
+            row[`${method} saved`] = single - row[method];
+            if (size > 1) {
+                assert.isBelow(row[method], single, `${name}.${method}Batch x${size} costs more per swap than ${method}`);
+            }
+        }
+    }
+
+    it('should measure AtomexEthVault gas against the baseline', async () => {
+        let measure = async (Vault) => {
+            let vault = await Vault.new();
+            return measureCalls(vault, (hash, refundTimestamp) =>
+                vault.initiate(hash, accounts[1], refundTimestamp, 0, 1, true, {from: accounts[0], value: 100}));
+        };
+        compare('AtomexEthVault', await measure(AtomexEthVaultBaseline), await measure(AtomexEthVault));
+    });
+
+    it('should measure AtomexErc20Vault gas against the baseline', async () => {
+        let measure = async (Vault) => {
+            let vault = await Vault.new();
+            let token = await FiatTokenV1.new('usdc', 'usdc', 100000, accounts[0]);
+            await token.approve(vault.address, 200);
+            return measureCalls(vault, (hash, refundTimestamp) =>
+                vault.initiate(hash, token.address, accounts[1], refundTimestamp, 0, 100, 1, true, {from: accounts[0]}));
+        };
+        compare('AtomexErc20Vault', await measure(AtomexErc20VaultBaseline), await measure(AtomexErc20Vault));
+    });
+
+    for (let [i, size] of [1, 10, 100].entries()) {
+        it(`should measure AtomexEthVault batches of ${size}`, async () => {
+            let vault = await AtomexEthVault.new();
+            await measureBatch('AtomexEthVault', vault, (hash, refundTimestamp) =>
+                vault.initiate(hash, accounts[1], refundTimestamp, 0, 1, true, {from: accounts[0], value: 100}), size, 2 * i);
+        });
+
+        it(`should measure AtomexErc20Vault batches of ${size}`, async () => {
+            let vault = await AtomexErc20Vault.new();
+            let token = await FiatTokenV1.new('usdc', 'usdc', 1000000, accounts[0]);
+            await token.approve(vault.address, 2 * size * 100);
+            await measureBatch('AtomexErc20Vault', vault, (hash, refundTimestamp) =>
+                vault.initiate(hash, token.address, accounts[1], refundTimestamp, 0, 100, 1, true, {from: accounts[0]}), size, 2 * i);
+        });
+    }
+});
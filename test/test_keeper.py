@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+from atomex.events import VaultEvent
+from atomex.keeper import Keeper
+from atomex.vaults import TEZ_VAULT
+from conftest import Getter, StandInClient, hashed_secret, make_mempool, make_swap, party, source, vault_address
+
+
+class Stop(Exception):
+    pass
+
+
+class KeeperTest(TestCase):
+
+    def test_track_expired(self):
+        now = [0]
+        keeper = Keeper(StandInClient(), {TEZ_VAULT: vault_address}, clock=lambda: now[0])
+        state = {'initiator': source, 'participant': party, 'amount': 980000, 'refund_time': 60,
+                 'payoff': 20000, 'bounty': 5000}
+        other = bytes(32)
+        keeper.track([
+            VaultEvent(1, 'oo1', vault_address, 'initiated', hashed_secret, state),
+            VaultEvent(1, 'oo2', vault_address, 'initiated', other, dict(state, bounty=0)),
+            VaultEvent(2, 'oo3', vault_address, 'added', hashed_secret, {'hashed_secret': hashed_secret, 'amount': 990000}),
+        ])
+        self.assertEqual([], keeper.expired())
+
+        now[0] = 60
+        expired = keeper.expired()
+        self.assertEqual([(hashed_secret, 990000, 5000)], [(swap.hashed_secret, swap.amount, swap.bounty)
+                                                           for swap in expired])
+        self.assertEqual(1005000, expired[0].refund_amount)
+
+        keeper.track([VaultEvent(3, 'oo4', vault_address, 'refunded', hashed_secret, hashed_secret)])
+        self.assertEqual([], keeper.expired())
+
+    def test_step(self):
+        swap = make_swap()
+        for client, sent in ((StandInClient(), [[('refund', hashed_secret)]]),
+                             (StandInClient(mempool=make_mempool('refund', hashed_secret)), []),
+                             (StandInClient(fee=6000), [])):
+            keeper = Keeper(client, {TEZ_VAULT: vault_address}, clock=lambda: swap.refund_time)
+            keeper.swaps[(TEZ_VAULT, hashed_secret)] = swap
+            keeper.step()
+            self.assertEqual(sent, client.sent)
+
+    def test_run_catches_up(self):
+        heads, tracked = [3, 4, 7], []
+
+        def wait_next_block():
+            heads.pop(0)
+            if not heads:
+                raise Stop()
+
+        def block(level):
+            return SimpleNamespace(operations=SimpleNamespace(managers=lambda: tracked.append(level) or []))
+
+        client = StandInClient()
+        client.shell.head = SimpleNamespace(header=lambda: {'level': heads[0]})
+        client.shell.blocks = Getter(block)
+        client.shell.wait_next_block = wait_next_block
+        keeper = Keeper(client, {TEZ_VAULT: vault_address})
+        with self.assertRaises(Stop):
+            keeper.run()
+        # Blocks 5 and 6 came while the keeper was busy, their events are not lost
+        self.assertEqual([3, 4, 5, 6, 7], tracked)
+        self.assertEqual(7, keeper.level)
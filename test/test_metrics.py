@@ -0,0 +1,113 @@
+from os.path import dirname, join
+from unittest import TestCase
+from urllib.request import urlopen
+
+from pytezos import ContractInterface, MichelsonRuntimeError
+
+from atomex.metrics import Registry, SwapTimer, failwith_message, gas_used, serve, track_gas
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+project_dir = dirname(dirname(__file__))
+
+
+class MetricsTest(TestCase):
+
+    def test_counter(self):
+        metrics = Registry()
+        rpc = metrics.counter('rpc_requests', 'RPC calls', labels=('endpoint',))
+        rpc.inc(endpoint='head')
+        rpc.inc(2, endpoint='head')
+        rpc.inc(endpoint='injection')
+
+        self.assertEqual(3, rpc.value(endpoint='head'))
+        self.assertEqual(
+            '# HELP rpc_requests RPC calls\n'
+            '# TYPE rpc_requests counter\n'
+            'rpc_requests_total{endpoint="head"} 3\n'
+            'rpc_requests_total{endpoint="injection"} 1\n',
+            metrics.render())
+
+    def test_counter_labels_mismatch(self):
+        rpc = Registry().counter('rpc_requests', 'RPC calls', labels=('endpoint',))
+        with self.assertRaises(ValueError):
+            rpc.inc(node='localhost')
+
+    def test_histogram(self):
+        metrics = Registry()
+        latency = metrics.histogram('latency_seconds', 'Latency', buckets=(1, 5))
+        latency.observe(0.5)
+        latency.observe(1)
+        latency.observe(7)
+
+        self.assertEqual(3, latency.count())
+        self.assertEqual(8.5, latency.sum())
+        self.assertEqual(
+            '# HELP latency_seconds Latency\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{le="1"} 2\n'
+            'latency_seconds_bucket{le="5"} 2\n'
+            'latency_seconds_bucket{le="+Inf"} 3\n'
+            'latency_seconds_sum 8.5\n'
+            'latency_seconds_count 3\n',
+            metrics.render())
+
+    def test_swap_timer(self):
+        latency = Registry().histogram('latency_seconds', 'Latency', labels=('vault',))
+        timer = SwapTimer(latency)
+        timer.start(b'\x01', at=100)
+        timer.start(b'\x01', at=105)
+
+        self.assertIsNone(timer.stop(b'\x02', at=110, vault='tez'))
+        self.assertEqual(10, timer.stop(b'\x01', at=110, vault='tez'))
+        self.assertEqual(1, latency.count(vault='tez'))
+
+    def test_failwith_message_interpreter(self):
+        atomex = ContractInterface.from_file(join(project_dir, 'contracts/tezos/tez_vault.tz'))
+        with self.assertRaises(MichelsonRuntimeError) as ctx:
+            atomex.refund(bytes(32)).interpret(storage=[{}, None], source=source)
+        self.assertEqual('no swap for such hash', failwith_message(ctx.exception))
+
+        with self.assertRaises(MichelsonRuntimeError) as ctx:
+            atomex.initiate(participant=source, hashed_secret=bytes(32), refund_time=60, payoff=0, bounty=2000) \
+                .with_amount(1000) \
+                .interpret(storage=[{}, None], source=source, now=0)
+        self.assertEqual('bounty exceeds the amount', failwith_message(ctx.exception))
+
+    def test_failwith_message_rpc(self):
+        errors = [
+            {'kind': 'temporary', 'id': 'proto.alpha.michelson_v1.runtime_error'},
+            {'kind': 'temporary', 'id': 'proto.alpha.michelson_v1.script_rejected',
+             'with': {'string': 'refund time has already come'}},
+        ]
+        self.assertEqual('refund time has already come', failwith_message(errors))
+        self.assertEqual('bounty amount exceeds the total',
+                         failwith_message([dict(errors[1], **{'with': {'string': 'bounty amount exceeds the total'}})]))
+        self.assertEqual('unknown', failwith_message({'with': {'int': '42'}}))
+
+    def test_track_gas(self):
+        vault_address = 'KT1VG2WtYdSWz5E7chTeAdDPZNy2MpP8pTfL'
+        redeem = {'kind': 'transaction', 'destination': vault_address,
+                  'parameters': {'entrypoint': 'redeem', 'value': {'bytes': '00'}}}
+        operation_group = {'contents': [
+            dict(redeem, metadata={'operation_result': {'status': 'applied', 'consumed_milligas': '2500300'}}),
+            dict(redeem, metadata={'operation_result': {'status': 'backtracked', 'consumed_milligas': '100'}}),
+            {'kind': 'transaction', 'destination': source, 'metadata': {
+                'operation_result': {'status': 'applied', 'consumed_milligas': '100000'},
+                'internal_operation_results': [dict(redeem, result={'status': 'applied', 'consumed_milligas': '700'})],
+            }},
+        ]}
+        labels = {'vault': 'tez_vault', 'entrypoint': 'redeem'}
+        count, total = gas_used.count(**labels), gas_used.sum(**labels)
+        track_gas({vault_address: 'tez_vault'}, operation_group)
+        self.assertEqual(count + 2, gas_used.count(**labels))
+        self.assertEqual(total + 2501 + 1, gas_used.sum(**labels))
+
+    def test_serve(self):
+        metrics = Registry()
+        metrics.counter('rpc_requests', 'RPC calls').inc()
+        server = serve(port=0, metrics=metrics)
+        try:
+            with urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as res:
+                self.assertIn('rpc_requests_total 1', res.read().decode())
+        finally:
+            server.shutdown()
@@ -0,0 +1,45 @@
+const AtomexEthVault = artifacts.require('../contracts/ethereum/AtomexEthVault.sol');
+const Multicall = artifacts.require('../contracts/ethereum/Multicall.sol');
+
+function getCurrentTime() {
+    return new Promise(function(resolve) {
+      web3.eth.getBlock("latest").then(function(block) {
+            resolve(block.timestamp)
+        });
+    })
+}
+
+contract('Multicall', async (accounts) => {
+    let vault;
+    let multicall;
+
+    beforeEach(async function(){
+        vault = await AtomexEthVault.new();
+        multicall = await Multicall.new();
+    });
+
+    it('should read many swaps in one call', async () => {
+        let refundTimestamp = (await getCurrentTime()) + 60;
+        let hashes = [];
+        for (let i = 1; i <= 5; i++) {
+            let hashed_secret = '0x' + i.toString(16).padStart(64, '0');
+            hashes.push(hashed_secret);
+            await vault.initiate(hashed_secret, accounts[1], refundTimestamp, 0, 0, true, {from: accounts[0], value: 100 * i});
+        }
+        hashes.push('0x' + 'ff'.repeat(32));
+
+        let calls = hashes.map(hash => ({target: vault.address, callData: vault.contract.methods.swaps(hash).encodeABI()}));
+        let result = await multicall.aggregate(calls);
+        assert.equal(result.returnData.length, hashes.length);
+
+        let outputs = vault.abi.find(item => item.name === 'swaps').outputs;
+        for (let i = 0; i < 5; i++) {
+            let swap = web3.eth.abi.decodeParameters(outputs, result.returnData[i]);
+            assert.equal(swap.participant, accounts[1]);
+            assert.equal(swap.value, 100 * (i + 1));
+            assert.equal(swap.state, 1);
+        }
+        let empty = web3.eth.abi.decodeParameters(outputs, result.returnData[5]);
+        assert.equal(empty.state, 0);
+    });
+});
@@ -0,0 +1,127 @@
+from collections import Counter
+from os.path import dirname, exists, join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pytezos import ContractInterface
+from pytezos.michelson.format import micheline_to_michelson
+from pytezos.michelson.parse import michelson_to_micheline
+
+from atomex.fuzzer import record_calls
+from atomex.optimizer import gas_report, install, optimize, optimize_code, script_size
+from atomex.replay import interpret
+from atomex.vaults import build_dir
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+secret = 'dca15ce0c01f61ab03139b4673f4bd902203dc3b898a89a5d35bad794e5cfd4f'
+hashed_secret = bytes.fromhex('05bce5c12071fbca95b13d49cb5ef45323e0216d618bb4575c519b74be75e3da')
+project_dir = dirname(dirname(__file__))
+tez_vault = join(project_dir, 'contracts/tezos/tez_vault.tz')
+
+
+def rewrite(code: str) -> str:
+    return micheline_to_michelson(optimize_code(michelson_to_micheline(code), Counter()))
+
+
+class OptimizerTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = TemporaryDirectory()
+        cls.script = ContractInterface.from_file(tez_vault).context.script['code']
+        cls.optimized, cls.stats = optimize(cls.script)
+        cls.candidate = join(cls.tmp.name, 'tez_vault.tz')
+        with open(cls.candidate, 'w') as f:
+            f.write(micheline_to_michelson(cls.optimized, inline=False))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_rules(self):
+        self.assertEqual('{ ADD }', rewrite('{ DUP ; DROP ; ADD ; PUSH nat 1 ; DROP ; SWAP ; SWAP }'))
+        self.assertEqual('{}', rewrite('{ DIG 3 ; DUG 3 ; DIG 1 ; DUG 1 ; DIP {} ; DIG 0 }'))
+        self.assertEqual('{ SWAP ; ADD }', rewrite('{ DIG 1 ; ADD }'))
+        self.assertEqual('{ DROP 3 }', rewrite('{ DROP ; DROP 2 }'))
+        self.assertEqual('{ DUP }', rewrite('{ DUP ; SWAP }'))
+        self.assertEqual('{ UNPAIR }', rewrite('{ DUP ; CDR ; SWAP ; CAR }'))
+        self.assertEqual('{ ADD ; MUL ; SUB }', rewrite('{ ADD ; { MUL ; { SUB } } }'))
+
+    def test_data_untouched(self):
+        # Sequences in PUSH values are data (lists, pairs, lambdas), not blocks to flatten or rewrite
+        for code in ('{ PUSH (list (pair nat nat)) { { 1 ; 2 } } }',
+                     '{ PUSH (list (list nat)) { {} } }',
+                     '{ PUSH (lambda nat nat) { { DUP ; DROP } } }'):
+            self.assertEqual(michelson_to_micheline(code), michelson_to_micheline(rewrite(code)))
+        self.assertEqual('{ LAMBDA nat nat { ADD } ; DIP 2 { MUL } }',
+                         rewrite('{ LAMBDA nat nat { { DUP ; DROP } ; ADD } ; DIP 2 { { MUL } } }'))
+
+    def test_shared_lookup(self):
+        lookup = 'CONTRACT %transfer nat ; IF_NONE { PUSH string "no entrypoint" ; FAILWITH } {}'
+        self.assertEqual(michelson_to_micheline(f'{{ DUP 3 ; {lookup} ; DUP }}'),
+                         michelson_to_micheline(rewrite(f'{{ DUP 3 ; {lookup} ; DUP 4 ; {lookup} }}')))
+        self.assertEqual(michelson_to_micheline(f'{{ {lookup} ; DUP }}'),
+                         michelson_to_micheline(rewrite(f'{{ DUP ; {lookup} ; SWAP ; {lookup} }}')))
+        # Not the same value looked up, or not a pure instruction
+        self.assertEqual('{ DUP 3 ; CAR ; DUP 3 ; CAR }', rewrite('{ DUP 3 ; CAR ; DUP 3 ; CAR }'))
+        self.assertEqual('{ DUP ; EXEC ; SWAP ; EXEC }', rewrite('{ DUP ; EXEC ; SWAP ; EXEC }'))
+
+    def test_smaller(self):
+        self.assertLess(script_size(self.optimized), script_size(self.script))
+        self.assertGreater(self.stats['flatten'], 0)
+
+    def test_same_behaviour(self):
+        atomex = ContractInterface.from_file(tez_vault)
+        storage = atomex.storage.encode([{
+            hashed_secret: {
+                'initiator': source,
+                'participant': party,
+                'amount': 980000,
+                'refund_time': 60,
+                'payoff': 20000,
+                'bounty': 5000
+            }
+        }, None])
+        calls = [
+            {'entrypoint': 'redeem', 'parameter': atomex.redeem(secret).parameters['value'], 'timestamp': 0},
+            {'entrypoint': 'redeem', 'parameter': atomex.redeem(secret).parameters['value'], 'timestamp': 60},
+            {'entrypoint': 'refund', 'parameter': atomex.refund(hashed_secret).parameters['value'], 'timestamp': 0},
+            {'entrypoint': 'refund', 'parameter': atomex.refund(hashed_secret).parameters['value'], 'timestamp': 60},
+            {'entrypoint': 'initiate', 'amount': 1000000, 'timestamp': 0,
+             'parameter': atomex.initiate(participant=party, hashed_secret=b'\x01' * 32, refund_time=60,
+                                          payoff=100, bounty=0).parameters['value']},
+        ]
+        for call in calls:
+            call = dict(call, storage=storage, source=source)
+            operations, storage_after, _, error = interpret(tez_vault, call)
+            expected = (operations, storage_after, str(error) if error else None)
+            operations, storage_after, _, error = interpret(self.candidate, call)
+            self.assertEqual(expected, (operations, storage_after, str(error) if error else None))
+
+    def test_gas_report(self):
+        script = [dict(section, args=[[{'prim': 'DUP'}, {'prim': 'DROP'}] + section['args'][0]])
+                  if section['prim'] == 'code' else section for section in self.script]
+        current = join(self.tmp.name, 'current.tz')
+        with open(current, 'w') as f:
+            f.write(micheline_to_michelson(script, inline=False))
+        calls = list(record_calls('tez_vault', 0, range(5), 10, tez_vault))
+        report = gas_report('tez_vault', current, self.candidate, calls)
+        self.assertEqual({'add', 'initiate', 'redeem', 'refund'} & set(report), set(report))
+        self.assertIn('initiate', report)
+        for entrypoint in report.values():
+            self.assertEqual(entrypoint['steps']['before'] - 2, entrypoint['steps']['after'])
+            self.assertNotIn('gas', entrypoint)
+
+    def test_install_only_if_tests_pass(self):
+        output = join(self.tmp.name, 'optimizer_test.tz')
+        self.assertFalse(install(self.candidate, output, tests=lambda: False))
+        self.assertFalse(exists(output))
+        self.assertFalse(exists(join(build_dir, 'optimizer_test.tz')))
+
+        seen = []
+        self.assertTrue(install(self.candidate, output, tests=lambda: seen.append(
+            exists(join(build_dir, 'optimizer_test.tz'))) or True))
+        self.assertEqual([True], seen)
+        self.assertTrue(exists(output))
+        self.assertFalse(exists(join(build_dir, 'optimizer_test.tz')))
@@ -0,0 +1,264 @@
+import asyncio
+from hashlib import sha256
+from os import urandom
+from threading import Lock
+from time import sleep
+from types import SimpleNamespace
+from unittest import TestCase
+
+from pytezos.rpc.node import RpcError, RpcNotFoundError
+
+from atomex.metrics import gas_used
+from atomex.orchestrator import (ACTIVATED, DONE, FAILED, INITIATED, REDEEMED, REFUNDED, EthereumChain, Orchestrator,
+                                 SwapStore, TezosChain)
+from atomex.vaults import TEZ_VAULT
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+eth_initiator = '0x00000000000000000000000000000000000000a1'
+eth_party = '0x00000000000000000000000000000000000000b2'
+
+
+class StandInChain:
+    """Swaps kept in memory, mirrors what a sandbox or anvil vault would hold"""
+
+    def __init__(self, now=0, fail_times=0):
+        self.clock = now
+        self.swaps = {}
+        self.calls = []
+        self.fail_times = fail_times
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = Lock()
+
+    def _record(self, name, hashed_secret):
+        with self._lock:
+            self.calls.append((name, hashed_secret))
+            if self.fail_times:
+                self.fail_times -= 1
+                raise ConnectionError('node is unavailable')
+
+    def initiate(self, leg, hashed_secret):
+        self._record('initiate', hashed_secret)
+        assert hashed_secret not in self.swaps
+        self.swaps[hashed_secret] = dict(leg, active=leg.get('active', True))
+
+    def activate(self, leg, hashed_secret):
+        self._record('activate', hashed_secret)
+        self.swaps[hashed_secret]['active'] = True
+
+    def redeem(self, leg, hashed_secret, secret):
+        self._record('redeem', hashed_secret)
+        assert sha256(sha256(secret).digest()).digest() == hashed_secret
+        assert self.clock < self.swaps[hashed_secret]['refund_time']
+        del self.swaps[hashed_secret]
+
+    def refund(self, leg, hashed_secret):
+        self._record('refund', hashed_secret)
+        assert self.clock >= self.swaps[hashed_secret]['refund_time']
+        del self.swaps[hashed_secret]
+
+    def is_open(self, leg, hashed_secret):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return hashed_secret in self.swaps
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def now(self):
+        return self.clock
+
+
+class FlakyChain(StandInChain):
+    """Fails the first `errors` swap lookups like an overloaded node, time moves by `tick` on every read"""
+
+    def __init__(self, errors=0, tick=0):
+        super().__init__()
+        self.errors = errors
+        self.tick = tick
+
+    def is_open(self, leg, hashed_secret):
+        if self.errors:
+            self.errors -= 1
+            raise RpcError('503 Service Unavailable')
+        return super().is_open(leg, hashed_secret)
+
+    def now(self):
+        self.clock += self.tick
+        return self.clock
+
+
+def make_swap(tezos_refund_time=7200, ethereum_refund_time=3600):
+    secret = urandom(32)
+    return {
+        'hashed_secret': sha256(sha256(secret).digest()).hexdigest(),
+        'secret': secret.hex(),
+        'legs': [
+            {'chain': 'tezos', 'vault': 'tez_vault', 'initiator': source, 'participant': party,
+             'amount': 980000, 'payoff': 20000, 'refund_time': tezos_refund_time},
+            {'chain': 'ethereum', 'vault': 'AtomexEthVault', 'initiator': eth_party, 'participant': eth_initiator,
+             'amount': 10 ** 18, 'payoff': 0, 'refund_time': ethereum_refund_time, 'active': False},
+        ],
+    }
+
+
+class OrchestratorTest(TestCase):
+
+    def setUp(self):
+        self.tezos = StandInChain()
+        self.ethereum = StandInChain()
+        self.store = SwapStore()
+
+    def orchestrator(self, **kwargs):
+        kwargs.setdefault('poll_interval', 0)
+        return Orchestrator(self.store, {'tezos': self.tezos, 'ethereum': self.ethereum}, **kwargs)
+
+    def test_swaps_complete(self):
+        swaps = [make_swap() for _ in range(100)]
+        asyncio.run(self.orchestrator(concurrency=8).run(swaps))
+
+        for swap in swaps:
+            self.assertEqual(DONE, self.store.get(swap['hashed_secret'])['state'])
+        self.assertEqual({}, self.tezos.swaps)
+        self.assertEqual({}, self.ethereum.swaps)
+        self.assertEqual(300, len(self.ethereum.calls))
+        self.assertLessEqual(self.tezos.max_in_flight + self.ethereum.max_in_flight, 8)
+        self.assertEqual([], self.store.active())
+
+    def test_resume_after_crash(self):
+        swap = make_swap()
+        hashed_secret = bytes.fromhex(swap['hashed_secret'])
+        swap['state'] = INITIATED
+        self.store.add(swap)
+        # the counter leg was initiated right before the crash, but the state was not saved
+        self.tezos.swaps[hashed_secret] = dict(swap['legs'][0])
+        self.ethereum.swaps[hashed_secret] = dict(swap['legs'][1])
+
+        asyncio.run(self.orchestrator().run())
+
+        self.assertEqual(DONE, self.store.get(swap['hashed_secret'])['state'])
+        self.assertEqual([], [name for name, _ in self.tezos.calls if name == 'initiate'])
+        self.assertEqual([], [name for name, _ in self.ethereum.calls if name == 'initiate'])
+
+    def test_refund_after_missed_window(self):
+        swap = make_swap(tezos_refund_time=200, ethereum_refund_time=100)
+        self.tezos.clock = self.ethereum.clock = 300
+        swap['state'] = INITIATED
+        hashed_secret = bytes.fromhex(swap['hashed_secret'])
+        self.tezos.swaps[hashed_secret] = dict(swap['legs'][0])
+        self.ethereum.swaps[hashed_secret] = dict(swap['legs'][1], active=True)
+
+        asyncio.run(self.orchestrator().run([swap]))
+
+        self.assertEqual(REFUNDED, self.store.get(swap['hashed_secret'])['state'])
+        self.assertIn(('refund', hashed_secret), self.tezos.calls)
+        self.assertIn(('refund', hashed_secret), self.ethereum.calls)
+
+    def test_retry_then_fail(self):
+        self.tezos.fail_times = 2
+        swap = make_swap()
+        asyncio.run(self.orchestrator(max_attempts=3).run([swap]))
+        self.assertEqual(DONE, self.store.get(swap['hashed_secret'])['state'])
+
+        self.tezos.fail_times = 10
+        swap = make_swap()
+        asyncio.run(self.orchestrator(max_attempts=3).run([swap]))
+        stored = self.store.get(swap['hashed_secret'])
+        self.assertEqual(FAILED, stored['state'])
+        self.assertEqual('node is unavailable', stored['error'])
+
+    def test_counter_leg_redeemed_by_somebody_else(self):
+        swap = make_swap()
+        swap['state'] = ACTIVATED
+        hashed_secret = bytes.fromhex(swap['hashed_secret'])
+        # gone before its refund time, e.g. redeemed by a relayer for the participant
+        self.tezos.swaps[hashed_secret] = dict(swap['legs'][0])
+
+        asyncio.run(self.orchestrator().run([swap]))
+
+        self.assertEqual(DONE, self.store.get(swap['hashed_secret'])['state'])
+        self.assertEqual([], self.ethereum.calls)
+        self.assertEqual([('redeem', hashed_secret)], self.tezos.calls)
+
+    def test_temporary_node_error(self):
+        self.tezos = FlakyChain(tick=600)
+        self.ethereum = FlakyChain(errors=4, tick=600)
+        swap = make_swap()
+        swap['state'] = ACTIVATED
+        hashed_secret = bytes.fromhex(swap['hashed_secret'])
+        self.tezos.swaps[hashed_secret] = dict(swap['legs'][0])
+        self.ethereum.swaps[hashed_secret] = dict(swap['legs'][1], active=True)
+
+        # The failing lookups neither close the leg nor fail the swap, its funds are refunded
+        asyncio.run(self.orchestrator(max_attempts=3).run([swap]))
+
+        self.assertEqual(REFUNDED, self.store.get(swap['hashed_secret'])['state'])
+        self.assertEqual([('refund', hashed_secret)], self.tezos.calls)
+        self.assertEqual([('refund', hashed_secret)], self.ethereum.calls)
+
+    def test_tezos_is_open(self):
+        errors = [RpcError('503 Service Unavailable'), RpcNotFoundError('Not found')]
+
+        def lookup():
+            raise errors.pop(0)
+
+        storage = [{bytes(32): lookup, bytes([1]) * 32: lambda: {'amount': 1}}]
+        client = SimpleNamespace(contract=lambda address: SimpleNamespace(storage=storage))
+        chain = TezosChain({source: client}, {TEZ_VAULT: 'KT1VG2WtYdSWz5E7chTeAdDPZNy2MpP8pTfL'})
+        leg = make_swap()['legs'][0]
+        with self.assertRaises(RpcError):
+            chain.is_open(leg, bytes(32))
+        self.assertFalse(chain.is_open(leg, bytes(32)))
+        self.assertFalse(chain.is_open(leg, bytes([2]) * 32))
+        self.assertTrue(chain.is_open(leg, bytes([1]) * 32))
+
+    def test_resume_after_redeem(self):
+        swap = make_swap()
+        swap.update(state=REDEEMED, redeeming=0)
+        # the first leg was redeemed right before the crash, but the state was not saved
+        asyncio.run(self.orchestrator().run([swap]))
+
+        self.assertEqual(DONE, self.store.get(swap['hashed_secret'])['state'])
+        self.assertEqual([], self.tezos.calls)
+
+    def test_tezos_injections_per_key(self):
+        in_flight, overlaps = {}, []
+
+        class Call:
+
+            def __init__(self, account):
+                self.account = account
+
+            def send(self, min_confirmations):
+                in_flight[self.account] = in_flight.get(self.account, 0) + 1
+                overlaps.append(in_flight[self.account] > 1)
+                sleep(0.01)
+                in_flight[self.account] -= 1
+                return SimpleNamespace(opg_result={'contents': []})
+
+        def client(account):
+            vault = SimpleNamespace(redeem=lambda secret: Call(account))
+            return SimpleNamespace(contract=lambda address: vault)
+
+        chain = TezosChain({source: client(source), party: client(party)},
+                           {'tez_vault': 'KT1VG2WtYdSWz5E7chTeAdDPZNy2MpP8pTfL'})
+        legs = [dict(make_swap()['legs'][0], participant=account) for account in (source, party) * 4]
+
+        async def redeem_all():
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(None, chain.redeem, leg, bytes(32), bytes(32)) for leg in legs))
+
+        asyncio.run(redeem_all())
+        self.assertEqual(8, len(overlaps))
+        self.assertFalse(any(overlaps))
+
+    def test_ethereum_gas(self):
+        rpc = SimpleNamespace(transact=lambda sender, to, data, value=0: {'gasUsed': '0x7530'})
+        chain = EthereumChain(rpc, {'AtomexEthVault': '0x00000000000000000000000000000000000000c3'})
+        leg = make_swap()['legs'][1]
+        count = gas_used.count(vault='AtomexEthVault', entrypoint='refund')
+        chain.refund(leg, bytes(32))
+        self.assertEqual(count + 1, gas_used.count(vault='AtomexEthVault', entrypoint='refund'))
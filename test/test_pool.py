@@ -0,0 +1,131 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import monotonic, sleep
+from unittest import TestCase
+
+from pytezos.rpc.shell import ShellQuery
+
+from atomex.pool import NoHealthyNode, RpcPool
+
+
+class StubNode:
+    """Local node serving its head header and accepting injections, with a configurable delay and lag"""
+
+    def __init__(self, level=100, delay=0.0):
+        self.level = level
+        self.delay = delay
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body):
+                sleep(stub.delay)
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                stub.requests.append(('GET', self.path))
+                if self.path.startswith('/chains/main/blocks/head/header'):
+                    self.reply({'level': stub.level, 'hash': f'B{stub.level}'})
+                else:
+                    self.reply({'served_by': stub.port})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append(('POST', self.path))
+                self.reply('oo' + str(stub.port))
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.uri = f'http://127.0.0.1:{self.port}'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reads(self):
+        return [path for method, path in self.requests if method == 'GET' and 'header' not in path]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RpcPoolTest(TestCase):
+
+    def setUp(self):
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+
+    def stub(self, **kwargs):
+        node = StubNode(**kwargs)
+        self.nodes.append(node)
+        return node
+
+    def test_spread_reads(self):
+        nodes = [self.stub() for _ in range(3)]
+        pool = RpcPool([node.uri for node in nodes])
+        for _ in range(60):
+            pool.get('/chains/main/blocks/head/context/constants')
+        self.assertTrue(all(node.reads() for node in nodes))
+
+    def test_skip_lagging_nodes(self):
+        fresh, lagging = self.stub(level=100), self.stub(level=90)
+        pool = RpcPool([fresh.uri, lagging.uri], max_lag=2)
+        for _ in range(10):
+            self.assertEqual(fresh.port, pool.get('/chains/main/blocks/head')['served_by'])
+        self.assertEqual([], lagging.reads())
+
+    def test_hedge_slow_node(self):
+        slow, fast = self.stub(delay=1.0), self.stub()
+        pool = RpcPool([slow.uri, fast.uri], hedge_delay=0.1, head_timeout=2.0)
+        pool.refresh()
+        pool.nodes[0].latencies.clear()
+        pool.nodes[1].latencies.extend([1.0] * 10)  # make the slow node look like the better one
+        start = monotonic()
+        self.assertEqual(fast.port, pool.get('/chains/main/blocks/head')['served_by'])
+        self.assertLess(monotonic() - start, 0.9)
+        self.assertEqual(1, len(slow.reads()))
+
+    def test_fail_over(self):
+        alive, dead = self.stub(), self.stub()
+        dead.stop()
+        self.nodes.remove(dead)
+        pool = RpcPool([dead.uri, alive.uri], head_timeout=1.0)
+        self.assertEqual(alive.port, pool.get('/chains/main/blocks/head')['served_by'])
+        self.assertEqual(1, pool.nodes[0].failures)
+
+    def test_pin_injections_to_head(self):
+        behind, at_head, fast = self.stub(level=99), self.stub(level=100), self.stub(level=100)
+        pool = RpcPool([behind.uri, at_head.uri, fast.uri])
+        pool.refresh()
+        pool.nodes[1].latencies.extend([0.001] * 10)
+        pool.nodes[2].latencies.extend([0.5] * 10)
+
+        self.assertEqual(f'oo{at_head.port}', pool.post('/injection/operation', json='00'))
+        pool.nodes[2].latencies.clear()
+        self.assertEqual(f'oo{at_head.port}', pool.post('/injection/operation', json='00'))
+        self.assertEqual([], [path for method, path in behind.requests + fast.requests if method == 'POST'])
+
+        at_head.level = 98
+        self.assertEqual(f'oo{fast.port}', pool.post('/injection/operation', json='00'))
+
+    def test_no_healthy_node(self):
+        node = self.stub()
+        node.stop()
+        self.nodes.remove(node)
+        with self.assertRaises(NoHealthyNode):
+            RpcPool([node.uri], head_timeout=0.5).get('/chains/main/blocks/head')
+
+    def test_shell(self):
+        nodes = [self.stub(level=7), self.stub(level=7)]
+        shell = ShellQuery(node=RpcPool([node.uri for node in nodes]))
+        self.assertEqual(7, shell.head.header()['level'])
@@ -0,0 +1,50 @@
+from os.path import dirname, join
+from unittest import TestCase
+
+from pytezos import ContractInterface
+
+from atomex.profiler import STARTUP_FRAME, attribute, folded, index_locations
+
+project_dir = dirname(dirname(__file__))
+
+
+class ProfilerTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.atomex = ContractInterface.from_file(join(project_dir, 'contracts/tezos/tez_vault.tz'))
+        cls.index = index_locations(cls.atomex.context.script['code'])
+
+    def locate(self, prim, entrypoint):
+        return [loc for loc, (name, frames) in self.index.items() if name == prim and entrypoint in frames]
+
+    def test_index_entrypoints(self):
+        self.assertEqual(2, len(self.locate('SHA256', 'redeem')))
+        self.assertEqual([], self.locate('SHA256', 'refund'))
+        self.assertEqual(2, len(self.locate('CONTRACT', 'initiate')))
+
+    def test_index_frames(self):
+        first, second = self.locate('SHA256', 'redeem')
+        self.assertEqual(first + 1, second)
+        self.assertEqual(('code', 'IF_LEFT:right', 'redeem'), self.index[first][1])
+
+    def test_attribute(self):
+        first, second = self.locate('SHA256', 'redeem')
+        trace = [
+            {'location': 42, 'gas': '1039900'},
+            {'location': first, 'gas': '1039899.5'},
+            {'location': second, 'gas': '1039899'},
+            {'location': first, 'gas': 'unaccounted'},
+        ]
+        report = attribute(trace, self.index, gas_limit=1040000)
+
+        self.assertEqual(100, report[(STARTUP_FRAME,)])
+        self.assertEqual({
+            ('code', 'IF_LEFT:right', 'redeem', f'SHA256@{first}'): 0.5,
+            ('code', 'IF_LEFT:right', 'redeem', f'SHA256@{second}'): 0.5,
+        }, {k: float(v) for k, v in report.items() if k != (STARTUP_FRAME,)})
+        self.assertEqual(
+            f'redeem;[startup] 100000\n'
+            f'redeem;code;IF_LEFT:right;redeem;SHA256@{first} 500\n'
+            f'redeem;code;IF_LEFT:right;redeem;SHA256@{second} 500\n',
+            folded(report, root='redeem'))
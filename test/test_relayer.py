@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+from unittest import TestCase
+
+from pytezos.rpc.node import RpcError, RpcNotFoundError
+
+from atomex.metrics import gas_used
+from atomex.relayer import Relayer
+from atomex.vaults import TEZ_VAULT, hash_secret
+from conftest import StandInClient, hashed_secret, make_mempool, party, secret, source, vault_address
+
+
+class FailingBigMap:
+    """Big map whose lookups raise the given errors in turn"""
+
+    def __init__(self, errors):
+        self.errors = errors
+
+    def __getitem__(self, key):
+        def lookup():
+            raise self.errors.pop(0)
+        return lookup
+
+
+class RelayerTest(TestCase):
+
+    def test_hash_secret(self):
+        self.assertEqual(hashed_secret, hash_secret(secret))
+
+    def test_track_included(self):
+        redeem = {'kind': 'transaction', 'destination': vault_address,
+                  'parameters': {'entrypoint': 'redeem', 'value': {'bytes': secret.hex()}},
+                  'metadata': {'operation_result': {'status': 'applied', 'consumed_milligas': '3000000'}}}
+        blocks = [[], [{'hash': 'oo1', 'contents': [redeem]}, {'hash': 'oo2', 'contents': [redeem]}]]
+        head = SimpleNamespace(operations=SimpleNamespace(managers=lambda: blocks.pop(0)))
+        client = SimpleNamespace(contract=lambda address: None, shell=SimpleNamespace(blocks=SimpleNamespace(head=head)))
+        relayer = Relayer(client, {TEZ_VAULT: vault_address})
+        relayer._injected['oo1'] = 5
+
+        count = gas_used.count(vault=TEZ_VAULT, entrypoint='redeem')
+        relayer.track_included()
+        self.assertEqual({'oo1': 4}, relayer._injected)
+        relayer.track_included()
+        self.assertEqual({}, relayer._injected)
+        self.assertEqual(count + 1, gas_used.count(vault=TEZ_VAULT, entrypoint='redeem'))
+
+    def test_find_swaps_keeps_secret_on_node_error(self):
+        swaps = FailingBigMap([RpcError('503 Service Unavailable'), RpcNotFoundError('Not found')])
+        client = SimpleNamespace(contract=lambda address: SimpleNamespace(storage=[swaps]))
+        relayer = Relayer(client, {TEZ_VAULT: vault_address}, clock=lambda: 0)
+        relayer.add_secret(secret)
+
+        # A failing node says nothing about the swap, only a missing key does
+        self.assertEqual([], relayer.find_swaps())
+        self.assertEqual({hashed_secret: secret}, relayer.secrets)
+        self.assertEqual([], relayer.find_swaps())
+        self.assertEqual({}, relayer.secrets)
+
+    def test_step(self):
+        state = {'initiator': source, 'participant': party, 'amount': 980000, 'refund_time': 6 * 3600,
+                 'payoff': 20000, 'bounty': 0}
+        storage = [{hashed_secret: lambda: state}]
+
+        client = StandInClient(storage)
+        relayer = Relayer(client, {TEZ_VAULT: vault_address}, clock=lambda: 0)
+        relayer.add_secret(secret)
+        self.assertIsNotNone(relayer.step())
+        self.assertEqual([[('redeem', secret)]], client.sent)
+
+        # Already being redeemed by somebody else, or not paying for its fee
+        for client in (StandInClient(storage, make_mempool('redeem', secret)), StandInClient(storage, fee=30000)):
+            relayer = Relayer(client, {TEZ_VAULT: vault_address}, clock=lambda: 0)
+            relayer.add_secret(secret)
+            self.assertIsNone(relayer.step())
+            self.assertEqual([], client.sent)
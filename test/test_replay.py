@@ -0,0 +1,99 @@
+from os.path import dirname, join
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pytezos import ContractInterface
+
+from atomex.replay import init_worker, replay, replay_all, summarize
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+secret = 'dca15ce0c01f61ab03139b4673f4bd902203dc3b898a89a5d35bad794e5cfd4f'
+hashed_secret = bytes.fromhex('05bce5c12071fbca95b13d49cb5ef45323e0216d618bb4575c519b74be75e3da')
+project_dir = dirname(dirname(__file__))
+tez_vault = join(project_dir, 'contracts/tezos/tez_vault.tz')
+
+
+class ReplayTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.atomex = ContractInterface.from_file(tez_vault)
+        storage = cls.atomex.storage.encode([{
+            hashed_secret: {
+                'initiator': source,
+                'participant': party,
+                'amount': 980000,
+                'refund_time': 60,
+                'payoff': 20000,
+                'bounty': 0
+            }
+        }, None])
+        cls.calls = [
+            {
+                'vault': 'tez_vault',
+                'entrypoint': 'redeem',
+                'parameter': cls.atomex.redeem(secret).parameters['value'],
+                'storage': storage,
+                'source': source,
+                'amount': 0,
+                'timestamp': 0,
+            },
+            {
+                'vault': 'tez_vault',
+                'entrypoint': 'refund',
+                'parameter': cls.atomex.refund(hashed_secret).parameters['value'],
+                'storage': storage,
+                'source': source,
+                'amount': 0,
+                'timestamp': 0,
+            },
+        ]
+        cls.tmp = TemporaryDirectory()
+        cls.candidate = join(cls.tmp.name, 'tez_vault.tz')
+        with open(tez_vault) as src, open(cls.candidate, 'w') as dst:
+            dst.write(src.read().replace('"refund_time has not come"', '"too early"'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_replay_same_build(self):
+        init_worker({}, current={'tez_vault': tez_vault})
+        report = replay(self.calls[0])
+
+        self.assertEqual([], report['divergence'])
+        self.assertIsNone(report['error'])
+        self.assertLess(report['big_map_delta_current'], 0)
+        self.assertEqual(0, report['big_map_delta_diff'])
+        self.assertIsNone(report['gas_current'])
+        self.assertGreater(report['steps_current'], 0)
+        self.assertEqual(0, report['steps_diff'])
+
+    def test_replay_divergence(self):
+        init_worker({'tez_vault': self.candidate}, current={'tez_vault': tez_vault})
+        self.assertEqual([], replay(self.calls[0])['divergence'])
+        report = replay(self.calls[1])
+        self.assertEqual(['error'], report['divergence'])
+        self.assertEqual("FAILWITH: 'refund_time has not come'", report['error'])
+
+    def test_replay_unknown_errors(self):
+        # Failures outside of the known vault messages are compared by value too
+        current = join(self.tmp.name, 'current.tz')
+        with open(tez_vault) as src, open(current, 'w') as dst:
+            dst.write(src.read().replace('"refund_time has not come"', '"not yet"'))
+        init_worker({'tez_vault': self.candidate}, current={'tez_vault': current})
+        report = replay(self.calls[1])
+        self.assertEqual(['error'], report['divergence'])
+        self.assertEqual("FAILWITH: 'not yet'", report['error'])
+
+    def test_replay_all(self):
+        reports = list(replay_all(self.calls * 4, {'tez_vault': self.candidate},
+                                  current={'tez_vault': tez_vault}, workers=2, chunksize=1))
+        self.assertEqual(8, len(reports))
+        self.assertEqual({
+            'tez_vault%redeem': {'calls': 4, 'diverged': 0, 'gas_diff': 0, 'steps_diff': 0,
+                                 'big_map_delta_diff': 0},
+            'tez_vault%refund': {'calls': 4, 'diverged': 4, 'gas_diff': 0, 'steps_diff': 0,
+                                 'big_map_delta_diff': 0},
+        }, summarize(reports))
@@ -0,0 +1,128 @@
+import json
+from os import urandom
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Lock
+from unittest import TestCase
+
+from atomex.ethereum import TOPICS, EthereumRpcError, topic
+from atomex.scanner import Checkpoint, Scanner, build_filters, decode_log
+
+eth_vault = '0x00000000000000000000000000000000000000e1'
+erc20_vault = '0x00000000000000000000000000000000000000e2'
+token = '0x00000000000000000000000000000000000000f1'
+initiator = '0x00000000000000000000000000000000000000a1'
+participant = '0x00000000000000000000000000000000000000b2'
+
+
+def make_log(block, index, address, topics, data=()):
+    return {
+        'blockNumber': hex(block),
+        'logIndex': hex(index),
+        'address': address,
+        'transactionHash': '0x' + urandom(32).hex(),
+        'topics': topics,
+        'data': '0x' + ''.join(topic(value, abi_type)[2:] for value, abi_type in data),
+    }
+
+
+def initiated(block, hashed_secret, vault=eth_vault, to=participant):
+    data = [(initiator, 'address'), (1000, 'uint256'), (0, 'uint256'), (10 ** 18, 'uint256'),
+            (10, 'uint256'), (True, 'bool')]
+    if vault == erc20_vault:
+        topics = [TOPICS['Erc20Initiated'], topic(hashed_secret, 'bytes32'), topic(token, 'address'), topic(to, 'address')]
+    else:
+        topics = [TOPICS['Initiated'], topic(hashed_secret, 'bytes32'), topic(to, 'address')]
+    return make_log(block, 0, vault, topics, data)
+
+
+def redeemed(block, hashed_secret, secret, vault=eth_vault):
+    return make_log(block, 1, vault, [TOPICS['Redeemed'], topic(hashed_secret, 'bytes32')], [(secret, 'bytes32')])
+
+
+class StandInNode:
+    """Serves eth_getLogs like a node limiting the number of logs per response"""
+
+    def __init__(self, logs, max_results=3):
+        self.logs = logs
+        self.max_results = max_results
+        self.ranges = []
+        self._lock = Lock()
+
+    def call(self, method, params):
+        assert method == 'eth_getLogs'
+        start, end = int(params['fromBlock'], 16), int(params['toBlock'], 16)
+        with self._lock:
+            self.ranges.append((start, end))
+        result = []
+        for log in self.logs:
+            if not start <= int(log['blockNumber'], 16) <= end or log['address'] not in params['address']:
+                continue
+            expected = params['topics'] + [None] * (len(log['topics']) - len(params['topics']))
+            if all(t is None or (value in t if isinstance(t, list) else value == t)
+                   for t, value in zip(expected, log['topics'])):
+                result.append(log)
+        if len(result) > self.max_results:
+            raise EthereumRpcError({'code': -32005, 'message': 'query returned more than 3 results'})
+        return result
+
+
+class ScannerTest(TestCase):
+
+    def setUp(self):
+        self.secrets = [urandom(32) for _ in range(20)]
+        self.hashes = [urandom(32) for _ in range(20)]
+        self.logs = []
+        for i, (hashed_secret, secret) in enumerate(zip(self.hashes, self.secrets)):
+            vault = erc20_vault if i % 2 else eth_vault
+            self.logs.append(initiated(10 * i, hashed_secret, vault))
+            self.logs.append(redeemed(10 * i + 5, hashed_secret, secret, vault))
+
+    def test_decode_log(self):
+        event = decode_log(initiated(7, self.hashes[0], erc20_vault))
+        self.assertEqual('Initiated', event.event)
+        self.assertEqual(7, event.block)
+        self.assertEqual(self.hashes[0], event.hashed_secret)
+        self.assertEqual(token, event.token)
+        self.assertEqual(participant, event.participant)
+        self.assertEqual(initiator, event.initiator)
+        self.assertEqual((1000, 10 ** 18, 10, True), (event.refund_timestamp, event.value, event.payoff, event.active))
+
+        event = decode_log(redeemed(8, self.hashes[0], self.secrets[0]))
+        self.assertEqual(('Redeemed', self.secrets[0]), (event.event, event.secret))
+        self.assertIsNone(decode_log(make_log(1, 0, eth_vault, ['0x' + '00' * 32])))
+
+    def test_split_large_ranges(self):
+        node = StandInNode(self.logs)
+        events = Scanner(node, build_filters([eth_vault, erc20_vault]), workers=4, chunk_size=1000).scan(0, 199)
+
+        self.assertEqual(40, len(events))
+        self.assertEqual(sorted((e.block, e.log_index) for e in events), [(e.block, e.log_index) for e in events])
+        self.assertIn((0, 199), node.ranges)
+        self.assertGreater(len(node.ranges), 1)
+
+    def test_filters(self):
+        node = StandInNode(self.logs, max_results=100)
+        filters = build_filters([eth_vault, erc20_vault], hashed_secrets=self.hashes[:2])
+        events = Scanner(node, filters).scan(0, 199)
+        self.assertEqual({'Initiated', 'Redeemed'}, {e.event for e in events})
+        self.assertEqual(set(self.hashes[:2]), {e.hashed_secret for e in events})
+
+        self.logs.append(initiated(3, urandom(32), erc20_vault, to=initiator))
+        filters = build_filters([eth_vault, erc20_vault], events=['Initiated'], participants=[initiator])
+        events = Scanner(node, filters).scan(0, 199)
+        self.assertEqual([(3, token)], [(e.block, e.token) for e in events])
+
+    def test_resume_from_checkpoint(self):
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'checkpoint.json')
+            node = StandInNode(self.logs, max_results=100)
+            scanner = Scanner(node, build_filters([eth_vault]), workers=2, chunk_size=50)
+            scanner.scan(0, 99, checkpoint=Checkpoint(path, 0))
+            with open(path) as f:
+                self.assertEqual({'block': 99}, json.load(f))
+
+            node.ranges.clear()
+            events = scanner.scan(0, 199, checkpoint=Checkpoint(path, 0))
+            self.assertTrue(all(start >= 100 for start, _ in node.ranges))
+            self.assertEqual(10, len(events))
@@ -4,6 +4,8 @@ from decimal import Decimal
 
 from pytezos import ContractInterface, MichelsonRuntimeError
 
+from atomex.views import run_view
+
 
 source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
 party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
@@ -26,7 +28,8 @@ class AtomexContractTest(TestCase):
             .initiate(participant=party,
                       hashed_secret=hashed_secret,
                       refund_time=6 * 3600,
-                      payoff=20000) \
+                      payoff=20000,
+                      bounty=0) \
             .with_amount(1000000) \
             .interpret(storage=empty_storage,
                        source=source,
@@ -38,18 +41,20 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': 980000,
                 'refund_time': 6 * 3600,
-                'payoff': 20000
+                'payoff': 20000,
+                'bounty': 0
             }
         }
         self.assertDictEqual(res_storage, res.storage[0])
-        self.assertEqual([], res.operations)
+        self.assertEqual(['initiated'], [op['tag'] for op in res.operations])
 
     def test_initiate_proxy(self):
         res = self.atomex \
             .initiate(participant=party,
                       hashed_secret=hashed_secret,
                       refund_time=6 * 3600,
-                      payoff=20000) \
+                      payoff=20000,
+                      bounty=0) \
             .with_amount(1000000) \
             .interpret(storage=empty_storage,
                        sender=proxy,
@@ -62,11 +67,12 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': 980000,
                 'refund_time': 6 * 3600,
-                'payoff': 20000
+                'payoff': 20000,
+                'bounty': 0
             }
         }
         self.assertDictEqual(res_storage, res.storage[0])
-        self.assertEqual([], res.operations)
+        self.assertEqual(['initiated'], [op['tag'] for op in res.operations])
 
     def test_initiate_same_secret(self):
         initial_storage = [{
@@ -75,7 +81,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 6 * 3600,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -84,7 +91,8 @@ class AtomexContractTest(TestCase):
                 .initiate(participant=party,
                           hashed_secret=hashed_secret,
                           refund_time=6 * 3600,
-                          payoff=Decimal('0.02')) \
+                          payoff=Decimal('0.02'),
+                          bounty=0) \
                 .with_amount(1000000) \
                 .interpret(storage=initial_storage,
                            source=source,
@@ -96,7 +104,8 @@ class AtomexContractTest(TestCase):
                 .initiate(participant=party,
                           hashed_secret=hashed_secret,
                           refund_time=6 * 3600,
-                          payoff=1100000) \
+                          payoff=1100000,
+                          bounty=0) \
                 .with_amount(1000000) \
                 .interpret(storage=empty_storage,
                            source=source,
@@ -108,7 +117,8 @@ class AtomexContractTest(TestCase):
                 .initiate(participant=party,
                           hashed_secret=hashed_secret,
                           refund_time=0,
-                          payoff=Decimal('0.01')) \
+                          payoff=Decimal('0.01'),
+                          bounty=0) \
                 .with_amount(1000000) \
                 .interpret(storage=empty_storage,
                            source=source,
@@ -120,7 +130,8 @@ class AtomexContractTest(TestCase):
                 .initiate(participant=party,
                           hashed_secret=hashed_secret,
                           refund_time=0,
-                          payoff=Decimal('0.01')) \
+                          payoff=Decimal('0.01'),
+                          bounty=0) \
                 .with_amount(1000000) \
                 .interpret(storage=empty_storage,
                            source=party,
@@ -140,7 +151,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': 980000,
                 'refund_time': 6 * 3600,
-                'payoff': 20000
+                'payoff': 20000,
+                'bounty': 0
             }
         }, None]
 
@@ -160,7 +172,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 0,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -177,7 +190,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 60,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -186,7 +200,7 @@ class AtomexContractTest(TestCase):
             .interpret(storage=initial_storage, source=source, now=0)
 
         self.assertDictEqual({hashed_secret: None}, res.storage[0])
-        self.assertEqual(2, len(res.operations))
+        self.assertEqual(3, len(res.operations))
 
         redeem_tx = res.operations[0]
         self.assertEqual(party, redeem_tx['destination'])
@@ -203,7 +217,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 0,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -219,7 +234,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 60,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -235,7 +251,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 60,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -252,7 +269,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 0,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -261,7 +279,7 @@ class AtomexContractTest(TestCase):
             .interpret(storage=initial_storage, source=source, now=60)
 
         self.assertDictEqual({hashed_secret: None}, res.storage[0])
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
 
         refund_tx = res.operations[0]
         self.assertEqual(source, refund_tx['destination'])
@@ -274,7 +292,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 60,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -296,7 +315,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 0,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -313,7 +333,8 @@ class AtomexContractTest(TestCase):
                 'participant': party,
                 'amount': Decimal('0.98'),
                 'refund_time': 0,
-                'payoff': Decimal('0.02')
+                'payoff': Decimal('0.02'),
+                'bounty': 0
             }
         }, None]
 
@@ -322,8 +343,72 @@ class AtomexContractTest(TestCase):
             .interpret(storage=initial_storage, source=party, now=60)
 
         self.assertDictEqual({hashed_secret: None}, res.storage[0])
-        self.assertEqual(1, len(res.operations))
+        self.assertEqual(2, len(res.operations))
 
         refund_tx = res.operations[0]
         self.assertEqual(source, refund_tx['destination'])
         self.assertEqual('1000000', refund_tx['amount'])
+
+    def test_initiate_bounty_overflow(self):
+        with self.assertRaises(MichelsonRuntimeError):
+            self.atomex \
+                .initiate(participant=party,
+                          hashed_secret=hashed_secret,
+                          refund_time=6 * 3600,
+                          payoff=20000,
+                          bounty=1100000) \
+                .with_amount(1000000) \
+                .interpret(storage=empty_storage,
+                           source=source,
+                           now=0)
+
+    def test_refund_with_bounty(self):
+        initial_storage = [{
+            hashed_secret: {
+                'initiator': source,
+                'participant': party,
+                'amount': Decimal('0.98'),
+                'refund_time': 0,
+                'payoff': Decimal('0.02'),
+                'bounty': Decimal('0.005')
+            }
+        }, None]
+
+        res = self.atomex \
+            .refund(hashed_secret) \
+            .interpret(storage=initial_storage, source=proxy, now=60)
+
+        self.assertDictEqual({hashed_secret: None}, res.storage[0])
+        self.assertEqual(3, len(res.operations))
+
+        refund_tx = res.operations[0]
+        self.assertEqual(source, refund_tx['destination'])
+        self.assertEqual('995000', refund_tx['amount'])
+
+        bounty_tx = res.operations[1]
+        self.assertEqual(proxy, bounty_tx['destination'])
+        self.assertEqual('5000', bounty_tx['amount'])
+
+    def test_views(self):
+        swap = {
+            'initiator': source,
+            'participant': party,
+            'amount': 980000,
+            'refund_time': 6 * 3600,
+            'payoff': 20000,
+            'bounty': 0
+        }
+        initial_storage = [{hashed_secret: swap}, None]
+        unknown = bytes(32)
+
+        for offchain in (False, True):
+            self.assertEqual(swap, run_view('tez_vault', 'get_swap', hashed_secret, initial_storage, offchain))
+            self.assertIsNone(run_view('tez_vault', 'get_swap', unknown, initial_storage, offchain))
+            self.assertEqual({hashed_secret: swap},
+                             run_view('tez_vault', 'get_swaps', [hashed_secret, unknown], initial_storage, offchain))
+            self.assertTrue(run_view('tez_vault', 'is_redeemable',
+                                     {'hashed_secret': hashed_secret, 'now': 60}, initial_storage, offchain))
+            self.assertFalse(run_view('tez_vault', 'is_redeemable',
+                                      {'hashed_secret': hashed_secret, 'now': 6 * 3600}, initial_storage, offchain))
+            self.assertFalse(run_view('tez_vault', 'is_redeemable',
+                                      {'hashed_secret': unknown, 'now': 60}, initial_storage, offchain))
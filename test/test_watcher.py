@@ -0,0 +1,147 @@
+from collections import Counter
+from unittest import TestCase
+
+from atomex.events import VaultEvent
+from atomex.scanner import SwapEvent
+from atomex.vaults import FA12_VAULT, TEZ_VAULT, Swap
+from atomex.watcher import PREFIXES, RETENTION, Alert, Diff, Shard, Watcher, assign, ethereum_diffs, tezos_diffs
+
+source = 'tz1irF8HUsQp2dLhKNMhteG1qALNU9g3pfdN'
+party = 'tz1h3rQ8wBxFd8L9B3d7Jhaawu6Z568XU3xY'
+vault_address = 'KT1VG2WtYdSWz5E7chTeAdDPZNy2MpP8pTfL'
+secret = bytes.fromhex('dca15ce0c01f61ab03139b4673f4bd902203dc3b898a89a5d35bad794e5cfd4f')
+hashed_secret = bytes.fromhex('05bce5c12071fbca95b13d49cb5ef45323e0216d618bb4575c519b74be75e3da')
+
+
+def initiated(hashed_secret, chain='tezos', vault=TEZ_VAULT, refund_time=600):
+    swap = Swap(vault=vault, hashed_secret=hashed_secret, initiator=source, participant=party,
+                refund_time=refund_time, amount=1000)
+    return Diff(chain, vault, 'initiated', hashed_secret, 1, swap=swap)
+
+
+def redeemed(hashed_secret, chain='ethereum', vault='eth_vault'):
+    return Diff(chain, vault, 'redeemed', hashed_secret, 2, secret=secret)
+
+
+class AssignTest(TestCase):
+
+    def test_balanced(self):
+        owners = assign([None] * PREFIXES, [0, 1, 2])
+        self.assertEqual({0: 86, 1: 85, 2: 85}, Counter(owners))
+
+    def test_minimal_moves(self):
+        owners = assign([None] * PREFIXES, [0, 1, 2])
+        joined = assign(owners, [0, 1, 2, 3])
+        self.assertEqual({0: 64, 1: 64, 2: 64, 3: 64}, Counter(joined))
+        self.assertEqual(64, sum(old != new for old, new in zip(owners, joined)))
+
+        left = assign(joined, [0, 2, 3])
+        self.assertEqual(64, sum(old != new for old, new in zip(joined, left)))
+        self.assertTrue(all(old == new for old, new in zip(joined, left) if old != 1))
+
+        with self.assertRaises(ValueError):
+            assign(owners, [])
+
+
+class ShardTest(TestCase):
+
+    def test_redeemable_and_refundable(self):
+        shard = Shard(retention=0)
+        other = bytes([hashed_secret[0]]) + bytes(31)
+        shard.apply([initiated(hashed_secret), initiated(hashed_secret, 'ethereum', 'eth_vault'), initiated(other)])
+        self.assertEqual(([], []), shard.check(0))
+
+        shard.apply([redeemed(hashed_secret)])
+        self.assertEqual(([Alert('redeemable', 'tezos', TEZ_VAULT, hashed_secret, secret)], []), shard.check(0))
+        self.assertEqual(([], []), shard.check(1))
+
+        alerts, closed = shard.check(600)
+        self.assertEqual([Alert('refundable', 'tezos', TEZ_VAULT, hashed_secret),
+                          Alert('refundable', 'tezos', TEZ_VAULT, other)], alerts)
+
+        shard.apply([Diff('tezos', TEZ_VAULT, 'redeemed', hashed_secret, 3, secret=secret),
+                     Diff('tezos', TEZ_VAULT, 'refunded', other, 3)])
+        alerts, closed = shard.check(600)
+        self.assertEqual([], alerts)
+        self.assertEqual(sorted([hashed_secret, other]), sorted(closed))
+        self.assertEqual({}, shard.swaps)
+
+    def test_leg_reported_after_redeem(self):
+        # A backfill reads the redeem of the Tezos leg before the Ethereum leg is initiated
+        shard = Shard()
+        shard.apply([initiated(hashed_secret), Diff('tezos', TEZ_VAULT, 'redeemed', hashed_secret, 2, secret=secret)])
+        self.assertEqual(([], []), shard.check(0))
+
+        shard.apply([initiated(hashed_secret, 'ethereum', 'eth_vault')])
+        self.assertEqual(([Alert('redeemable', 'ethereum', 'eth_vault', hashed_secret, secret)], []), shard.check(1))
+
+        # Once the last leg is closed the secret is kept for the retention only
+        shard.apply([Diff('ethereum', 'eth_vault', 'redeemed', hashed_secret, 3, secret=secret)])
+        self.assertEqual(([], []), shard.check(2))
+        self.assertIn(hashed_secret, shard.secrets)
+        self.assertEqual(([], [hashed_secret]), shard.check(2 + RETENTION))
+        self.assertEqual(({}, {}), (shard.swaps, shard.secrets))
+
+    def test_added_and_drop(self):
+        shard = Shard()
+        shard.apply([initiated(hashed_secret), Diff('tezos', TEZ_VAULT, 'added', hashed_secret, 2, amount=2000)])
+        self.assertEqual(2000, shard.swaps[hashed_secret][('tezos', TEZ_VAULT)].amount)
+        shard.drop([hashed_secret[0] + 1])
+        self.assertIn(hashed_secret, shard.swaps)
+        shard.drop([hashed_secret[0]])
+        self.assertEqual({}, shard.swaps)
+
+
+class DiffsTest(TestCase):
+
+    def test_tezos(self):
+        state = {'initiator': source, 'participant': party, 'refundTime': 60, 'tokenAddress': vault_address,
+                 'totalAmount': 100, 'payoffAmount': 1, 'bountyAmount': 2}
+        events = [
+            VaultEvent(1, 'oo1', vault_address, 'initiated', hashed_secret, {'hashedSecret': hashed_secret, 'swap': state}),
+            VaultEvent(2, 'oo2', vault_address, 'added', hashed_secret, {'hashedSecret': hashed_secret, 'totalAmount': 150}),
+            VaultEvent(3, 'oo3', vault_address, 'redeemed', hashed_secret, {'hashedSecret': hashed_secret, 'secret': secret}),
+        ]
+        initiate, add, redeem = tezos_diffs(events, {vault_address: FA12_VAULT})
+        self.assertEqual((FA12_VAULT, 100, 2), (initiate.vault, initiate.swap.amount, initiate.swap.bounty))
+        self.assertEqual(150, add.amount)
+        self.assertEqual(secret, redeem.secret)
+
+    def test_ethereum(self):
+        events = [
+            SwapEvent(5, 0, '0xvault', 'Initiated', hashed_secret, participant='0xparty', initiator='0xinit',
+                      refund_timestamp=600, countdown=0, value=10 ** 18, payoff=10 ** 16),
+            SwapEvent(6, 0, '0xvault', 'Activated', hashed_secret),
+            SwapEvent(7, 0, '0xvault', 'Refunded', hashed_secret),
+        ]
+        initiate, refund = ethereum_diffs(events, {'0xvault': 'eth_vault'})
+        self.assertEqual(('ethereum', 'eth_vault', 600, 10 ** 18), (initiate.chain, initiate.vault,
+                                                                    initiate.swap.refund_time, initiate.swap.amount))
+        self.assertEqual('refunded', refund.tag)
+
+
+class WatcherTest(TestCase):
+
+    def test_workers(self):
+        hashed_secrets = [bytes([i]) + bytes(31) for i in range(0, PREFIXES, 16)]
+        with Watcher(2, retention=0) as watcher:
+            watcher.ingest([initiated(h, refund_time=100 + i) for i, h in enumerate(hashed_secrets)])
+            self.assertEqual([], watcher.check(0))
+            self.assertEqual({hashed_secrets[0]}, {alert.hashed_secret for alert in watcher.check(100)})
+
+            joined = watcher.join()
+            self.assertEqual(3, len(set(watcher.owners)))
+            self.assertEqual({hashed_secrets[1]}, {alert.hashed_secret for alert in watcher.check(101)})
+
+            watcher.leave(joined)
+            watcher.ingest([Diff('tezos', TEZ_VAULT, 'refunded', h, 2) for h in hashed_secrets[:2]])
+            watcher.check(101)
+            self.assertEqual(len(hashed_secrets) - 2, sum(map(len, watcher.journal)))
+
+            # A dead worker is replaced by replaying the journal of its prefixes
+            dead = watcher.owners[hashed_secrets[-1][0]]
+            watcher.workers[dead][0].kill()
+            watcher.workers[dead][0].join()
+            alerts = watcher.check(10 ** 6)
+            self.assertNotIn(dead, watcher.workers)
+            self.assertEqual(set(hashed_secrets[2:]), {alert.hashed_secret for alert in alerts})